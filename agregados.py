@@ -0,0 +1,305 @@
+"""
+Agregadores en streaming con memoria constante y combinables (merge).
+
+Sirven para acumular millones de ensayos o barridos del catálogo entero sin guardar
+cada resultado: cada bloque o proceso acumula lo suyo y al final se combinan con
+`merge`, con el mismo resultado que si se hubiera acumulado todo en uno.
+
+- Momentos: n, media, varianza (Welford / Chan), mínimo y máximo.
+- Histograma: bins fijos entre [minimo, maximo) más contadores de desbordamiento.
+- SketchCuantiles: cuantiles con error relativo acotado (estilo DDSketch) para
+  magnitudes sin cota conocida, como el daño.
+- Distribucion: momentos más histograma o sketch de una misma magnitud.
+- AgregadoCombate: todo lo que se resume de una serie de combates.
+"""
+
+import math
+from typing import Any, Dict, Optional, Tuple
+
+
+class Momentos:
+    """Media y varianza en streaming (Welford), combinables con el algoritmo de Chan."""
+
+    def __init__(self):
+        self.n = 0
+        self.media = 0.0
+        self._m2 = 0.0
+        self.minimo = math.inf
+        self.maximo = -math.inf
+
+    def add(self, x: float) -> None:
+        self.n += 1
+        delta = x - self.media
+        self.media += delta / self.n
+        self._m2 += delta * (x - self.media)
+        if x < self.minimo:
+            self.minimo = x
+        if x > self.maximo:
+            self.maximo = x
+
+    def merge(self, otro: "Momentos") -> "Momentos":
+        if otro.n == 0:
+            return self
+        if self.n == 0:
+            self.n, self.media, self._m2 = otro.n, otro.media, otro._m2
+            self.minimo, self.maximo = otro.minimo, otro.maximo
+            return self
+        n = self.n + otro.n
+        delta = otro.media - self.media
+        self.media += delta * otro.n / n
+        self._m2 += otro._m2 + delta * delta * self.n * otro.n / n
+        self.n = n
+        self.minimo = min(self.minimo, otro.minimo)
+        self.maximo = max(self.maximo, otro.maximo)
+        return self
+
+    @property
+    def varianza(self) -> float:
+        return self._m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    def semiancho(self, z: float) -> float:
+        """Semiancho del intervalo de confianza de la media (infinito con menos de 2 datos)."""
+        if self.n < 2:
+            return math.inf
+        return z * math.sqrt(self.varianza / self.n)
+
+    def intervalo(self, z: float, minimo: Optional[float] = None,
+                  maximo: Optional[float] = None) -> Tuple[Optional[float], Optional[float]]:
+        """
+        (inferior, superior) del intervalo de confianza de la media, recortado a
+        [minimo, maximo] si se dan (p. ej. [0, 1] para una proporción). Con menos de 2
+        datos no hay intervalo: (None, None), que sí es JSON válido.
+        """
+        if self.n < 2:
+            return None, None
+        h = self.semiancho(z)
+        inf, sup = self.media - h, self.media + h
+        if minimo is not None:
+            inf = max(minimo, inf)
+        if maximo is not None:
+            sup = min(maximo, sup)
+        return inf, sup
+
+
+class Histograma:
+    """Histograma de bins fijos; lo que cae fuera se cuenta en `bajo` / `alto`."""
+
+    def __init__(self, minimo: float, maximo: float, bins: int):
+        if bins < 1 or maximo <= minimo:
+            raise ValueError("Histograma: se necesita maximo > minimo y al menos un bin")
+        self.minimo = float(minimo)
+        self.maximo = float(maximo)
+        self.bins = int(bins)
+        self._ancho = (self.maximo - self.minimo) / self.bins
+        self.conteos = [0] * self.bins
+        self.bajo = 0
+        self.alto = 0
+
+    @property
+    def n(self) -> int:
+        return sum(self.conteos) + self.bajo + self.alto
+
+    def add(self, x: float) -> None:
+        if x < self.minimo:
+            self.bajo += 1
+        elif x >= self.maximo:
+            self.alto += 1
+        else:
+            self.conteos[min(self.bins - 1, int((x - self.minimo) / self._ancho))] += 1
+
+    def merge(self, otro: "Histograma") -> "Histograma":
+        if (otro.minimo, otro.maximo, otro.bins) != (self.minimo, self.maximo, self.bins):
+            raise ValueError("Histograma: solo se combinan histogramas con los mismos bins")
+        self.conteos = [a + b for a, b in zip(self.conteos, otro.conteos)]
+        self.bajo += otro.bajo
+        self.alto += otro.alto
+        return self
+
+    def cuantil(self, q: float) -> float:
+        """Cuantil aproximado, interpolando dentro del bin."""
+        n = self.n
+        if n == 0:
+            return math.nan
+        objetivo = q * n
+        acumulado = self.bajo
+        if objetivo < acumulado:
+            return self.minimo
+        for i, c in enumerate(self.conteos):
+            if c and objetivo < acumulado + c:
+                return self.minimo + (i + (objetivo - acumulado) / c) * self._ancho
+            acumulado += c
+        return self.maximo
+
+    def a_dict(self) -> Dict[str, Any]:
+        return {"min": self.minimo, "max": self.maximo, "conteos": list(self.conteos),
+                "bajo": self.bajo, "alto": self.alto}
+
+
+class SketchCuantiles:
+    """
+    Cuantiles con error relativo `alfa` en buckets logarítmicos (como DDSketch).
+    Admite valores >= 0 (los menores que `minimo_positivo` cuentan como cero). Si se
+    superan `max_buckets` se fusionan los más bajos: la cola alta mantiene la precisión.
+    """
+
+    def __init__(self, alfa: float = 0.01, max_buckets: int = 2048, minimo_positivo: float = 1e-9):
+        self.alfa = alfa
+        self.max_buckets = max_buckets
+        self.minimo_positivo = minimo_positivo
+        self._gamma = (1 + alfa) / (1 - alfa)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets: Dict[int, int] = {}
+        self.ceros = 0
+        self.n = 0
+
+    def add(self, x: float) -> None:
+        self.n += 1
+        if x < self.minimo_positivo:
+            self.ceros += 1
+            return
+        k = math.ceil(math.log(x) / self._log_gamma)
+        self.buckets[k] = self.buckets.get(k, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            self._colapsar()
+
+    def _colapsar(self) -> None:
+        claves = sorted(self.buckets)
+        sobran = len(claves) - self.max_buckets
+        destino = claves[sobran]
+        for k in claves[:sobran]:
+            self.buckets[destino] += self.buckets.pop(k)
+
+    def merge(self, otro: "SketchCuantiles") -> "SketchCuantiles":
+        if otro.alfa != self.alfa:
+            raise ValueError("SketchCuantiles: solo se combinan sketches con la misma precisión")
+        for k, c in otro.buckets.items():
+            self.buckets[k] = self.buckets.get(k, 0) + c
+        self.ceros += otro.ceros
+        self.n += otro.n
+        if len(self.buckets) > self.max_buckets:
+            self._colapsar()
+        return self
+
+    def cuantil(self, q: float) -> float:
+        if self.n == 0:
+            return math.nan
+        rango = q * (self.n - 1)
+        acumulado = self.ceros
+        if rango < acumulado:
+            return 0.0
+        for k in sorted(self.buckets):
+            acumulado += self.buckets[k]
+            if rango < acumulado:
+                return 2 * self._gamma ** k / (self._gamma + 1)
+        return 2 * self._gamma ** max(self.buckets) / (self._gamma + 1)
+
+
+CUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+class Distribucion:
+    """
+    Momentos más la forma de la distribución: histograma de bins fijos si se conocen
+    las cotas o, si no, un sketch de cuantiles.
+    """
+
+    def __init__(self, minimo: Optional[float] = None, maximo: Optional[float] = None,
+                 bins: Optional[int] = None):
+        self.momentos = Momentos()
+        self.histograma = Histograma(minimo, maximo, bins) if bins else None
+        self.sketch = SketchCuantiles() if self.histograma is None else None
+
+    @classmethod
+    def enteros(cls, maximo: int) -> "Distribucion":
+        """Para conteos 0..maximo: un bin por valor, cuantiles exactos."""
+        return cls(0, maximo + 1, maximo + 1)
+
+    def add(self, x: float) -> None:
+        self.momentos.add(x)
+        if self.histograma is not None:
+            self.histograma.add(x)
+        else:
+            self.sketch.add(x)
+
+    def merge(self, otro: "Distribucion") -> "Distribucion":
+        self.momentos.merge(otro.momentos)
+        if self.histograma is not None:
+            self.histograma.merge(otro.histograma)
+        else:
+            self.sketch.merge(otro.sketch)
+        return self
+
+    def cuantil(self, q: float) -> float:
+        if self.histograma is not None:
+            # Bins de ancho 1 empezando en un entero: el suelo es el valor exacto
+            return math.floor(self.histograma.cuantil(q))
+        return round(self.sketch.cuantil(q), 2)
+
+    def resumen(self, z: Optional[float] = None) -> Dict[str, Any]:
+        m = self.momentos
+        out: Dict[str, Any] = {"media": m.media}
+        if z is not None:
+            out["ic_inf"], out["ic_sup"] = m.intervalo(z)
+        out["cuantiles"] = {f"p{int(q * 100):02d}": self.cuantil(q) for q in CUANTILES} if m.n else {}
+        if self.histograma is not None:
+            out["histograma"] = list(self.histograma.conteos)
+        return out
+
+
+class AgregadoCombate:
+    """
+    Resumen combinable de una serie de combates (ensayos Monte Carlo o filas de un
+    lote): victoria del atacante, supervivientes, rondas y daño causado por cada lado.
+    Con `max_minis_*` se guardan además histogramas exactos de supervivientes.
+    """
+
+    def __init__(self, max_rondas: int = 10, max_minis_atac: Optional[int] = None,
+                 max_minis_def: Optional[int] = None):
+        self.victoria = Momentos()
+        self.empates = 0
+        self.sup_atac = Distribucion.enteros(max_minis_atac) if max_minis_atac is not None else Distribucion()
+        self.sup_def = Distribucion.enteros(max_minis_def) if max_minis_def is not None else Distribucion()
+        self.rondas = Distribucion.enteros(max_rondas)
+        self.dano_atac = Distribucion()
+        self.dano_def = Distribucion()
+
+    @property
+    def n(self) -> int:
+        return self.victoria.n
+
+    def add(self, resultado: int, minis_atac: int, minis_def: int, rondas: int,
+            dano_atac: Optional[float] = None, dano_def: Optional[float] = None) -> None:
+        self.victoria.add(1.0 if resultado == 1 else 0.0)
+        if resultado == 0:
+            self.empates += 1
+        self.sup_atac.add(minis_atac)
+        self.sup_def.add(minis_def)
+        self.rondas.add(rondas)
+        if dano_atac is not None:
+            self.dano_atac.add(dano_atac)
+        if dano_def is not None:
+            self.dano_def.add(dano_def)
+
+    def merge(self, otro: "AgregadoCombate") -> "AgregadoCombate":
+        self.victoria.merge(otro.victoria)
+        self.empates += otro.empates
+        for nombre in ("sup_atac", "sup_def", "rondas", "dano_atac", "dano_def"):
+            getattr(self, nombre).merge(getattr(otro, nombre))
+        return self
+
+    def resumen(self, z: float) -> Dict[str, Any]:
+        v = self.victoria
+        ic_inf, ic_sup = v.intervalo(z, 0.0, 1.0)
+        out: Dict[str, Any] = {
+            "ensayos": v.n,
+            "victoria_atacante": {"media": v.media, "ic_inf": ic_inf, "ic_sup": ic_sup},
+            "supervivientes_atacante": self.sup_atac.resumen(z),
+            "supervivientes_defensor": self.sup_def.resumen(z),
+            "empates": self.empates,
+            "rondas": self.rondas.resumen(),
+        }
+        if self.dano_atac.momentos.n:
+            out["dano_atacante"] = self.dano_atac.resumen()
+            out["dano_defensor"] = self.dano_def.resumen()
+        return out
+
@@ -0,0 +1,375 @@
+"""
+Reparto de los ataques de una unidad entre varias unidades enemigas.
+
+Cada arma de cada miniatura puede apuntar a un objetivo distinto. Para cada arma y
+objetivo se precalcula la distribución exacta del daño de una miniatura (dados de
+ataques, impactar, herir, salvación, ward, críticos y dados de daño, con las mismas
+reglas que `montecarlo._tirar_ataques`) y de ahí la de k miniaturas por convolución.
+Las bajas esperadas de un objetivo son E[min(minis, daño // heridas)], que no es
+lineal: repartir bien importa cuando un objetivo se puede rematar.
+
+La búsqueda es una programación dinámica sobre los objetivos con el estado "miniaturas
+que quedan por asignar de cada arma", podando los repartos que ya sobran para
+eliminar un objetivo. Si hay muchas armas o miniaturas se asignan en bloques para que
+el número de estados quepa en MAX_ESTADOS. Antes se hace una búsqueda local que
+evalúa cada reparto directamente, sin tablas; el presupuesto de tiempo cubre esa
+búsqueda, las tablas y la programación dinámica, y si se agota se devuelve el mejor
+reparto encontrado hasta entonces (con `optimo` a False). Como mucho MAX_DEFENSORES
+objetivos.
+"""
+
+import math
+import time
+from functools import lru_cache
+from itertools import product
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from montecarlo import _minis_iniciales, _objetivo, compilar_armas
+from simulador import armas_de, combate_media_multiarmas
+
+MAX_ESTADOS = 100_000
+PRESUPUESTO_S = 0.5
+MAX_DEFENSORES = 6
+
+Distribucion = List[float]
+
+
+class _SinTiempo(Exception):
+    pass
+
+
+# --- Distribuciones de daño (truncadas: la masa por encima de `tope` se acumula en `tope`) ---
+
+def _convolucion(a: Distribucion, b: Distribucion, tope: int) -> Distribucion:
+    out = [0.0] * (tope + 1)
+    nb = len(b)
+    for i, pa in enumerate(a):
+        if pa == 0.0:
+            continue
+        n = min(nb, tope - i)
+        for j in range(n):
+            out[i + j] += pa * b[j]
+        if nb > n:
+            out[tope] += pa * sum(b[n:])
+    return out
+
+
+def _mezcla(pesos_y_dists: Sequence[Tuple[float, Distribucion]], tope: int) -> Distribucion:
+    out = [0.0] * (tope + 1)
+    for peso, d in pesos_y_dists:
+        for i, p in enumerate(d):
+            out[i] += peso * p
+    return out
+
+
+def _delta(tope: int, valor: int = 0) -> Distribucion:
+    d = [0.0] * (tope + 1)
+    d[min(max(valor, 0), tope)] = 1.0
+    return d
+
+
+def _formula(terminos: List[Tuple[int, int, int]], tope: int) -> Distribucion:
+    """Distribución del resultado de una fórmula de dados, recortada a [0, tope]."""
+    valores = {0: 1.0}
+    for signo, n, caras in terminos:
+        pasos = [(signo * n, 1.0)] if not caras else None
+        for _ in range(1 if pasos else n):
+            dado = pasos or [(signo * c, 1.0 / caras) for c in range(1, caras + 1)]
+            nuevo: Dict[int, float] = {}
+            for v, p in valores.items():
+                for dv, dp in dado:
+                    nuevo[v + dv] = nuevo.get(v + dv, 0.0) + p * dp
+            valores = nuevo
+    out = [0.0] * (tope + 1)
+    for v, p in valores.items():
+        out[min(max(v, 0), tope)] += p
+    return out
+
+
+def _p_supera(objetivo: int) -> float:
+    return (7 - objetivo) / 6.0
+
+
+def _dist_ataque(arma: tuple, defensor: Dict[str, Any], tope: int) -> Distribucion:
+    """Daño de UN ataque del arma (tupla de `compilar_armas`) contra el defensor."""
+    _, to_hit, to_wound, rend, dano, crit, crit_valor = arma
+    save = int(defensor.get("save", 7) or 7)
+    ward = int(defensor.get("ward_save", 0) or 0)
+    p_ward = _p_supera(_objetivo(ward)) if ward > 0 else 0.0
+    pasa = (1.0 - _p_supera(_objetivo(save + rend))) * (1.0 - p_ward)
+    cero = _delta(tope)
+    herida = _mezcla([(1.0 - pasa, cero), (pasa, _formula(dano, tope))], tope)
+    p_herir = _p_supera(to_wound)
+    impacto = _mezcla([(1.0 - p_herir, cero), (p_herir, herida)], tope)
+    resultados = []
+    for tirada in range(1, 7):
+        if tirada == 6 and crit == "auto_wound":
+            resultados.append((1.0 / 6.0, herida))
+            continue
+        r = impacto if tirada >= to_hit else cero
+        if tirada == 6 and crit == "impactos_dobles" and tirada >= to_hit:
+            r = _convolucion(impacto, impacto, tope)
+        if tirada == 6 and crit == "mortal_wounds":
+            # Cada herida mortal tira ward por separado: binomial(crit_valor, 1 - p_ward)
+            mortales = [math.comb(crit_valor, k) * (1 - p_ward) ** k * p_ward ** (crit_valor - k)
+                        for k in range(crit_valor + 1)]
+            r = _convolucion(r, mortales, tope)
+        resultados.append((1.0 / 6.0, r))
+    return _mezcla(resultados, tope)
+
+
+class _Potencias:
+    """Daño de m miniaturas con un arma: potencias de convolución memoizadas."""
+
+    def __init__(self, por_mini: Distribucion, tope: int):
+        self.tope = tope
+        self._cache = {0: _delta(tope), 1: por_mini}
+
+    def __call__(self, m: int) -> Distribucion:
+        d = self._cache.get(m)
+        if d is None:
+            d = _convolucion(self(m // 2), self(m - m // 2), self.tope)
+            self._cache[m] = d
+        return d
+
+
+def _dist_miniatura(arma: tuple, ataque: Distribucion, tope: int) -> Distribucion:
+    """Daño de una miniatura: mezcla por el número de ataques (que puede ser una tirada)."""
+    n_ataques = _formula(arma[0], max(1, sum(n * (c or 1) for s, n, c in arma[0] if s > 0)))
+    pot = _Potencias(ataque, tope)
+    return _mezcla([(p, pot(n)) for n, p in enumerate(n_ataques) if p], tope)
+
+
+# --- Tablas de bajas esperadas por objetivo --------------------------------------------
+
+def _esperanza_bajas(dist: Distribucion, bajas: List[int]) -> float:
+    return sum(p * b for p, b in zip(dist, bajas) if p)
+
+
+def _tabla_bajas(potencias: List[_Potencias], rejilla: List[int], bajas: List[int], tope: int,
+                 inicial: Distribucion, limite: float = math.inf) -> Dict[Tuple[int, ...], float]:
+    """
+    Bajas esperadas para cada combinación de miniaturas por arma de la rejilla. Se
+    recorre con convoluciones parciales por prefijo y la última arma se resuelve con un
+    producto escalar contra una tabla precalculada: O(L) por celda en vez de O(L²).
+    Lanza _SinTiempo si se pasa de `limite` (perf_counter).
+    """
+    ultima = potencias[-1]
+    g_ultima = []
+    for m in rejilla:
+        dm = ultima(m)
+        g_ultima.append([sum(dm[y] * bajas[min(x + y, tope)] for y in range(tope + 1) if dm[y])
+                         for x in range(tope + 1)])
+    tabla: Dict[Tuple[int, ...], float] = {}
+
+    def rec(w: int, parcial: Distribucion, prefijo: Tuple[int, ...]) -> None:
+        if time.perf_counter() > limite:
+            raise _SinTiempo()
+        if w == len(potencias) - 1:
+            for m, g in zip(rejilla, g_ultima):
+                tabla[prefijo + (m,)] = sum(p * gx for p, gx in zip(parcial, g) if p)
+            return
+        for m in rejilla:
+            rec(w + 1, _convolucion(parcial, potencias[w](m), tope), prefijo + (m,))
+
+    rec(0, inicial, ())
+    return tabla
+
+
+def _pasos(minis: int, n_armas: int, n_objetivos: int) -> int:
+    """Bloques por arma para que la programación dinámica quepa en MAX_ESTADOS."""
+    k = max(1, minis)
+    while k > 1:
+        # Con tres o más objetivos los estados intermedios son todos los restos posibles
+        por_arma = (k + 1) * (k + 2) / 2 if n_objetivos > 2 else k + 1
+        if por_arma ** n_armas <= MAX_ESTADOS:
+            break
+        k -= 1
+    return k
+
+
+def optimizar_reparto(atacante_u: Dict[str, Any], defensores: List[Dict[str, Any]], carga: bool = False,
+                      presupuesto_s: float = PRESUPUESTO_S) -> Dict[str, Any]:
+    """
+    Mejor reparto de las miniaturas de cada arma del atacante entre los defensores
+    para maximizar las bajas esperadas en una ronda de combate.
+
+    Las unidades pueden traer `current_models` (si ya han sufrido bajas) y sus armas
+    ya resueltas en `armas`. Como referencia se incluyen las bajas de concentrar todo
+    en cada objetivo.
+    """
+    if len(defensores) > MAX_DEFENSORES:
+        raise ValueError(f"como mucho {MAX_DEFENSORES} defensores")
+    inicio = time.perf_counter()
+    limite = inicio + presupuesto_s
+    armas = armas_de(atacante_u)
+    if not armas or not defensores:
+        return {"asignacion": [], "bajas_totales": 0.0, "optimo": True, "bloque_miniaturas": 1,
+                "segundos": 0.0, "todo_a_uno": []}
+    compiladas = compilar_armas(atacante_u, armas, carga=carga)
+    minis = int(atacante_u.get("current_models") or _minis_iniciales(atacante_u))
+    campeon = bool(atacante_u.get("champion", False))
+    n_armas, n_obj = len(compiladas), len(defensores)
+
+    # Todos los objetivos menos el último reciben múltiplos de `paso`; el último, el resto
+    paso = max(1, math.ceil(minis / _pasos(minis, n_armas, n_obj)))
+    multiplos = list(range(0, minis + 1, paso))
+    complemento = [minis - m for m in multiplos]
+
+    por_defensor, maximos, todo_a_uno = [], [], []
+    for defensor in defensores:
+        minis_def = int(defensor.get("current_models") or _minis_iniciales(defensor))
+        heridas_def = max(1, int(defensor.get("wounds", 1)))
+        tope = minis_def * heridas_def
+        bajas = [min(minis_def, d // heridas_def) for d in range(tope + 1)]
+        ataques = [_dist_ataque(a, defensor, tope) for a in compiladas]
+        potencias = [_Potencias(_dist_miniatura(a, d, tope), tope) for a, d in zip(compiladas, ataques)]
+        por_defensor.append((potencias, ataques, bajas, tope))
+        maximos.append(float(minis_def))
+        todo = ataques[0] if campeon else _delta(tope)
+        for pot in potencias:
+            todo = _convolucion(todo, pot(minis), tope)
+        todo_a_uno.append({"defensor": defensor.get("name", ""), "bajas_esperadas": round(_esperanza_bajas(todo, bajas), 3)})
+
+    # Bajas de un reparto a un objetivo: de las tablas si ya están, si no calculadas y memorizadas
+    tablas: List[Optional[Dict[Tuple[int, ...], float]]] = [None] * n_obj
+    tablas_campeon: List[Optional[Dict[Tuple[int, ...], float]]] = [None] * n_obj
+    directas: Dict[Tuple[int, Tuple[int, ...], bool], float] = {}
+
+    def f(t: int, a: Tuple[int, ...], campeon_libre: bool) -> float:
+        # El ataque extra del campeón va con la primera arma, en el primer objetivo que la recibe
+        con_campeon = campeon_libre and a[0] > 0
+        tabla = (tablas_campeon if con_campeon else tablas)[t]
+        if tabla is not None:
+            return tabla[a]
+        valor = directas.get((t, a, con_campeon))
+        if valor is None:
+            potencias, ataques, bajas, tope = por_defensor[t]
+            dist = ataques[0] if con_campeon else _delta(tope)
+            for pot, m in zip(potencias, a):
+                dist = _convolucion(dist, pot(m), tope)
+            valor = directas[(t, a, con_campeon)] = _esperanza_bajas(dist, bajas)
+        return valor
+
+    def total(reparto: List[Tuple[int, ...]]) -> float:
+        campeon_libre = campeon
+        suma = 0.0
+        for t, a in enumerate(reparto):
+            suma += f(t, a, campeon_libre)
+            campeon_libre = campeon_libre and a[0] == 0
+        return suma
+
+    # Punto de partida: búsqueda local desde "todo al último objetivo", moviendo bloques
+    reparto = [tuple(0 for _ in range(n_armas))] * (n_obj - 1) + [tuple(minis for _ in range(n_armas))]
+    mejor = total(reparto)
+    optimo = True
+    try:
+        mejorado = True
+        while mejorado:
+            mejorado = False
+            for origen, destino, w in product(range(n_obj), range(n_obj), range(n_armas)):
+                if origen == destino or reparto[origen][w] < paso:
+                    continue
+                if time.perf_counter() > limite:
+                    raise _SinTiempo()
+                nuevo = list(reparto)
+                nuevo[origen] = tuple(v - paso if i == w else v for i, v in enumerate(reparto[origen]))
+                nuevo[destino] = tuple(v + paso if i == w else v for i, v in enumerate(reparto[destino]))
+                valor = total(nuevo)
+                if valor > mejor + 1e-9:
+                    reparto, mejor, mejorado = nuevo, valor, True
+
+        for t, (potencias, ataques, bajas, tope) in enumerate(por_defensor):
+            rejilla = complemento if t == n_obj - 1 else multiplos
+            tablas[t] = _tabla_bajas(potencias, rejilla, bajas, tope, _delta(tope), limite)
+            if campeon:
+                tablas_campeon[t] = _tabla_bajas(potencias, rejilla, bajas, tope, ataques[0], limite)
+        reparto_dp, valor_dp = _programacion_dinamica(f, n_obj, n_armas, minis, paso, campeon, maximos, limite)
+        if valor_dp >= mejor - 1e-9:
+            reparto, mejor = reparto_dp, valor_dp
+    except _SinTiempo:
+        optimo = False
+
+    asignacion = []
+    campeon_libre = campeon
+    for t, (defensor, a) in enumerate(zip(defensores, reparto)):
+        con_campeon = campeon_libre and a[0] > 0
+        campeon_libre = campeon_libre and a[0] == 0
+        if not any(a):
+            continue
+        usadas = [(arma, m) for arma, m in zip(armas, a) if m]
+        medias = _medias_por_arma(atacante_u, [arma for arma, _ in usadas], defensor, carga,
+                                  [m for _, m in usadas], con_campeon)
+        asignacion.append({
+            "defensor": defensor.get("name", ""),
+            "defensor_id": defensor.get("id", ""),
+            "armas": [{"arma": arma.get("name", "arma"), "miniaturas": m, "heridas_medias": round(h, 2)}
+                      for (arma, m), h in zip(usadas, medias)],
+            "campeon": con_campeon,
+            "bajas_esperadas": round(f(t, a, con_campeon), 3),
+            "minis_defensor": int(maximos[t]),
+        })
+
+    return {
+        "asignacion": asignacion,
+        "bajas_totales": round(mejor, 3),
+        "optimo": optimo,
+        "bloque_miniaturas": paso,
+        "segundos": round(time.perf_counter() - inicio, 4),
+        "todo_a_uno": todo_a_uno,
+    }
+
+
+def _medias_por_arma(atacante_u: Dict[str, Any], armas: List[Dict[str, Any]], defensor: Dict[str, Any],
+                     carga: bool, minis_por_arma: List[int], campeon: bool) -> List[float]:
+    """Heridas medias de cada arma con sus miniaturas asignadas, según el motor por medias."""
+    unidad = dict(atacante_u, armas=armas, champion=False)
+    _, detalle, _, _ = combate_media_multiarmas(unidad, defensor, carga=carga)
+    modelos = max(1, _minis_iniciales(unidad))
+    medias = []
+    for i, ((_, out), m) in enumerate(zip(detalle, minis_por_arma)):
+        # combate_media da el total de la unidad completa: se escala a las miniaturas asignadas
+        por_mini = out.get("total_heridas", 0.0) / modelos
+        extra = por_mini / out["attacks"] if campeon and i == 0 and out.get("attacks") else 0.0
+        medias.append(por_mini * m + extra)
+    return medias
+
+
+def _programacion_dinamica(f, n_obj: int, n_armas: int, minis: int, paso: int, campeon: bool,
+                           maximos: List[float], limite: float) -> Tuple[List[Tuple[int, ...]], float]:
+    """
+    V_t(r) = max_{a <= r} f_t(a) + V_{t+1}(r - a), con V_último(r) = f_último(r).
+    Se podan los `a` que ya eliminan el objetivo con un bloque menos de alguna arma:
+    dar más a un objetivo muerto nunca mejora.
+    """
+    completo = (minis,) * n_armas
+
+    @lru_cache(maxsize=None)
+    def v(t: int, r: Tuple[int, ...]) -> Tuple[float, Tuple[int, ...]]:
+        if time.perf_counter() > limite:
+            raise _SinTiempo()
+        # Nadie antes ha recibido miniaturas de la primera arma: el campeón sigue libre
+        campeon_libre = campeon and r[0] == minis
+        if t == n_obj - 1:
+            return f(t, r, campeon_libre), r
+        saturado = maximos[t] * (1 - 1e-9)
+        mejor, mejor_a = -1.0, r
+        for a in product(*(range(0, x + 1, paso) for x in r)):
+            propio = f(t, a, campeon_libre)
+            if propio >= saturado and any(
+                x >= paso and f(t, a[:w] + (x - paso,) + a[w + 1:], campeon_libre) >= saturado
+                for w, x in enumerate(a)
+            ):
+                continue
+            valor = propio + v(t + 1, tuple(x - y for x, y in zip(r, a)))[0]
+            if valor > mejor:
+                mejor, mejor_a = valor, a
+        return mejor, mejor_a
+
+    r = completo
+    reparto = []
+    for t in range(n_obj):
+        a = v(t, r)[1]
+        reparto.append(a)
+        r = tuple(x - y for x, y in zip(r, a))
+    return reparto, v(0, completo)[0]
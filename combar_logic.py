@@ -84,14 +84,16 @@ def _aplica_ward(defender: dict, heridas: float):
     return heridas * (1.0 - p_ward_ok)
 
 def combate_media(attacker: dict, defender: dict, carga: bool = False) -> dict:
-    """Calcula medias para UN perfil de arma (attacker) contra una unidad (defender)."""
+    """
+    Calcula medias para UN perfil de arma (attacker) contra una unidad (defender).
+
+    Los efectos de la carga (rend_on_charge, bonos) ya vienen aplicados en el perfil
+    por `simulador.construir_perfil_ataque`; `carga` se mantiene por compatibilidad.
+    """
 
     # rend total (normaliza: siempre negativo)
     rend_total = _to_int(attacker.get("rend", 0), 0)
     rend_total = -abs(rend_total)
-    if carga and attacker.get("rend_on_charge"):
-        roc = _to_int(attacker.get("rend_on_charge", 0), 0)
-        rend_total += -abs(roc)
 
     models, total_attacks, impactos_normales, auto_wounds, mortal_wounds = _impactos_promedio(attacker)
 
@@ -149,3 +151,43 @@ def combate_media(attacker: dict, defender: dict, carga: bool = False) -> dict:
         "total_heridas": total_heridas,
     }
 
+
+
+SALVACIONES = (2, 3, 4, 5, 6)
+WARDS = (None, 6, 5, 4)
+
+
+def rejilla_defensor(perfiles: list, saves=SALVACIONES, wards=WARDS, mods_rend=(0, 1)) -> dict:
+    """
+    Heridas medias de un conjunto de perfiles de arma contra toda la rejilla de
+    características del defensor: salvación x ward x modificador de rend.
+
+    Lo que no depende del defensor (impactos, heridas, mortales, daño) se calcula una
+    vez por arma; después cada celda es solo la probabilidad de fallar la salvación
+    y la ward, con los mismos criterios que `combate_media`.
+
+    Returns:
+        {"saves": [...], "wards": [...], "mods_rend": [...],
+         "heridas": [[[total por ward] por save] por mod_rend]}
+    """
+    # Por arma: (rend base, heridas que tiran salvación x daño, mortales)
+    agregados = []
+    for attacker in perfiles:
+        rend_total = -abs(_to_int(attacker.get("rend", 0), 0))
+        _models, _total, impactos_normales, auto_wounds, mortal_wounds = _impactos_promedio(attacker)
+        heridas = impactos_normales * _p_x_plus(_to_int(attacker.get("to_wound", 7), 7)) + auto_wounds
+        damage = _to_float(attacker.get("damage", 0.0), 0.0)
+        agregados.append((rend_total, heridas * damage, mortal_wounds))
+
+    mortales = sum(m for (_r, _h, m) in agregados)
+    p_fallo_ward = [1.0 - (_p_x_plus(w) if w and _to_int(w, 0) > 0 else 0.0) for w in wards]
+
+    rejilla = []
+    for mod in mods_rend:
+        filas = []
+        for save in saves:
+            # rend ya es negativo: cada punto de mod lo mejora en 1 para el atacante
+            normales = sum(h * (1.0 - _p_x_plus(save - min(0, rend - mod))) for (rend, h, _m) in agregados)
+            filas.append([(normales + mortales) * pw for pw in p_fallo_ward])
+        rejilla.append(filas)
+    return {"saves": list(saves), "wards": list(wards), "mods_rend": list(mods_rend), "heridas": rejilla}
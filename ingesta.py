@@ -0,0 +1,366 @@
+"""
+Carga masiva del catálogo (facciones, unidades y armas) desde JSON o CSV.
+
+    python ingesta.py seraphon.json otra_faccion.csv
+    python ingesta.py catalogo.json --validar          (solo valida, no escribe)
+
+Formatos admitidos:
+- JSON anidado: {"factions": [{"name", "units": [{"name", ..., "weapons": [{...}]}]}]}
+  (o directamente la lista de facciones).
+- CSV plano con una fila por arma: columnas `faction`, `unit`, `weapon` más las de la
+  unidad (base_size, wounds, save, ...) y las del arma (attacks_formula, to_hit, ...).
+  Los datos de la unidad se toman de su primera fila.
+
+Todo se valida antes de escribir nada (fórmulas de dados con `utils.parsear_formula`,
+rangos de tiradas, modificadores). Los ids son uuid5 deterministas derivados de los
+nombres, salvo que la fila traiga su propio `id`, así que volver a cargar el mismo
+fichero actualiza las filas en lugar de duplicarlas. Se escribe con upserts por lotes
+(facciones, luego unidades, luego armas).
+
+Tras escribir se avisa al índice de dependencias (services/dependencias.py): se borran
+los resultados cacheados que usaban las unidades o armas cambiadas y se encola su
+recálculo en la cola de trabajos (`--sin-recalcular` solo los borra).
+
+Cada fila se escribe solo con las columnas que trae: un campo opcional que falta en el
+fichero (rend_on_charge, crit_value, modificadores...) no borra el valor que ya hubiera
+en la base. `crit_effect`/`crit_value` a nivel de unidad son el valor por defecto de sus
+armas que no declaren el suyo.
+
+La columna `units.modificadores` no forma parte del esquema original; antes de cargar
+unidades con modificadores hay que crearla:
+
+    alter table units add column if not exists modificadores jsonb;
+
+Si falta, la carga se detiene antes de escribir nada.
+
+Las escrituras usan SUPABASE_SERVICE_KEY si está definida (la clave anónima no suele
+tener permiso de escritura).
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+TAM_LOTE = 1000
+TABLAS = ("factions", "units", "unit_weapons")
+
+# Espacio de nombres fijo: los ids no cambian entre cargas ni entre máquinas
+_NS = uuid.uuid5(uuid.NAMESPACE_URL, "https://aos-simulador/catalogo")
+
+CAMPOS_UNIDAD = ("base_size", "wounds", "save", "ward_save", "reinforced", "points", "img_url",
+                 "rend_on_charge", "crit_effect", "crit_value", "modificadores")
+CAMPOS_ARMA = ("attacks_formula", "to_hit", "to_wound", "rend", "damage_formula", "crit_effect", "crit_value")
+CRIT_EFFECTS = ("none", "mortal_wounds", "auto_wound", "impactos_dobles")
+
+
+class ErrorValidacion(ValueError):
+    """Errores de validación acumulados de toda la entrada."""
+
+    def __init__(self, errores: List[str]):
+        super().__init__(f"{len(errores)} errores de validación")
+        self.errores = errores
+
+
+def id_faccion(nombre: str) -> str:
+    return str(uuid.uuid5(_NS, f"faction:{nombre.strip().lower()}"))
+
+
+def id_unidad(faccion: str, nombre: str) -> str:
+    return str(uuid.uuid5(_NS, f"unit:{faccion.strip().lower()}/{nombre.strip().lower()}"))
+
+
+def id_arma(faccion: str, unidad: str, nombre: str) -> str:
+    return str(uuid.uuid5(_NS, f"weapon:{faccion.strip().lower()}/{unidad.strip().lower()}/{nombre.strip().lower()}"))
+
+
+def _vacio(v: Any) -> bool:
+    return v is None or (isinstance(v, str) and not v.strip())
+
+
+def _leer_json(ruta: str) -> List[dict]:
+    with open(ruta, encoding="utf-8") as f:
+        datos = json.load(f)
+    return datos.get("factions", []) if isinstance(datos, dict) else datos
+
+
+def _leer_csv(ruta: str) -> List[dict]:
+    """Reagrupa el CSV plano (una fila por arma) en la misma forma anidada que el JSON."""
+    facciones: Dict[str, dict] = {}
+    with open(ruta, encoding="utf-8", newline="") as f:
+        for fila in csv.DictReader(f):
+            fila = {k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in fila.items() if k}
+            nombre_f = fila.get("faction", "")
+            faccion = facciones.setdefault(nombre_f, {"name": nombre_f, "units": [], "_idx": {}})
+            nombre_u = fila.get("unit", "")
+            unidad = faccion["_idx"].get(nombre_u)
+            if unidad is None:
+                unidad = {"name": nombre_u, "weapons": []}
+                unidad.update({c: fila[c] for c in CAMPOS_UNIDAD if not _vacio(fila.get(c))})
+                if not _vacio(fila.get("unit_id")):
+                    unidad["id"] = fila["unit_id"]
+                faccion["_idx"][nombre_u] = unidad
+                faccion["units"].append(unidad)
+            if not _vacio(fila.get("weapon")):
+                arma = {"name": fila["weapon"]}
+                arma.update({c: fila[c] for c in CAMPOS_ARMA if not _vacio(fila.get(c))})
+                if not _vacio(fila.get("weapon_id")):
+                    arma["id"] = fila["weapon_id"]
+                unidad["weapons"].append(arma)
+    for faccion in facciones.values():
+        faccion.pop("_idx")
+    return list(facciones.values())
+
+
+def leer(ruta: str) -> List[dict]:
+    """Facciones anidadas (con sus unidades y armas) de un fichero .json o .csv."""
+    return _leer_csv(ruta) if ruta.lower().endswith(".csv") else _leer_json(ruta)
+
+
+def _entero(v: Any, campo: str, donde: str, errores: List[str], minimo: int = None, maximo: int = None,
+            opcional: bool = False) -> Optional[int]:
+    if _vacio(v):
+        if not opcional:
+            errores.append(f"{donde}: falta {campo}")
+        return None
+    try:
+        n = int(str(v).strip().rstrip("+"))
+    except ValueError:
+        errores.append(f"{donde}: {campo} no es un entero ({v!r})")
+        return None
+    if (minimo is not None and n < minimo) or (maximo is not None and n > maximo):
+        errores.append(f"{donde}: {campo}={n} fuera de rango [{minimo}, {maximo}]")
+    return n
+
+
+def _bool(v: Any) -> bool:
+    if isinstance(v, str):
+        return v.strip().lower() in ("1", "true", "si", "sí", "yes")
+    return bool(v)
+
+
+def _formula(v: Any, campo: str, donde: str, errores: List[str]) -> Optional[str]:
+    from utils import parsear_formula
+
+    if _vacio(v):
+        errores.append(f"{donde}: falta {campo}")
+        return None
+    try:
+        if not parsear_formula(v):
+            raise ValueError
+    except ValueError:
+        errores.append(f"{donde}: {campo} no es una fórmula de dados válida ({v!r})")
+        return None
+    return str(v).strip().replace(" ", "")
+
+
+def _crit(v: Any, donde: str, errores: List[str]) -> Optional[str]:
+    if _vacio(v):
+        return None
+    v = str(v).strip().lower()
+    if v not in CRIT_EFFECTS:
+        errores.append(f"{donde}: crit_effect desconocido ({v!r})")
+    return v
+
+
+def _modificadores(v: Any, donde: str, errores: List[str]) -> Optional[list]:
+    from modificadores import compilar
+
+    if _vacio(v):
+        return None
+    try:
+        mods = json.loads(v) if isinstance(v, str) else v
+        if not isinstance(mods, list):
+            raise ValueError("se esperaba una lista")
+        compilar(mods)
+    except (ValueError, TypeError, AttributeError) as e:
+        errores.append(f"{donde}: modificadores no válidos ({e})")
+        return None
+    return mods
+
+
+def normalizar(facciones: Iterable[dict]) -> Dict[str, List[dict]]:
+    """
+    Valida y convierte las facciones anidadas en filas por tabla, con ids deterministas.
+    Lanza ErrorValidacion con todos los problemas encontrados (no solo el primero).
+    """
+    filas: Dict[str, Dict[str, dict]] = {t: {} for t in TABLAS}
+    errores: List[str] = []
+    for i, faccion in enumerate(facciones):
+        nombre_f = str(faccion.get("name") or "").strip()
+        if not nombre_f:
+            errores.append(f"facción #{i + 1}: falta name")
+            continue
+        fid = str(faccion.get("id") or id_faccion(nombre_f))
+        filas["factions"][fid] = {"id": fid, "name": nombre_f}
+        for unidad in faccion.get("units", []):
+            nombre_u = str(unidad.get("name") or "").strip()
+            donde = f"{nombre_f} / {nombre_u or '?'}"
+            if not nombre_u:
+                errores.append(f"{donde}: unidad sin name")
+                continue
+            uid = str(unidad.get("id") or id_unidad(nombre_f, nombre_u))
+            fila_u = {
+                "id": uid, "faction_id": fid, "name": nombre_u,
+                "base_size": _entero(unidad.get("base_size"), "base_size", donde, errores, 1, 100),
+                "wounds": _entero(unidad.get("wounds"), "wounds", donde, errores, 1, 100),
+                "save": _entero(unidad.get("save"), "save", donde, errores, 2, 7),
+                "reinforced": _bool(unidad.get("reinforced", False)),
+                "points": _entero(unidad.get("points", 0), "points", donde, errores, 0, 10000),
+            }
+            ward = _entero(unidad.get("ward_save"), "ward_save", donde, errores, 2, 6, opcional=True)
+            if ward is not None:
+                fila_u["ward_save"] = ward
+            if not _vacio(unidad.get("img_url")):
+                fila_u["img_url"] = str(unidad["img_url"])
+            roc = _entero(unidad.get("rend_on_charge"), "rend_on_charge", donde, errores, -6, 6, opcional=True)
+            if roc is not None:
+                fila_u["rend_on_charge"] = roc
+            mods = _modificadores(unidad.get("modificadores"), donde, errores)
+            if mods is not None:
+                fila_u["modificadores"] = mods
+            # Crítico de la unidad: por defecto para las armas que no declaran el suyo
+            crit_u = _crit(unidad.get("crit_effect"), donde, errores)
+            crit_valor_u = _entero(unidad.get("crit_value"), "crit_value", donde, errores, 0, 20, opcional=True)
+            if uid in filas["units"]:
+                errores.append(f"{donde}: unidad duplicada")
+            filas["units"][uid] = fila_u
+            armas = unidad.get("weapons", [])
+            if not armas:
+                errores.append(f"{donde}: la unidad no tiene armas")
+            for arma in armas:
+                nombre_a = str(arma.get("name") or "").strip()
+                donde_a = f"{donde} / {nombre_a or '?'}"
+                if not nombre_a:
+                    errores.append(f"{donde_a}: arma sin name")
+                    continue
+                aid = str(arma.get("id") or id_arma(nombre_f, nombre_u, nombre_a))
+                fila_a = {
+                    "id": aid, "unit_id": uid, "name": nombre_a,
+                    "attacks_formula": _formula(arma.get("attacks_formula", arma.get("attacks")),
+                                                "attacks_formula", donde_a, errores),
+                    "to_hit": _entero(arma.get("to_hit"), "to_hit", donde_a, errores, 2, 7),
+                    "to_wound": _entero(arma.get("to_wound"), "to_wound", donde_a, errores, 2, 7),
+                    "rend": _entero(arma.get("rend", 0), "rend", donde_a, errores, -6, 6),
+                    "damage_formula": _formula(arma.get("damage_formula", arma.get("damage")),
+                                               "damage_formula", donde_a, errores),
+                    "crit_effect": _crit(arma.get("crit_effect"), donde_a, errores) or crit_u or "none",
+                }
+                if not _vacio(arma.get("crit_value")):
+                    fila_a["crit_value"] = _entero(arma.get("crit_value"), "crit_value", donde_a, errores, 0, 20)
+                elif crit_valor_u is not None and _vacio(arma.get("crit_effect")):
+                    fila_a["crit_value"] = crit_valor_u
+                if aid in filas["unit_weapons"]:
+                    errores.append(f"{donde_a}: arma duplicada")
+                filas["unit_weapons"][aid] = fila_a
+    if errores:
+        raise ErrorValidacion(errores)
+    return {t: list(v.values()) for t, v in filas.items()}
+
+
+def _lotes(filas: List[dict], tam: int) -> Iterable[List[dict]]:
+    for i in range(0, len(filas), tam):
+        yield filas[i:i + tam]
+
+
+def _client():
+    from supabase import create_client
+    from services.unidad_service import SUPABASE_KEY, SUPABASE_URL
+
+    return create_client(SUPABASE_URL, os.getenv("SUPABASE_SERVICE_KEY") or SUPABASE_KEY)
+
+
+def _por_columnas(filas: List[dict]) -> Dict[tuple, List[dict]]:
+    """Agrupa las filas por su conjunto de columnas (PostgREST exige el mismo en todo el lote)."""
+    grupos: Dict[tuple, List[dict]] = {}
+    for f in filas:
+        grupos.setdefault(tuple(sorted(f)), []).append(f)
+    return grupos
+
+
+def _comprobar_columnas(filas: Dict[str, List[dict]], cliente) -> None:
+    """Falla antes de escribir nada si el fichero usa columnas opcionales que la base no tiene."""
+    if any("modificadores" in f for f in filas["units"]):
+        try:
+            cliente.table("units").select("modificadores").limit(1).execute()
+        except Exception as e:
+            raise ErrorValidacion([
+                "la tabla units no tiene la columna 'modificadores' "
+                "(alter table units add column if not exists modificadores jsonb)"
+            ]) from e
+
+
+def subir(filas: Dict[str, List[dict]], tam_lote: int = TAM_LOTE, cliente=None) -> Dict[str, int]:
+    """
+    Upsert por lotes en orden de dependencia. Cada fila se envía solo con sus columnas,
+    así que lo que no trae el fichero no se pisa con NULL. Devuelve las filas escritas
+    por tabla.
+    """
+    cliente = cliente or _client()
+    _comprobar_columnas(filas, cliente)
+    escritas = {}
+    for tabla in TABLAS:
+        n = 0
+        for grupo in _por_columnas(filas[tabla]).values():
+            for lote in _lotes(grupo, tam_lote):
+                cliente.table(tabla).upsert(lote, on_conflict="id").execute()
+                n += len(lote)
+        escritas[tabla] = n
+    return escritas
+
+
+def avisar_cambios(filas: Dict[str, List[dict]], recalcular: bool = True) -> Dict[str, Any]:
+    """Invalida (y encola para recalcular) lo precalculado con las unidades escritas."""
+    from lotes import resolver_unidades
+    from services import dependencias
+
+    ids = {f["id"] for f in filas["units"]} | {f["unit_id"] for f in filas["unit_weapons"]}
+    return dependencias.actualizar(resolver_unidades(ids), recalcular_=recalcular)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Carga masiva del catálogo desde JSON o CSV")
+    parser.add_argument("ficheros", nargs="+", help="ficheros .json o .csv")
+    parser.add_argument("--validar", action="store_true", help="solo validar, sin escribir")
+    parser.add_argument("--lote", type=int, default=TAM_LOTE, help="filas por petición de upsert")
+    parser.add_argument("--sin-recalcular", action="store_true",
+                        help="borrar los resultados afectados sin encolar su recálculo")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    facciones: List[dict] = []
+    for ruta in args.ficheros:
+        facciones.extend(leer(ruta))
+    try:
+        filas = normalizar(facciones)
+    except ErrorValidacion as e:
+        for err in e.errores:
+            print(f"[ingesta] {err}", file=sys.stderr)
+        print(f"[ingesta] {len(e.errores)} errores: no se ha escrito nada", file=sys.stderr)
+        return 1
+    resumen = ", ".join(f"{len(filas[t])} {t}" for t in TABLAS)
+    if args.validar:
+        print(f"[ingesta] válido: {resumen}")
+        return 0
+    try:
+        escritas = subir(filas, tam_lote=args.lote)
+    except ErrorValidacion as e:
+        for err in e.errores:
+            print(f"[ingesta] {err}: no se ha escrito nada", file=sys.stderr)
+        return 1
+    print(f"[ingesta] {', '.join(f'{n} {t}' for t, n in escritas.items())} en {time.perf_counter() - t0:.2f} s")
+    try:
+        avisar_cambios(filas, recalcular=not args.sin_recalcular)
+    except Exception as e:
+        # El catálogo ya está escrito: lo cacheado con los datos viejos sigue ahí
+        print(f"[ingesta] no se pudieron invalidar los resultados cacheados: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+Constructor de listas de ejército por puntos.
+
+Dada una lista rival, un presupuesto y las unidades candidatas (normalmente las de
+una facción), elige qué unidades incluir y si van reforzadas para maximizar el
+rendimiento esperado contra esa lista.
+
+1. Puntuaciones de enfrentamiento, calculadas una sola vez: cada opción candidata
+   (unidad normal o reforzada) contra cada unidad rival, en los dos sentidos. El daño
+   sale de `rejilla_defensor`, que resuelve todas las armas contra todas las
+   combinaciones de salvación y ward de la otra lista en una pasada, así que el coste
+   es una rejilla por opción y por rival, no un combate por pareja.
+2. La puntuación de una opción es el balance de puntos por ronda de combate (puntos
+   rivales que destruye menos puntos propios que pierde), ponderado por el peso en
+   puntos de cada rival en su lista.
+3. Mochila de elección múltiple sobre el presupuesto: por unidad, ninguna opción,
+   normal o reforzada (hasta `max_copias` veces). Los puntos se dividen por su máximo
+   común divisor, de modo que 2000 puntos en múltiplos de 10 son 200 columnas. El
+   presupuesto se limita a MAX_PRESUPUESTO: con un divisor de 1 cada punto es una
+   columna por grupo.
+"""
+
+import math
+from functools import reduce
+from typing import Any, Dict, List, Optional, Tuple
+
+from combar_logic import rejilla_defensor
+from modificadores import pipeline_de
+from simulador import armas_de, construir_perfil_ataque
+
+PRESUPUESTO = 2000
+MAX_PRESUPUESTO = 5000
+
+
+def _minis(unidad: Dict[str, Any]) -> int:
+    return int(unidad.get("base_size", 1)) * (2 if bool(unidad.get("reinforced", False)) else 1)
+
+
+def _coste(unidad: Dict[str, Any]) -> int:
+    """Puntos de la unidad; reforzada cuesta el doble."""
+    return int(unidad.get("points") or 0) * (2 if bool(unidad.get("reinforced", False)) else 1)
+
+
+def _ward(unidad: Dict[str, Any]) -> Optional[int]:
+    w = int(unidad.get("ward_save") or 0)
+    return w if w > 0 else None
+
+
+def _heridas_contra(atacante: Dict[str, Any], defensores: List[Dict[str, Any]]) -> List[float]:
+    """Heridas medias por ronda del atacante contra cada defensor, con una sola rejilla."""
+    pipeline = pipeline_de(atacante)
+    perfiles = [construir_perfil_ataque(atacante, arma, pipeline=pipeline) for arma in armas_de(atacante)]
+    saves = sorted({int(d.get("save", 7) or 7) for d in defensores})
+    wards = sorted({_ward(d) for d in defensores}, key=lambda w: w or 0)
+    rejilla = rejilla_defensor(perfiles, saves=saves, wards=wards, mods_rend=(0,))["heridas"][0]
+    return [rejilla[saves.index(int(d.get("save", 7) or 7))][wards.index(_ward(d))] for d in defensores]
+
+
+def _puntos_destruidos(heridas: float, defensor: Dict[str, Any]) -> float:
+    minis = _minis(defensor)
+    bajas = min(float(minis), heridas / max(1, int(defensor.get("wounds", 1))))
+    return bajas * _coste(defensor) / max(1, minis)
+
+
+def opciones(candidatas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Cada unidad con coste, normal y (si se puede) reforzada."""
+    out = []
+    for u in candidatas:
+        if not int(u.get("points") or 0):
+            continue
+        out.append(dict(u, reinforced=False, champion=False))
+        if bool(u.get("reinforced", False)):
+            out.append(dict(u, reinforced=True, champion=False))
+    return out
+
+
+def matriz_enfrentamientos(opciones_: List[Dict[str, Any]], rivales: List[Dict[str, Any]]) -> List[List[float]]:
+    """
+    Balance de puntos por ronda de cada opción (filas) contra cada rival (columnas).
+    Una rejilla por opción contra todos los rivales y una por rival contra todas las
+    opciones.
+    """
+    ofensiva = [_heridas_contra(o, rivales) for o in opciones_]
+    # Traspuesta: lo que cada rival hace a cada opción
+    defensiva = [_heridas_contra(r, opciones_) for r in rivales]
+    return [
+        [_puntos_destruidos(ofensiva[i][j], r) - _puntos_destruidos(defensiva[j][i], o)
+         for j, r in enumerate(rivales)]
+        for i, o in enumerate(opciones_)
+    ]
+
+
+def comprobar_presupuesto(presupuesto: int) -> int:
+    """El presupuesto como entero en [0, MAX_PRESUPUESTO]; ValueError si no lo es."""
+    try:
+        presupuesto = int(presupuesto)
+    except (TypeError, ValueError):
+        raise ValueError("el presupuesto debe ser un número entero de puntos") from None
+    if not 0 <= presupuesto <= MAX_PRESUPUESTO:
+        raise ValueError(f"el presupuesto debe estar entre 0 y {MAX_PRESUPUESTO} puntos")
+    return presupuesto
+
+
+def _mochila(grupos: List[List[Tuple[int, float]]], capacidad: int) -> Tuple[float, List[int]]:
+    """
+    Mochila de elección múltiple: de cada grupo, como mucho un elemento (coste, valor).
+    Devuelve (mejor valor, índice elegido por grupo o -1).
+    """
+    mejor = [0.0] * (capacidad + 1)
+    elecciones: List[List[int]] = []
+    for grupo in grupos:
+        nuevo = list(mejor)
+        eleccion = [-1] * (capacidad + 1)
+        for k, (coste, valor) in enumerate(grupo):
+            if valor <= 0 or coste > capacidad:
+                continue
+            for c in range(coste, capacidad + 1):
+                v = mejor[c - coste] + valor
+                if v > nuevo[c]:
+                    nuevo[c] = v
+                    eleccion[c] = k
+        elecciones.append(eleccion)
+        mejor = nuevo
+    c = max(range(capacidad + 1), key=lambda i: (mejor[i], -i))
+    total = mejor[c]
+    elegidos = [-1] * len(grupos)
+    for g in range(len(grupos) - 1, -1, -1):
+        k = elecciones[g][c]
+        if k >= 0:
+            elegidos[g] = k
+            c -= grupos[g][k][0]
+    return total, elegidos
+
+
+def optimizar_lista(candidatas: List[Dict[str, Any]], rivales: List[Dict[str, Any]],
+                    presupuesto: int = PRESUPUESTO, max_copias: int = 1) -> Dict[str, Any]:
+    """
+    Mejor lista dentro de `presupuesto` contra la lista `rivales`. Las unidades deben
+    traer sus armas en `armas` (ver `lotes.resolver_unidades`); en los rivales,
+    `reinforced` indica si van reforzados.
+    """
+    presupuesto = comprobar_presupuesto(presupuesto)
+    opts = opciones(candidatas)
+    if not opts or not rivales:
+        return {"unidades": [], "puntos": 0, "presupuesto": presupuesto, "puntuacion": 0.0}
+    matriz = matriz_enfrentamientos(opts, rivales)
+    total_rival = sum(_coste(r) for r in rivales) or len(rivales)
+    pesos = [(_coste(r) or 1) / total_rival for r in rivales]
+    valores = [sum(p * s for p, s in zip(pesos, fila)) for fila in matriz]
+
+    costes = [_coste(o) for o in opts]
+    divisor = reduce(math.gcd, costes + [presupuesto]) or 1
+    # Un grupo por unidad y copia: ninguna, normal o reforzada
+    por_unidad: Dict[str, List[int]] = {}
+    for i, o in enumerate(opts):
+        por_unidad.setdefault(str(o.get("id", i)), []).append(i)
+    grupos_idx = [idx for idx in por_unidad.values() for _ in range(max(1, max_copias))]
+    grupos = [[(costes[i] // divisor, valores[i]) for i in idx] for idx in grupos_idx]
+    puntuacion, elegidos = _mochila(grupos, presupuesto // divisor)
+
+    unidades = []
+    for idx, k in zip(grupos_idx, elegidos):
+        if k < 0:
+            continue
+        i = idx[k]
+        o = opts[i]
+        unidades.append({
+            "unit_id": o.get("id", ""),
+            "nombre": o.get("name", ""),
+            "reforzada": bool(o["reinforced"]),
+            "puntos": costes[i],
+            "puntuacion": round(valores[i], 2),
+            "contra": {r.get("name", str(j)): round(matriz[i][j], 2) for j, r in enumerate(rivales)},
+        })
+    return {
+        "unidades": unidades,
+        "puntos": sum(u["puntos"] for u in unidades),
+        "presupuesto": presupuesto,
+        "puntuacion": round(puntuacion, 2),
+        "opciones_evaluadas": len(opts),
+    }
+
+
+def lista_para_faccion(faction_id: str, rivales: List[Tuple[str, bool]], presupuesto: int = PRESUPUESTO,
+                       max_copias: int = 1) -> Dict[str, Any]:
+    """Candidatas: todas las unidades de la facción. `rivales` son pares (unit_id, reforzada)."""
+    presupuesto = comprobar_presupuesto(presupuesto)
+    from lotes import resolver_unidades
+    from services import catalogo
+
+    ids = [uid for uid, _ in catalogo.get_units_by_faction(faction_id)]
+    unidades = resolver_unidades(ids + [uid for uid, _ in rivales])
+    faltan = [uid for uid, _ in rivales if uid not in unidades]
+    if faltan:
+        raise ValueError(f"unidades rivales no encontradas: {', '.join(faltan)}")
+    lista_rival = [dict(unidades[uid], reinforced=reforzada, champion=False) for uid, reforzada in rivales]
+    return optimizar_lista([unidades[uid] for uid in ids if uid in unidades], lista_rival,
+                           presupuesto=presupuesto, max_copias=max_copias)
@@ -0,0 +1,298 @@
+"""
+Ejecución por lotes del simulador desde línea de comandos.
+
+Lee enfrentamientos de un fichero JSONL o CSV, resuelve todas las unidades y armas en
+bloque, evalúa en varios procesos y escribe un JSONL de resultados en el mismo orden
+que la entrada. La salida hace de checkpoint: si se interrumpe, al relanzar con los
+mismos ficheros se continúa desde la primera fila sin resultado.
+
+Al terminar se escribe `<salida>.resumen.json` con la distribución de los resultados
+de todas las filas (medias y cuantiles), acumulada en streaming con memoria constante.
+
+Cada fila de entrada admite las claves:
+    atacante, defensor                       (ids de unidad, obligatorias)
+    reforzada_atacante, reforzada_defensor   (bool)
+    campeon_atacante, campeon_defensor       (bool)
+    bono_atacante                            (bono de carga, p. ej. "Rend -1"; el atacante carga)
+    max_rondas                               (int)
+
+Solo carga quien golpea primero, el atacante: una fila con `bono_defensor` se rechaza
+porque ese bono nunca se aplicaría.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+TAM_BLOQUE = 2000
+ERROR_BONO_DEFENSOR = "bono_defensor no tiene efecto: solo carga el atacante (usa bono_atacante e invierte la fila)"
+
+_UNIDADES: Dict[str, dict] = {}
+_MODO = "medias"
+_ENSAYOS = 0
+_PERFIL = None
+
+
+def _bool(v: Any) -> bool:
+    if isinstance(v, str):
+        return v.strip().lower() in ("1", "true", "si", "sí", "yes")
+    return bool(v)
+
+
+def leer_enfrentamientos(ruta: str) -> Iterator[Dict[str, Any]]:
+    """Itera las filas de un fichero .jsonl o .csv sin cargarlo entero en memoria."""
+    with open(ruta, encoding="utf-8", newline="") as f:
+        if ruta.lower().endswith(".csv"):
+            for fila in csv.DictReader(f):
+                yield fila
+        else:
+            for linea in f:
+                linea = linea.strip()
+                if linea:
+                    yield json.loads(linea)
+
+
+class _ResumenLote:
+    """Distribución de los resultados por fila de todo el lote (victoria, supervivientes, rondas)."""
+
+    def __init__(self):
+        from agregados import Distribucion
+        self.campos = {c: Distribucion() for c in ("victoria", "supervivientes_atacante",
+                                                    "supervivientes_defensor", "rondas")}
+        self.errores = 0
+
+    def add(self, res: Dict[str, Any]) -> None:
+        if "error" in res:
+            self.errores += 1
+            return
+        if "victoria_atacante" in res:
+            # Fila de Monte Carlo: medias de sus ensayos
+            valores = {
+                "victoria": res["victoria_atacante"]["media"],
+                "supervivientes_atacante": res["supervivientes_atacante"]["media"],
+                "supervivientes_defensor": res["supervivientes_defensor"]["media"],
+                "rondas": res["rondas"]["media"],
+            }
+        else:
+            valores = {
+                "victoria": 1.0 if res.get("defensor_restante") == 0 and res.get("atacante_restante", 0) > 0 else 0.0,
+                "supervivientes_atacante": res.get("atacante_restante", 0),
+                "supervivientes_defensor": res.get("defensor_restante", 0),
+                "rondas": res.get("rondas", 0),
+            }
+        for campo, v in valores.items():
+            self.campos[campo].add(float(v))
+
+    def a_dict(self) -> Dict[str, Any]:
+        filas = self.campos["victoria"].momentos.n
+        return {"filas": filas, "errores": self.errores,
+                **{c: d.resumen() for c, d in self.campos.items()}}
+
+
+def _filas_hechas(ruta_salida: str, resumen: Optional[_ResumenLote] = None) -> int:
+    """
+    Cuenta los resultados completos ya escritos (y los pliega en `resumen`). Si la
+    última línea quedó a medias por una interrupción, se recorta el fichero para que
+    el reanudado sea limpio.
+    """
+    if not os.path.exists(ruta_salida):
+        return 0
+    hechas = 0
+    ultimo_ok = 0
+    with open(ruta_salida, "rb") as f:
+        for linea in f:
+            if not linea.endswith(b"\n"):
+                break
+            try:
+                res = json.loads(linea)
+            except ValueError:
+                break
+            if resumen is not None:
+                resumen.add(res)
+            hechas += 1
+            ultimo_ok += len(linea)
+    if ultimo_ok < os.path.getsize(ruta_salida):
+        with open(ruta_salida, "r+b") as f:
+            f.truncate(ultimo_ok)
+    return hechas
+
+
+def resolver_unidades(ids) -> Dict[str, dict]:
+    """Unidades con sus armas ya en unidad["armas"], en dos consultas por bloque de ids."""
+    from services.unidad_service import obtener_unidades_por_ids, obtener_armas_de_unidades
+
+    ids = set(ids)
+    ids.discard("")
+    unidades = obtener_unidades_por_ids(list(ids))
+    armas = obtener_armas_de_unidades(list(unidades))
+    for uid, unidad in unidades.items():
+        unidad["armas"] = armas.get(uid, [])
+    return unidades
+
+
+def _resolver_unidades(ruta_entrada: str) -> Dict[str, dict]:
+    """Recorre la entrada una vez para reunir los ids y resolverlos con pocas consultas."""
+    ids = set()
+    for fila in leer_enfrentamientos(ruta_entrada):
+        ids.add(str(fila.get("atacante", "")))
+        ids.add(str(fila.get("defensor", "")))
+    return resolver_unidades(ids)
+
+
+def _init_worker(unidades: Dict[str, dict], modo: str, ensayos: int) -> None:
+    global _UNIDADES, _MODO, _ENSAYOS, _PERFIL
+    _UNIDADES = unidades
+    _MODO = modo
+    _ENSAYOS = ensayos
+    from services import perfilado
+    _PERFIL = perfilado.sesion(f"lotes_{modo}")
+    if _PERFIL is not None:
+        # Los workers salen con os._exit: atexit no se ejecuta, los Finalize sí
+        from multiprocessing.util import Finalize
+        Finalize(_PERFIL, _PERFIL.cerrar, exitpriority=10)
+
+
+def preparar(fila: Dict[str, Any], unidades: Dict[str, dict]) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    Atacante y defensor de una fila con sus opciones aplicadas; (None, None) si falta
+    alguno. ValueError si la fila trae `bono_defensor`.
+    """
+    from modificadores import con_bono_carga
+
+    if fila.get("bono_defensor"):
+        raise ValueError(ERROR_BONO_DEFENSOR)
+    atacante = unidades.get(str(fila.get("atacante", "")))
+    defensor = unidades.get(str(fila.get("defensor", "")))
+    if atacante is None or defensor is None:
+        return None, None
+    atacante = dict(atacante)
+    defensor = dict(defensor)
+    if "reforzada_atacante" in fila:
+        atacante["reinforced"] = _bool(fila["reforzada_atacante"])
+    if "reforzada_defensor" in fila:
+        defensor["reinforced"] = _bool(fila["reforzada_defensor"])
+    atacante["champion"] = _bool(fila.get("campeon_atacante", False))
+    defensor["champion"] = _bool(fila.get("campeon_defensor", False))
+    return con_bono_carga(atacante, fila.get("bono_atacante") or ""), defensor
+
+
+def _preparar(fila: Dict[str, Any]) -> Tuple[Optional[dict], Optional[dict]]:
+    return preparar(fila, _UNIDADES)
+
+
+def evaluar_fila(args: Tuple[int, Dict[str, Any]]) -> Dict[str, Any]:
+    """Evalúa un enfrentamiento en el worker. Nunca lanza: los errores van en el resultado."""
+    if _PERFIL is not None:
+        return _PERFIL.ejecutar(_evaluar_fila, args)
+    return _evaluar_fila(args)
+
+
+def _evaluar_fila(args: Tuple[int, Dict[str, Any]]) -> Dict[str, Any]:
+    n, fila = args
+    salida = {"fila": n, "atacante_id": fila.get("atacante"), "defensor_id": fila.get("defensor")}
+    try:
+        atacante, defensor = _preparar(fila)
+        if atacante is None:
+            salida["error"] = "unidad no encontrada"
+            return salida
+        max_rondas = int(fila.get("max_rondas") or 10)
+        if _MODO == "montecarlo":
+            from montecarlo import montecarlo, montecarlo_adaptativo
+            if _ENSAYOS:
+                res = montecarlo(atacante, defensor, ensayos=_ENSAYOS, max_rondas=max_rondas)
+            else:
+                res = montecarlo_adaptativo(atacante, defensor, max_rondas=max_rondas)
+            # Por fila basta con medias y cuantiles: los histogramas inflarían la salida
+            for clave in ("supervivientes_atacante", "supervivientes_defensor", "rondas"):
+                res[clave].pop("histograma", None)
+            res.pop("dano_atacante", None)
+            res.pop("dano_defensor", None)
+        else:
+            from simulador import simular_combate_completo
+            res = simular_combate_completo(atacante, defensor, max_rondas=max_rondas, out=io.StringIO())
+            res.pop("rondas_detalle", None)
+        salida.update(res)
+    except Exception as e:
+        salida["error"] = str(e)
+    return salida
+
+
+def _bloques(filas: Iterator[Tuple[int, Dict[str, Any]]], tam: int) -> Iterator[List[Tuple[int, Dict[str, Any]]]]:
+    bloque = []
+    for item in filas:
+        bloque.append(item)
+        if len(bloque) >= tam:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+def ejecutar_lote(ruta_entrada: str, ruta_salida: str, procesos: Optional[int] = None,
+                  modo: str = "medias", ensayos: int = 0) -> int:
+    """
+    Procesa la entrada y añade los resultados a `ruta_salida`. Devuelve cuántas filas
+    se han evaluado en esta ejecución (las ya presentes en la salida se saltan).
+    """
+    from services.perfilado import perfilar
+
+    resumen = _ResumenLote()
+    hechas = _filas_hechas(ruta_salida, resumen)
+    unidades = perfilar("lotes_resolver", _resolver_unidades, ruta_entrada)
+    pendientes = ((n, fila) for n, fila in enumerate(leer_enfrentamientos(ruta_entrada)) if n >= hechas)
+    procesos = procesos or os.cpu_count() or 1
+    evaluadas = 0
+    with open(ruta_salida, "a", encoding="utf-8") as out, \
+            ProcessPoolExecutor(max_workers=procesos, initializer=_init_worker,
+                                initargs=(unidades, modo, ensayos)) as pool:
+        # Bloques acotados: memoria constante y resultados escritos en orden de entrada
+        for bloque in _bloques(pendientes, TAM_BLOQUE):
+            chunk = max(1, len(bloque) // (procesos * 4))
+            for res in pool.map(evaluar_fila, bloque, chunksize=chunk):
+                out.write(json.dumps(res, ensure_ascii=False) + "\n")
+                resumen.add(res)
+            out.flush()
+            os.fsync(out.fileno())
+            evaluadas += len(bloque)
+            print(f"[lotes] {hechas + evaluadas} filas completadas", file=sys.stderr)
+    with open(ruta_salida + ".resumen.json", "w", encoding="utf-8") as f:
+        json.dump(resumen.a_dict(), f, ensure_ascii=False, indent=2)
+    return evaluadas
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Simulador de combate Age of Sigmar")
+    parser.add_argument("--atacante", help="id de la unidad atacante (análisis individual)")
+    parser.add_argument("--defensor", help="id de la unidad defensora (análisis individual)")
+    parser.add_argument("--entrada", help="fichero .jsonl o .csv con enfrentamientos")
+    parser.add_argument("--salida", help="fichero .jsonl de resultados (se reanuda si existe)")
+    parser.add_argument("--procesos", type=int, default=None, help="procesos de trabajo (por defecto, CPUs)")
+    parser.add_argument("--modo", choices=["medias", "montecarlo"], default="medias")
+    parser.add_argument("--ensayos", type=int, default=0,
+                        help="ensayos fijos en modo montecarlo (0 = adaptativo)")
+    parser.add_argument("--perfil", action="store_true",
+                        help="perfilar la ejecución (como AOS_PERFIL=1; ver services/perfilado.py)")
+    args = parser.parse_args(argv)
+    if args.perfil:
+        # Por entorno para que lo hereden los procesos de trabajo
+        os.environ.setdefault("AOS_PERFIL", "1")
+
+    if args.entrada:
+        if not args.salida:
+            parser.error("--entrada requiere --salida")
+        ejecutar_lote(args.entrada, args.salida, procesos=args.procesos, modo=args.modo, ensayos=args.ensayos)
+    elif args.atacante and args.defensor:
+        from simulador import mostrar_analisis_inicial
+        print("=== SIMULADOR DE COMBATE AGE OF SIGMAR ===")
+        mostrar_analisis_inicial(args.atacante, args.defensor, carga=True)
+    else:
+        parser.error("indica --atacante y --defensor, o --entrada y --salida")
+
+
+if __name__ == "__main__":
+    main()
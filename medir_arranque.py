@@ -0,0 +1,52 @@
+"""
+Mide el tiempo hasta la primera petición atendida por el backend.
+
+    python medir_arranque.py -- reflex run --env prod --backend-only --port 8000
+    python medir_arranque.py --url http://localhost:8000/ping -- docker run -p 8000:8000 proyecto_aos
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+def medir(comando, url: str, limite_s: float = 300.0) -> float:
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(comando)
+    try:
+        while time.perf_counter() - t0 < limite_s:
+            if proc.poll() is not None:
+                raise RuntimeError(f"El proceso terminó con código {proc.returncode} antes de responder")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as r:
+                    if r.status == 200:
+                        return time.perf_counter() - t0
+            except OSError:
+                pass
+            time.sleep(0.1)
+        raise TimeoutError(f"Sin respuesta de {url} en {limite_s} s")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000/ping")
+    parser.add_argument("--limite", type=float, default=300.0)
+    parser.add_argument("comando", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    comando = args.comando[1:] if args.comando[:1] == ["--"] else args.comando
+    if not comando:
+        parser.error("indica el comando de arranque tras --")
+    segundos = medir(comando, args.url, args.limite)
+    print(f"Tiempo hasta la primera petición: {segundos:.2f} s")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
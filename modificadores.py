@@ -0,0 +1,181 @@
+"""
+Modificadores de perfil de arma declarados como datos.
+
+Un modificador es un diccionario:
+    {"campo": "rend", "op": "sumar", "valor": 1, "cuando": "carga"}
+
+- campo: attacks, to_hit, to_wound, rend, damage o crit_effect
+- op: sumar, fijar o multiplicar (crit_effect solo admite fijar)
+- cuando: "siempre" (por defecto) o "carga" (solo en la ronda en que la unidad carga)
+
+El rend se trata como magnitud: sumar 1 a un rend -1 da -2. En attacks y damage se
+actualizan a la vez la media y los términos de dados (`*_terms`) para que el motor
+por medias y el Monte Carlo vean lo mismo.
+
+Cada lista de modificadores se compila una vez en un `Pipeline` (se memoriza por su
+contenido) y luego se aplica a cada perfil sin volver a interpretarla.
+"""
+
+import json
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Tuple
+
+CAMPOS = ("attacks", "to_hit", "to_wound", "rend", "damage", "crit_effect")
+OPS = ("sumar", "fijar", "multiplicar")
+
+# Bonos de carga elegibles en la interfaz
+BONOS_CARGA: Dict[str, List[Dict[str, Any]]] = {
+    "Rend -1": [{"campo": "rend", "op": "sumar", "valor": 1, "cuando": "carga"}],
+    "Daño +1": [{"campo": "damage", "op": "sumar", "valor": 1, "cuando": "carga"}],
+}
+
+Transformacion = Callable[[Dict[str, Any]], None]
+
+
+def _transformacion(campo: str, op: str, valor: Any) -> Transformacion:
+    if campo == "crit_effect":
+        if op != "fijar":
+            raise ValueError("crit_effect solo admite la operación 'fijar'")
+
+        def _t(p):
+            p["crit_effect"] = valor
+        return _t
+
+    if campo == "rend":
+        v = int(valor)
+        if op == "sumar":
+            def _t(p):
+                p["rend"] = -(abs(int(p["rend"])) + v)
+        elif op == "fijar":
+            def _t(p):
+                p["rend"] = -abs(v)
+        else:
+            def _t(p):
+                p["rend"] = -int(abs(int(p["rend"])) * v)
+        return _t
+
+    if campo in ("to_hit", "to_wound"):
+        v = int(valor)
+        if op == "sumar":
+            # +1 a impactar/herir = objetivo 1 punto más fácil
+            def _t(p):
+                p[campo] = int(p[campo]) - v
+        elif op == "fijar":
+            def _t(p):
+                p[campo] = v
+        else:
+            raise ValueError(f"{campo} no admite 'multiplicar'")
+        return _t
+
+    # attacks / damage: media y términos de dados
+    terms = f"{campo}_terms"
+    if op == "sumar":
+        v = int(valor)
+
+        def _t(p):
+            p[campo] = float(p[campo]) + v
+            if terms in p:
+                p[terms] = list(p[terms]) + [(1 if v >= 0 else -1, abs(v), 0)]
+    elif op == "fijar":
+        v = int(valor)
+
+        def _t(p):
+            p[campo] = float(v)
+            if terms in p:
+                p[terms] = [(1, v, 0)]
+    else:
+        k = int(valor)
+
+        def _t(p):
+            p[campo] = float(p[campo]) * k
+            if terms in p:
+                p[terms] = list(p[terms]) * k
+    return _t
+
+
+class Pipeline:
+    """Transformaciones ya compiladas, separadas según se apliquen siempre o solo al cargar."""
+
+    def __init__(self, siempre: Tuple[Transformacion, ...], carga: Tuple[Transformacion, ...]):
+        self.siempre = siempre
+        self.carga = carga
+
+    def __bool__(self) -> bool:
+        return bool(self.siempre or self.carga)
+
+    def aplicar(self, perfil: Dict[str, Any], carga: bool = False) -> Dict[str, Any]:
+        """Aplica las transformaciones sobre `perfil` (se modifica y se devuelve)."""
+        for t in self.siempre:
+            t(perfil)
+        if carga:
+            for t in self.carga:
+                t(perfil)
+        return perfil
+
+
+VACIO = Pipeline((), ())
+
+
+@lru_cache(maxsize=1024)
+def _compilar_json(decl_json: str) -> Pipeline:
+    siempre, carga = [], []
+    for m in json.loads(decl_json):
+        campo, op = m.get("campo"), m.get("op", "sumar")
+        if campo not in CAMPOS:
+            raise ValueError(f"Campo de modificador no válido: {campo!r}")
+        if op not in OPS:
+            raise ValueError(f"Operación de modificador no válida: {op!r}")
+        t = _transformacion(campo, op, m.get("valor", 0))
+        (carga if m.get("cuando", "siempre") == "carga" else siempre).append(t)
+    return Pipeline(tuple(siempre), tuple(carga))
+
+
+def compilar(modificadores: List[Dict[str, Any]]) -> Pipeline:
+    """Compila una lista de modificadores (memorizado por contenido)."""
+    if not modificadores:
+        return VACIO
+    return _compilar_json(json.dumps(modificadores, sort_keys=True, ensure_ascii=False))
+
+
+def modificadores_de_unidad(unidad: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Modificadores declarados para una unidad: los de sus habilidades en base de datos
+    (`rend_on_charge`, columna `modificadores` si existe) más los añadidos para el
+    enfrentamiento (p. ej. el bono de carga elegido en la interfaz).
+    """
+    mods: List[Dict[str, Any]] = []
+    roc = unidad.get("rend_on_charge")
+    if roc:
+        try:
+            mods.append({"campo": "rend", "op": "sumar", "valor": abs(int(roc)), "cuando": "carga"})
+        except (ValueError, TypeError):
+            pass
+    declarados = unidad.get("modificadores")
+    if isinstance(declarados, str):
+        try:
+            declarados = json.loads(declarados)
+        except ValueError:
+            declarados = None
+    if isinstance(declarados, list):
+        mods.extend(declarados)
+    return mods
+
+
+def con_bono_carga(unidad: Dict[str, Any], bono: str) -> Dict[str, Any]:
+    """Copia de la unidad con el bono de carga `bono` (clave de BONOS_CARGA) añadido a sus modificadores."""
+    extra = BONOS_CARGA.get(bono or "")
+    if not extra:
+        return unidad
+    declarados = unidad.get("modificadores")
+    if isinstance(declarados, str):
+        try:
+            declarados = json.loads(declarados)
+        except ValueError:
+            declarados = None
+    unidad = dict(unidad)
+    unidad["modificadores"] = list(declarados if isinstance(declarados, list) else []) + extra
+    return unidad
+
+
+def pipeline_de(unidad: Dict[str, Any]) -> Pipeline:
+    return compilar(modificadores_de_unidad(unidad))
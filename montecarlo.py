@@ -0,0 +1,272 @@
+"""
+Simulación Monte Carlo del combate completo.
+
+A diferencia de `simulador`, que trabaja con medias, aquí se tiran los dados de cada
+ataque. El modo adaptativo lanza ensayos en lotes crecientes y se detiene cuando el
+intervalo de confianza de la tasa de victoria es lo bastante estrecho o se agota el
+presupuesto de tiempo, de modo que los combates desequilibrados terminan antes.
+"""
+
+import math
+import os
+import random
+import time
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional, Tuple
+
+from agregados import AgregadoCombate
+from modificadores import pipeline_de
+from simulador import armas_de, construir_perfil_ataque
+from utils import tirar_formula
+
+
+def _objetivo(t: int) -> int:
+    """Resultado mínimo en 1d6 para superar una tirada (7 = imposible)."""
+    t = int(t)
+    return 7 if t >= 7 else max(t, 2)
+
+
+def compilar_armas(unidad: Dict[str, Any], armas: List[Dict[str, Any]], carga: bool = False) -> List[tuple]:
+    """
+    Convierte las armas de una unidad en tuplas listas para tirar dados. Los
+    modificadores de la unidad se aplican aquí, una vez, sobre los términos de dados.
+    """
+    pipeline = pipeline_de(unidad)
+    compiladas = []
+    for arma in armas:
+        perfil = construir_perfil_ataque(unidad, arma, carga=carga, pipeline=pipeline)
+        compiladas.append((
+            perfil["attacks_terms"],
+            _objetivo(perfil["to_hit"]),
+            _objetivo(perfil["to_wound"]),
+            abs(int(perfil["rend"])),
+            perfil["damage_terms"],
+            (perfil.get("crit_effect") or "none").strip().lower(),
+            int(float(perfil.get("crit_value") or 1)),
+        ))
+    return compiladas
+
+
+def _tirar_ataques(armas: List[tuple], minis: int, champion: bool, defensor: Dict[str, Any], rng: random.Random) -> int:
+    """Daño total causado por `minis` miniaturas con todas sus armas en una ronda."""
+    save = int(defensor.get("save", 7) or 7)
+    ward = int(defensor.get("ward_save", 0) or 0)
+    objetivo_ward = _objetivo(ward) if ward > 0 else 7
+    randint = rng.randint
+    dano_total = 0
+    for idx, (ataques, to_hit, to_wound, rend, dano, crit, crit_valor) in enumerate(armas):
+        n = sum(tirar_formula(ataques, rng) for _ in range(minis))
+        if idx == 0 and champion:
+            n += 1
+        objetivo_save = _objetivo(save + rend)
+        heridas = 0
+        mortales = 0
+        for _ in range(n):
+            tirada = randint(1, 6)
+            if tirada == 6 and crit == "auto_wound":
+                heridas += 1
+                continue
+            if tirada == 6 and crit == "mortal_wounds":
+                mortales += crit_valor
+            if tirada < to_hit:
+                continue
+            impactos = 2 if (tirada == 6 and crit == "impactos_dobles") else 1
+            for _ in range(impactos):
+                if randint(1, 6) >= to_wound:
+                    heridas += 1
+        for _ in range(heridas):
+            if randint(1, 6) >= objetivo_save:
+                continue
+            if randint(1, 6) >= objetivo_ward:
+                continue
+            dano_total += max(0, tirar_formula(dano, rng))
+        for _ in range(mortales):
+            if randint(1, 6) < objetivo_ward:
+                dano_total += 1
+    return dano_total
+
+
+def _minis_iniciales(unidad: Dict[str, Any]) -> int:
+    return int(unidad.get("base_size", 1)) * (2 if bool(unidad.get("reinforced", False)) else 1)
+
+
+def ensayo_combate(atacante_u: Dict[str, Any], defensor_u: Dict[str, Any], armas_atac_carga: List[tuple],
+                   armas_atac: List[tuple], armas_def: List[tuple], rng: random.Random,
+                   max_rondas: int = 10) -> Tuple[int, int, int, int, int, int]:
+    """
+    Un combate completo con dados, con el mismo orden y reparto de heridas que
+    `simulador.iterar_combate`.
+
+    Returns:
+        (resultado, minis_atacante, minis_defensor, rondas, dano_atacante, dano_defensor)
+        con resultado 1 si gana el atacante, -1 si gana el defensor y 0 en empate; los
+        daños son el total causado por cada lado en todo el combate.
+    """
+    atacante_vivo = _minis_iniciales(atacante_u)
+    defensor_vivo = _minis_iniciales(defensor_u)
+    wpm_atac = int(atacante_u.get("wounds", 1))
+    wpm_def = int(defensor_u.get("wounds", 1))
+    champion_atac = bool(atacante_u.get("champion", False))
+    champion_def = bool(defensor_u.get("champion", False))
+    acumuladas_atac = 0
+    acumuladas_def = 0
+    dano_atac = 0
+    dano_def = 0
+    ronda = 1
+    while ronda <= max_rondas:
+        armas = armas_atac_carga if ronda == 1 else armas_atac
+        dano = _tirar_ataques(armas, atacante_vivo, champion_atac, defensor_u, rng)
+        dano_atac += dano
+        acumuladas_def += dano
+        defensor_vivo = max(defensor_vivo - acumuladas_def // wpm_def, 0)
+        acumuladas_def %= wpm_def
+        if defensor_vivo == 0:
+            return 1, atacante_vivo, 0, ronda, dano_atac, dano_def
+        dano = _tirar_ataques(armas_def, defensor_vivo, champion_def, atacante_u, rng)
+        dano_def += dano
+        acumuladas_atac += dano
+        atacante_vivo = max(atacante_vivo - acumuladas_atac // wpm_atac, 0)
+        acumuladas_atac %= wpm_atac
+        if atacante_vivo == 0:
+            return -1, 0, defensor_vivo, ronda, dano_atac, dano_def
+        ronda += 1
+    return 0, atacante_vivo, defensor_vivo, max_rondas, dano_atac, dano_def
+
+
+class _Preparado:
+    """Armas de ambos lados resueltas y compiladas una sola vez por enfrentamiento."""
+
+    def __init__(self, atacante_u: Dict[str, Any], defensor_u: Dict[str, Any],
+                 armas_atac: Optional[List[Dict[str, Any]]] = None,
+                 armas_def: Optional[List[Dict[str, Any]]] = None):
+        if armas_atac is None:
+            armas_atac = armas_de(atacante_u)
+        if armas_def is None:
+            armas_def = armas_de(defensor_u)
+        self.atacante_u = atacante_u
+        self.defensor_u = defensor_u
+        self.atac_carga = compilar_armas(atacante_u, armas_atac, carga=True)
+        self.atac = compilar_armas(atacante_u, armas_atac, carga=False)
+        self.defe = compilar_armas(defensor_u, armas_def, carga=False)
+
+    def ensayo(self, rng: random.Random, max_rondas: int) -> Tuple[int, int, int, int, int, int]:
+        return ensayo_combate(self.atacante_u, self.defensor_u, self.atac_carga, self.atac, self.defe, rng, max_rondas)
+
+    def agregado(self, max_rondas: int) -> AgregadoCombate:
+        """Agregador vacío con histogramas exactos de supervivientes para este enfrentamiento."""
+        return AgregadoCombate(max_rondas, _minis_iniciales(self.atacante_u), _minis_iniciales(self.defensor_u))
+
+    def acumular(self, agregado: AgregadoCombate, rng: random.Random, ensayos: int, max_rondas: int) -> None:
+        for _ in range(ensayos):
+            agregado.add(*self.ensayo(rng, max_rondas))
+
+
+def iterar_montecarlo_adaptativo(atacante_u: Dict[str, Any], defensor_u: Dict[str, Any],
+                                 ancho_ic: float = 0.05, ancho_supervivientes: Optional[float] = None,
+                                 confianza: float = 0.95, presupuesto_s: float = 2.0,
+                                 lote_inicial: int = 200, max_ensayos: int = 200_000,
+                                 max_rondas: int = 10, semilla: Optional[int] = None,
+                                 armas_atac: Optional[List[Dict[str, Any]]] = None,
+                                 armas_def: Optional[List[Dict[str, Any]]] = None):
+    """
+    Generador del Monte Carlo adaptativo: produce un resumen parcial tras cada lote y
+    devuelve (vía StopIteration.value) el resumen final con `ensayos` y `motivo`.
+
+    Se para cuando el IC de la tasa de victoria del atacante (y, si se pide, el de sus
+    supervivientes en miniaturas) tiene una anchura total <= la pedida, al agotar
+    `presupuesto_s` segundos o al llegar a `max_ensayos`. Los lotes se duplican.
+    Los ensayos se pliegan en un `AgregadoCombate`: la memoria no crece con su número.
+    """
+    prep = _Preparado(atacante_u, defensor_u, armas_atac, armas_def)
+    rng = random.Random(semilla)
+    z = NormalDist().inv_cdf(0.5 + confianza / 2.0)
+    agregado = prep.agregado(max_rondas)
+    victoria, sup_atac = agregado.victoria, agregado.sup_atac.momentos
+    inicio = time.perf_counter()
+    lote = max(2, int(lote_inicial))
+    motivo = "max_ensayos"
+
+    while victoria.n < max_ensayos:
+        prep.acumular(agregado, rng, min(lote, max_ensayos - victoria.n), max_rondas)
+        parcial = agregado.resumen(z)
+        parcial["segundos"] = time.perf_counter() - inicio
+        yield parcial
+
+        convergido = 2 * victoria.semiancho(z) <= ancho_ic
+        if ancho_supervivientes is not None:
+            convergido = convergido and 2 * sup_atac.semiancho(z) <= ancho_supervivientes
+        # Con p = 0 o 1 la varianza es 0: exigir un mínimo para no parar en el primer lote por azar
+        if convergido and victoria.n >= 2 * lote_inicial:
+            motivo = "convergencia"
+            break
+        if parcial["segundos"] >= presupuesto_s:
+            motivo = "tiempo"
+            break
+        lote *= 2
+
+    final = agregado.resumen(z)
+    final["segundos"] = time.perf_counter() - inicio
+    final["motivo"] = motivo
+    final["confianza"] = confianza
+    return final
+
+
+def montecarlo_adaptativo(atacante_u: Dict[str, Any], defensor_u: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+    """Versión bloqueante de `iterar_montecarlo_adaptativo`: devuelve solo el resumen final."""
+    gen = iterar_montecarlo_adaptativo(atacante_u, defensor_u, **kwargs)
+    while True:
+        try:
+            next(gen)
+        except StopIteration as fin:
+            return fin.value
+
+
+def montecarlo(atacante_u: Dict[str, Any], defensor_u: Dict[str, Any], ensayos: int = 1000,
+               max_rondas: int = 10, semilla: Optional[int] = None, confianza: float = 0.95,
+               armas_atac: Optional[List[Dict[str, Any]]] = None,
+               armas_def: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Monte Carlo con un número fijo de ensayos."""
+    return montecarlo_adaptativo(
+        atacante_u, defensor_u, ancho_ic=0.0, confianza=confianza, presupuesto_s=math.inf,
+        lote_inicial=ensayos, max_ensayos=ensayos, max_rondas=max_rondas, semilla=semilla,
+        armas_atac=armas_atac, armas_def=armas_def,
+    )
+
+
+def _bloque_montecarlo(args: tuple) -> AgregadoCombate:
+    """Un bloque de ensayos en un proceso de trabajo; devuelve solo su agregado."""
+    atacante_u, defensor_u, ensayos, max_rondas, semilla = args
+    prep = _Preparado(atacante_u, defensor_u, atacante_u["armas"], defensor_u["armas"])
+    agregado = prep.agregado(max_rondas)
+    prep.acumular(agregado, random.Random(semilla), ensayos, max_rondas)
+    return agregado
+
+
+def montecarlo_por_bloques(atacante_u: Dict[str, Any], defensor_u: Dict[str, Any], ensayos: int,
+                           procesos: Optional[int] = None, tam_bloque: int = 50_000,
+                           max_rondas: int = 10, semilla: Optional[int] = None,
+                           confianza: float = 0.95) -> Dict[str, Any]:
+    """
+    Monte Carlo de muchos ensayos (10^7 o más) repartido en bloques entre procesos.
+    Cada bloque devuelve su `AgregadoCombate` y se combinan al llegar, así que la
+    memoria es la misma para mil ensayos que para mil millones.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Armas resueltas aquí: los workers no consultan la base de datos
+    atacante_u = dict(atacante_u, armas=armas_de(atacante_u))
+    defensor_u = dict(defensor_u, armas=armas_de(defensor_u))
+    base = random.Random(semilla).getrandbits(64)
+    bloques = [(atacante_u, defensor_u, min(tam_bloque, ensayos - i), max_rondas, base + n)
+               for n, i in enumerate(range(0, ensayos, tam_bloque))]
+    inicio = time.perf_counter()
+    total = None
+    with ProcessPoolExecutor(max_workers=procesos or os.cpu_count() or 1) as pool:
+        for agregado in pool.map(_bloque_montecarlo, bloques):
+            total = agregado if total is None else total.merge(agregado)
+    z = NormalDist().inv_cdf(0.5 + confianza / 2.0)
+    final = total.resumen(z) if total is not None else AgregadoCombate(max_rondas).resumen(z)
+    final["segundos"] = time.perf_counter() - inicio
+    final["motivo"] = "max_ensayos"
+    final["confianza"] = confianza
+    return final
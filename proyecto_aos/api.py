@@ -0,0 +1,327 @@
+"""
+Rutas HTTP propias que se montan junto al backend de Reflex.
+
+En producción el frontend se compila al construir la imagen y aquí se sirve como
+estáticos desde el mismo proceso, así que arrancar el contenedor no recompila nada.
+"""
+
+import os
+import time
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+# Inicio del proceso; el CMD del contenedor puede pasar AOS_T0 con la hora de arranque real
+T0 = float(os.getenv("AOS_T0") or time.time())
+FRONTEND_DIR = os.getenv("AOS_FRONTEND_DIR", "")
+
+# Prefijos que atiende el backend de Reflex o esta API y nunca se buscan en los estáticos
+_PREFIJOS_BACKEND = ("/_event", "/_upload", "/_health", "/_all_routes", "/ping", "/api/")
+
+_arranque = {"primera_peticion_s": None}
+
+
+async def arranque(request):
+    return JSONResponse({
+        "uptime_s": time.time() - T0,
+        "primera_peticion_s": _arranque["primera_peticion_s"],
+        "frontend_estatico": bool(FRONTEND_DIR),
+    })
+
+
+# Una URL con la versión de la imagen (`v=`) no cambia nunca: caché larga + ETag. Sin
+# ella o con una versión vieja, el navegador revalida con el ETag cada vez
+CACHE_IMAGENES = "public, max-age=604800, stale-while-revalidate=86400"
+CACHE_IMAGENES_SIN_VERSION = "no-cache"
+
+
+async def imagen(request):
+    from services.imagenes import miniatura
+
+    unit_id = request.path_params["unit_id"]
+    try:
+        ancho = int(request.query_params.get("w", 0))
+    except ValueError:
+        ancho = 0
+    try:
+        res = await run_in_threadpool(miniatura, unit_id, ancho)
+    except Exception as e:
+        print(f"[imagenes] Error generando miniatura de {unit_id}: {e}")
+        return Response(status_code=502)
+    if res is None:
+        return Response(status_code=404)
+    ruta, etag, media_type, version = res
+    cache = CACHE_IMAGENES if request.query_params.get("v") == version else CACHE_IMAGENES_SIN_VERSION
+    cabeceras = {"ETag": f'"{etag}"', "Cache-Control": cache}
+    if request.headers.get("if-none-match", "").strip('W/ "') == etag:
+        return Response(status_code=304, headers=cabeceras)
+    with open(ruta, "rb") as f:
+        return Response(f.read(), media_type=media_type, headers=cabeceras)
+
+
+async def metricas(request):
+    """Breakers, cachés y antigüedad del catálogo en formato Prometheus."""
+    from services import catalogo
+    from services.resiliencia import metricas_prometheus
+
+    texto = metricas_prometheus()
+    texto += f"aos_catalogo_edad_s {catalogo.edad_s()}\n"
+    texto += f"aos_catalogo_version {catalogo._snap.version}\n"
+    return PlainTextResponse(texto)
+
+
+def _pide_perfil(request) -> bool:
+    """
+    `?perfil=1` perfila esta petición aunque AOS_PERFIL esté desactivado, solo si se
+    permite (AOS_PERFIL_PERMITIR=1), igual que la casilla de la interfaz. No se fía de
+    que la petición venga de la propia máquina: detrás de un proxy inverso lo parecen todas.
+    """
+    from services.perfilado import forzado_permitido
+
+    return request.query_params.get("perfil", "0") in ("1", "true") and forzado_permitido()
+
+
+async def rejilla(request):
+    """Rejilla salvación x ward x rend de una unidad atacante: /api/rejilla/{unit_id}?carga=1"""
+    from services.unidad_service import obtener_unidad_por_id
+    from simulador import rejilla_que_pasaria
+
+    unidad = await run_in_threadpool(obtener_unidad_por_id, request.path_params["unit_id"])
+    if not unidad:
+        return JSONResponse({"error": "unidad no encontrada"}, status_code=404)
+    from services.perfilado import perfilar
+
+    carga = request.query_params.get("carga", "0") in ("1", "true")
+    return JSONResponse(await run_in_threadpool(
+        perfilar, "rejilla", rejilla_que_pasaria, unidad, carga, forzar=_pide_perfil(request),
+    ))
+
+
+async def reparto(request):
+    """
+    Mejor reparto de los ataques de una unidad entre varios objetivos:
+    /api/reparto/{unit_id}?defensores=id1,id2,id3&carga=1
+    """
+    from asignacion import MAX_DEFENSORES, optimizar_reparto
+    from lotes import resolver_unidades
+    from services.perfilado import perfilar
+
+    atacante_id = request.path_params["unit_id"]
+    defensores_ids = [d for d in request.query_params.get("defensores", "").split(",") if d]
+    if not defensores_ids:
+        return JSONResponse({"error": "indica al menos un defensor en ?defensores="}, status_code=400)
+    if len(defensores_ids) > MAX_DEFENSORES:
+        return JSONResponse({"error": f"como mucho {MAX_DEFENSORES} defensores"}, status_code=400)
+    unidades = await run_in_threadpool(resolver_unidades, [atacante_id] + defensores_ids)
+    faltan = [u for u in [atacante_id] + defensores_ids if u not in unidades]
+    if faltan:
+        return JSONResponse({"error": "unidad no encontrada", "ids": faltan}, status_code=404)
+    carga = request.query_params.get("carga", "0") in ("1", "true")
+    return JSONResponse(await run_in_threadpool(
+        perfilar, "reparto", optimizar_reparto, unidades[atacante_id], [unidades[d] for d in defensores_ids],
+        carga, forzar=_pide_perfil(request),
+    ))
+
+
+async def iniciativa(request):
+    """
+    Los cuatro órdenes de golpe entre dos unidades (quién golpea primero, con o sin carga):
+    /api/iniciativa?u1=id1&u2=id2&reforzada1=1&bono1=Rend -1&bono2=...
+    """
+    from lotes import resolver_unidades
+    from modificadores import con_bono_carga
+    from services.perfilado import perfilar
+    from simulador import comparar_iniciativa
+
+    q = request.query_params
+    ids = [q.get("u1", ""), q.get("u2", "")]
+    if not all(ids):
+        return JSONResponse({"error": "indica ?u1= y ?u2="}, status_code=400)
+    unidades = await run_in_threadpool(resolver_unidades, ids)
+    faltan = [u for u in ids if u not in unidades]
+    if faltan:
+        return JSONResponse({"error": "unidad no encontrada", "ids": faltan}, status_code=404)
+    u1, u2 = (
+        con_bono_carga(dict(unidades[uid], reinforced=q.get(f"reforzada{n}", "0") in ("1", "true"),
+                            champion=q.get(f"campeon{n}", "0") in ("1", "true")), q.get(f"bono{n}", ""))
+        for n, uid in ((1, ids[0]), (2, ids[1]))
+    )
+    return JSONResponse(await run_in_threadpool(
+        perfilar, "iniciativa", comparar_iniciativa, u1, u2, forzar=_pide_perfil(request),
+    ))
+
+
+async def lista(request):
+    """
+    Lista de ejército por puntos contra una lista rival:
+    /api/lista?faccion=<id>&rivales=id1,id2:r,id3&puntos=2000&copias=1   (":r" = reforzada)
+    """
+    from listas import PRESUPUESTO, comprobar_presupuesto, lista_para_faccion
+    from services.perfilado import perfilar
+
+    q = request.query_params
+    rivales = []
+    for r in q.get("rivales", "").split(","):
+        if r:
+            uid, _, opcion = r.partition(":")
+            rivales.append((uid, opcion == "r"))
+    if not q.get("faccion") or not rivales:
+        return JSONResponse({"error": "indica ?faccion= y ?rivales="}, status_code=400)
+    try:
+        copias = min(3, max(1, int(q.get("copias", 1))))
+    except ValueError:
+        return JSONResponse({"error": "puntos y copias deben ser enteros"}, status_code=400)
+    try:
+        presupuesto = comprobar_presupuesto(q.get("puntos", PRESUPUESTO))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    try:
+        res = await run_in_threadpool(
+            perfilar, "lista", lista_para_faccion, q["faccion"], rivales, presupuesto, copias,
+            forzar=_pide_perfil(request),
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=404)
+    return JSONResponse(res)
+
+
+async def buscar(request):
+    """Buscar mientras se escribe: /api/buscar?q=saur&n=10"""
+    from services import buscador
+
+    try:
+        limite = min(50, max(1, int(request.query_params.get("n", 10))))
+    except ValueError:
+        limite = 10
+    from services.perfilado import perfilar
+
+    # La primera búsqueda tras un refresco del catálogo reconstruye el índice: fuera del bucle
+    resultados = await run_in_threadpool(
+        perfilar, "buscar", buscador.buscar, request.query_params.get("q", ""), limite,
+        forzar=_pide_perfil(request),
+    )
+    return JSONResponse(resultados)
+
+
+async def trabajos(request):
+    """
+    Cola de trabajos largos (ver services/trabajos.py).
+
+    POST /api/trabajos {"tipo": "montecarlo", "params": {...}}  -> 202 {"id": ...}
+    GET  /api/trabajos?ids=id1,id2                               -> estado de esos trabajos
+
+    No hay listado de todos los trabajos: el id, aleatorio, solo lo conoce quien lo envió.
+    """
+    from services import trabajos as cola
+
+    if request.method == "POST":
+        try:
+            cuerpo = await request.json()
+            tipo = str(cuerpo.get("tipo", ""))
+            if tipo not in cola.PUBLICOS:
+                raise ValueError(f"Tipo de trabajo no admitido: {tipo!r} (válidos: {', '.join(cola.PUBLICOS)})")
+            id_ = await run_in_threadpool(cola.enviar, tipo, cuerpo.get("params") or {})
+        except (ValueError, AttributeError) as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        cola.arrancar()
+        return JSONResponse({"id": id_, "estado": f"/api/trabajos/{id_}"}, status_code=202)
+    ids = [i for i in request.query_params.get("ids", "").split(",") if i][:100]
+    if not ids:
+        return JSONResponse({"error": "indica los ids de tus trabajos en ?ids="}, status_code=400)
+    estados = await run_in_threadpool(lambda: [cola.estado(i, con_resultado=False) for i in ids])
+    return JSONResponse([e for e in estados if e is not None])
+
+
+async def trabajo(request):
+    """
+    GET    /api/trabajos/{id}?esperar=10  estado; con `esperar` responde en cuanto cambia
+                                          el progreso o termina (long polling)
+    DELETE /api/trabajos/{id}             cancela
+    """
+    import asyncio
+    from services import trabajos as cola
+
+    id_ = request.path_params["id"]
+    if request.method == "DELETE":
+        if not await run_in_threadpool(cola.cancelar, id_):
+            return JSONResponse({"error": "trabajo no encontrado o ya terminado"}, status_code=409)
+        return JSONResponse(await run_in_threadpool(cola.estado, id_, False))
+    try:
+        esperar = min(30.0, max(0.0, float(request.query_params.get("esperar", 0))))
+    except ValueError:
+        esperar = 0.0
+    e = await run_in_threadpool(cola.estado, id_)
+    limite = time.time() + esperar
+    inicial = e and (e["estado"], e["progreso"])
+    while e and e["estado"] not in cola.TERMINADOS and (e["estado"], e["progreso"]) == inicial and time.time() < limite:
+        await asyncio.sleep(0.25)
+        e = await run_in_threadpool(cola.estado, id_)
+    if e is None:
+        return JSONResponse({"error": "trabajo no encontrado"}, status_code=404)
+    return JSONResponse(e)
+
+
+async def catalogo_actualizado(request):
+    """
+    Aviso de edición del catálogo hecha fuera de `ingesta.py` (p. ej. en Supabase):
+    POST {"unidades": [ids], "recalcular": true} borra lo cacheado con sus datos
+    anteriores y encola su recálculo. Solo se recalcula lo que usaba esas unidades.
+    """
+    from lotes import resolver_unidades
+    from services import dependencias, trabajos as cola
+
+    try:
+        cuerpo = await request.json()
+        ids = [str(u) for u in cuerpo.get("unidades") or []]
+    except (ValueError, AttributeError, TypeError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if not ids:
+        return JSONResponse({"error": "indica las unidades cambiadas en 'unidades'"}, status_code=400)
+    unidades = await run_in_threadpool(resolver_unidades, ids)
+    res = await run_in_threadpool(dependencias.actualizar, unidades, bool(cuerpo.get("recalcular", True)))
+    if res["recalculos"]:
+        cola.arrancar()
+    return JSONResponse(dict(res, no_encontradas=[u for u in ids if u not in unidades]))
+
+
+api = Starlette(routes=[
+    Route("/api/arranque", arranque),
+    Route("/api/img/{unit_id}", imagen),
+    Route("/api/metricas", metricas),
+    Route("/api/rejilla/{unit_id}", rejilla),
+    Route("/api/reparto/{unit_id}", reparto),
+    Route("/api/lista", lista),
+    Route("/api/iniciativa", iniciativa),
+    Route("/api/buscar", buscar),
+    Route("/api/trabajos", trabajos, methods=["GET", "POST"]),
+    Route("/api/trabajos/{id}", trabajo, methods=["GET", "DELETE"]),
+    Route("/api/catalogo/actualizado", catalogo_actualizado, methods=["POST"]),
+])
+
+
+class _Frontal:
+    """Mide el tiempo hasta la primera petición y sirve el frontend precompilado si lo hay."""
+
+    def __init__(self, app, directorio: str = ""):
+        self.app = app
+        self.estaticos = None
+        if directorio and os.path.isdir(directorio):
+            from starlette.staticfiles import StaticFiles
+            self.estaticos = StaticFiles(directory=directorio, html=True)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            if _arranque["primera_peticion_s"] is None:
+                _arranque["primera_peticion_s"] = time.time() - T0
+                print(f"[arranque] Primera petición a los {_arranque['primera_peticion_s']:.2f} s")
+            if (self.estaticos is not None and scope["method"] in ("GET", "HEAD")
+                    and not scope["path"].startswith(_PREFIJOS_BACKEND)):
+                await self.estaticos(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+def frontal(asgi_app):
+    return _Frontal(asgi_app, FRONTEND_DIR)
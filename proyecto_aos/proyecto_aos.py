@@ -1,25 +1,32 @@
 """Welcome to Reflex! This file outlines the steps to create a basic app."""
+import asyncio
+import functools
+import io
+import json
 import reflex as rx
 from typing import List,Dict,Tuple
-from services.unidad_service import get_factions, get_units_by_faction
 
 
 from rxconfig import config
 
+# Límite orientativo para el payload de resultados que se envía por websocket
+PAYLOAD_MAX_BYTES = 4096
+MAX_RONDAS = 10
+# Monte Carlo adaptativo: anchura del IC de la tasa de victoria y tiempo máximo
+MC_ANCHO_IC = 0.05
+MC_PRESUPUESTO_S = 3.0
+# Monte Carlo grande enviado a la cola de trabajos (ver services/trabajos.py)
+MC_ENSAYOS_TRABAJO = 1_000_000
+TRABAJO_SONDEO_S = 0.5
 
-class SimState(rx.State):
-    factions_names: list[str] = []
-    factions_map: dict[str, str] = {}
-
-    units1_names: list[str] = []
-    units1_map: dict[str, str] = {}
-    units2_names: list[str] = []
-    units2_map: dict[str, str] = {}
 
-    faction1_name: str = ""
-    faction2_name: str = ""
-    unit1_name: str = ""
-    unit2_name: str = ""
+class SimState(rx.State):
+    # Solo los ids seleccionados: nombres y listas salen del catálogo compartido del proceso
+    catalog_version: int = 0
+    faction1_id: str = ""
+    faction2_id: str = ""
+    unit1_id: str = ""
+    unit2_id: str = ""
 
     charge1: bool = False
     charge2: bool = False
@@ -32,50 +39,120 @@ class SimState(rx.State):
     champion2: bool = False
 
     result_text: str = ""
-    result_lines: list[str] = []
-    result_output: str = ""
+    # Resumen compacto y filas por ronda: es lo único que viaja al cliente tras simular
+    result_summary: dict[str, str | int] = {}
+    result_rounds: list[list[int]] = []
+    # El detalle de texto solo se envía si el usuario lo pide
+    result_detail: str = ""
+    show_detail: bool = False
+    _result_detail: str = ""
+    _payload_bytes: int = 0
+
+    # Estado de la simulación en curso
+    sim_running: bool = False
+    sim_progress: int = 0
+    sim_cancel: bool = False
+
+    # Monte Carlo adaptativo opcional tras la simulación por medias
+    mc_mode: bool = False
+    # Perfilar la próxima simulación (equivale a AOS_PERFIL para esta petición)
+    profile_mode: bool = False
+    mc_summary: dict[str, str | int] = {}
+
+    # Rejilla "¿qué pasaría?": filas de celdas [texto, color] listas para pintar
+    what_if_title: str = ""
+    what_if_rows: list[list[list[str]]] = []
+
+    # Comparación de iniciativa: quién golpea primero y con o sin carga, en una pasada
+    initiative_title: str = ""
+    initiative_rows: list[list[str]] = []
+
+    # Trabajo en la cola local: se envía, se consulta su progreso y se puede cancelar
+    job_id: str = ""
+    job_status: str = ""
+    job_progress: int = 0
+
+    # Buscador de unidades y armas de todas las facciones
+    search_query: str = ""
+    search_results: list[dict[str, str]] = []
 
     unit1_attrs: dict = {}
     unit2_attrs: dict = {}
 
     
+    @rx.var
+    def factions_names(self) -> list[str]:
+        from services import catalogo
+        # Todas las vars del catálogo leen catalog_version para recalcularse cuando se refresca
+        return list(catalogo.faction_names()) if self.catalog_version else []
+
+    @rx.var
+    def faction1_name(self) -> str:
+        from services import catalogo
+        return catalogo.faction_name(self.faction1_id) if self.catalog_version else ""
+
+    @rx.var
+    def faction2_name(self) -> str:
+        from services import catalogo
+        return catalogo.faction_name(self.faction2_id) if self.catalog_version else ""
+
+    @rx.var
+    def units1_names(self) -> list[str]:
+        from services import catalogo
+        return list(catalogo.unit_names(self.faction1_id)) if self.catalog_version else []
+
+    @rx.var
+    def units2_names(self) -> list[str]:
+        from services import catalogo
+        return list(catalogo.unit_names(self.faction2_id)) if self.catalog_version else []
+
+    @rx.var
+    def unit1_name(self) -> str:
+        from services import catalogo
+        return catalogo.unit_name(self.unit1_id) if self.catalog_version else ""
+
+    @rx.var
+    def unit2_name(self) -> str:
+        from services import catalogo
+        return catalogo.unit_name(self.unit2_id) if self.catalog_version else ""
+
     def on_load(self):
-        rows = get_factions()  # [(id, name)]
-        self.factions_names = [n for (_id, n) in rows]
-        self.factions_map   = {n: _id for (_id, n) in rows}
-        '''self.charge1 = False
-        self.charge2 = False
-        self.bonus1 = ""
-        self.bonus2 = ""'''
+        self._sincronizar_catalogo()
         self.update_unit1_attrs()
         self.update_unit2_attrs()
 
+    def _sincronizar_catalogo(self):
+        """Recoge un refresco del catálogo en segundo plano en la próxima interacción."""
+        from services import catalogo
+        v = catalogo.version()
+        if v != self.catalog_version:
+            self.catalog_version = v
+
     def set_faction1_name(self, name: str):
-        
-        self.faction1_name = name
-        fid = self.factions_map.get(name, "")
-        rows = get_units_by_faction(fid)
-        self.units1_names = [n for (_id, n) in rows]
-        self.units1_map   = {n: _id for (_id, n) in rows}
-        self.unit1_name   = self.units1_names[0] if self.units1_names else ""
+        # Filtrado en memoria sobre el catálogo compartido, sin ir a la base de datos
+        from services import catalogo
+        self.faction1_id = catalogo.faction_id(name)
+        names = catalogo.unit_names(self.faction1_id)
+        self.unit1_id = catalogo.unit_id(self.faction1_id, names[0]) if names else ""
+        self.update_unit1_attrs()
 
     def set_faction2_name(self, name: str):
-        
-        self.faction2_name = name
-        fid = self.factions_map.get(name, "")
-        rows = get_units_by_faction(fid)
-        self.units2_names = [n for (_id, n) in rows]
-        self.units2_map   = {n: _id for (_id, n) in rows}
-        self.unit2_name   = self.units2_names[0] if self.units2_names else ""
-
-    def set_unit1_name(self, name: str): 
-        self.unit1_name = name
+        from services import catalogo
+        self.faction2_id = catalogo.faction_id(name)
+        names = catalogo.unit_names(self.faction2_id)
+        self.unit2_id = catalogo.unit_id(self.faction2_id, names[0]) if names else ""
+        self.update_unit2_attrs()
+
+    def set_unit1_name(self, name: str):
+        from services import catalogo
+        self.unit1_id = catalogo.unit_id(self.faction1_id, name)
         self.update_unit1_attrs()
-        
-    def set_unit2_name(self, name: str): 
-        self.unit2_name = name
+
+    def set_unit2_name(self, name: str):
+        from services import catalogo
+        self.unit2_id = catalogo.unit_id(self.faction2_id, name)
         self.update_unit2_attrs()
-        
+
     def set_charge1(self, v: bool): 
         self.charge1 = bool(v)
         if not self.charge1:
@@ -108,172 +185,296 @@ class SimState(rx.State):
         self.update_unit2_attrs()
 
     def update_unit1_attrs(self):
-        from services.unidad_service import obtener_unidad_por_id, obtener_armas_de_unidad, obtener_ataques_totales
-        units_map = self.units1_map 
-        unit_name = self.unit1_name 
-        unit_id = units_map.get(unit_name, "")
-        if not unit_id:
-            self.unit1_attrs = {}
-            return
-        unidad = obtener_unidad_por_id(unit_id)
-        if not unidad:
-            self.unit1_attrs = {}
-            return
-        base_size = int(unidad.get("base_size", 1))
-        wounds = int(unidad.get("wounds", 1))
-        attacks = obtener_ataques_totales(unit_id)
-        can_be_reinforced = bool(unidad.get("reinforced", False))
-        reinforced = self.reinforced1 if can_be_reinforced else False
-        champion = self.champion1 
-        models = base_size * (2 if reinforced else 1)
-        total_attacks = models * attacks + (1 if champion else 0)
-        total_wounds = models * wounds
-
-        # Obtener arma principal
-        armas = obtener_armas_de_unidad(unit_id)
-        arma = armas[0] if armas else {}
-        base_rend = int(arma.get("rend", 0)) if arma.get("rend") is not None else 0
-        base_damage = arma.get("damage_formula", "1")
-        # Ajustar rend y daño si ha cargado
-        rend = base_rend
-        damage = base_damage
-        if self.charge1:
-            if self.bonus1 == "Rend -1":
-                rend = base_rend - 1
-            elif self.bonus1 == "Daño +1":
-                try:
-                    damage = str(int(base_damage) + 1)
-                except Exception:
-                    damage = f"{base_damage}+1"
-
-        self.unit1_attrs = {
-            "models": models,
-            "wounds_per_model": wounds,
-            "total_wounds": total_wounds,
-            "attacks_per_model": attacks,
-            "total_attacks": total_attacks,
-            "champion": champion,
-            "reinforced": reinforced,
-            "can_be_reinforced": can_be_reinforced,
-            "arma_nombre": arma.get("name", "-"),
-            "arma_rend": rend,
-            "arma_damage": damage,
-            "img_url": unidad.get("img_url", ""),
-        }
-        if not can_be_reinforced:
+        # Casi todos los handlers pasan por aquí: buen momento para ver si cambió el catálogo
+        self._sincronizar_catalogo()
+        attrs = _calcular_attrs(self.unit1_id, self.reinforced1, self.champion1, self.charge1, self.bonus1)
+        # Solo reasignar si cambia: cada asignación se envía entera al cliente
+        if attrs != self.unit1_attrs:
+            self.unit1_attrs = attrs
+        if not attrs.get("can_be_reinforced", False) and self.reinforced1:
             self.reinforced1 = False
 
     def update_unit2_attrs(self):
-        from services.unidad_service import obtener_unidad_por_id, obtener_armas_de_unidad, obtener_ataques_totales
-        units_map = self.units2_map 
-        unit_name = self.unit2_name 
-        unit_id = units_map.get(unit_name, "")
-        if not unit_id:
-            self.unit2_attrs = {}
-            return
-        unidad = obtener_unidad_por_id(unit_id)
-        if not unidad:
-            self.unit2_attrs = {}
-            return
-        base_size = int(unidad.get("base_size", 1))
-        wounds = int(unidad.get("wounds", 1))
-        attacks = obtener_ataques_totales(unit_id)
-        can_be_reinforced = bool(unidad.get("reinforced", False))
-        reinforced = self.reinforced2 if can_be_reinforced else False
-        champion = self.champion2 
-        models = base_size * (2 if reinforced else 1)
-        total_attacks = models * attacks + (1 if champion else 0)
-        total_wounds = models * wounds
-
-        armas = obtener_armas_de_unidad(unit_id)
-        arma = armas[0] if armas else {}
-        base_rend = int(arma.get("rend", 0)) if arma.get("rend") is not None else 0
-        base_damage = arma.get("damage_formula", "1")
-        rend = base_rend
-        damage = base_damage
-        if self.charge2:
-            if self.bonus2 == "Rend -1":
-                rend = base_rend - 1
-            elif self.bonus2 == "Daño +1":
-                try:
-                    damage = str(int(base_damage) + 1)
-                except Exception:
-                    damage = f"{base_damage}+1"
-
-        self.unit2_attrs = {
-            "models": models,
-            "wounds_per_model": wounds,
-            "total_wounds": total_wounds,
-            "attacks_per_model": attacks,
-            "total_attacks": total_attacks,
-            "champion": champion,
-            "reinforced": reinforced,
-            "can_be_reinforced": can_be_reinforced,
-            "arma_nombre": arma.get("name", "-"),
-            "arma_rend": rend,
-            "arma_damage": damage,
-            "img_url": unidad.get("img_url", ""),
-        }
-        if not can_be_reinforced:
+        self._sincronizar_catalogo()
+        attrs = _calcular_attrs(self.unit2_id, self.reinforced2, self.champion2, self.charge2, self.bonus2)
+        if attrs != self.unit2_attrs:
+            self.unit2_attrs = attrs
+        if not attrs.get("can_be_reinforced", False) and self.reinforced2:
             self.reinforced2 = False
 
     def get_unit_attrs(self, left: bool) -> dict:
         # Devuelve los atributos de la unidad seleccionada, calculando totales
         return self.unit1_attrs if left else self.unit2_attrs
 
-    def simulate(self):
-        uid1 = self.units1_map.get(self.unit1_name, "")
-        uid2 = self.units2_map.get(self.unit2_name, "")
-        if not uid1 or not uid2:
-            self.result_text = "Selecciona faccion y unidad en ambos lados"
-            self.result_lines = []
-            self.result_output = ""
-            return
+    def set_mc_mode(self, v: bool):
+        self.mc_mode = bool(v)
 
-        # Construir diccionarios de unidad con los atributos actuales para pasarlos al simulador
-        from services.unidad_service import obtener_unidad_por_id
-        from simulador import simular_combate_completo_str
-
-        unidad1 = obtener_unidad_por_id(uid1) or {}
-        unidad2 = obtener_unidad_por_id(uid2) or {}
-
-        # Actualizar atributos relevantes antes de simular
-        unidad1 = dict(unidad1)
-        unidad2 = dict(unidad2)
-        # No multipliques base_size aquí: el simulador ya respeta la bandera 'reinforced'
-        unidad1['base_size'] = int(unidad1.get('base_size', 1))
-        unidad2['base_size'] = int(unidad2.get('base_size', 1))
-        unidad1['reinforced'] = bool(self.reinforced1)
-        unidad2['reinforced'] = bool(self.reinforced2)
-        
-        # ¡IMPORTANTE! Pasar la bandera de campeón al diccionario que recibe el simulador
-        unidad1['champion'] = bool(self.champion1)
-        unidad2['champion'] = bool(self.champion2)
-
-        # Ejecutar simulación teniendo en cuenta quién ha cargado: si la unidad derecha cargó,
-        # hará el primer ataque y por tanto intercambiamos el orden al llamar al simulador.
+    def set_profile_mode(self, v: bool):
+        self.profile_mode = bool(v)
+
+    def _set_resultado(self, text: str, summary: dict, rounds: list, detail: str):
+        self.result_text = text
+        self.mc_summary = {}
+        self.result_summary = summary
+        self.result_rounds = rounds
+        self.result_detail = ""
+        self.show_detail = False
+        # El texto completo se queda en el backend hasta que se pida
+        self._result_detail = detail
+        self._payload_bytes = _medir_payload(text, summary, rounds)
+        if self._payload_bytes > PAYLOAD_MAX_BYTES:
+            print(f"[SimState] Payload de resultado grande: {self._payload_bytes} bytes")
+
+    @rx.event(background=True)
+    async def simulate(self):
+        """
+        Simulación en segundo plano: cada ronda resuelta se envía al cliente en cuanto
+        está lista, con progreso y posibilidad de cancelar.
+        """
+        async with self:
+            if self.sim_running:
+                return
+            uid1 = self.unit1_id
+            uid2 = self.unit2_id
+            if not uid1 or not uid2:
+                self._set_resultado("Selecciona faccion y unidad en ambos lados", {}, [], "")
+                return
+            reinforced1, reinforced2 = bool(self.reinforced1), bool(self.reinforced2)
+            champion1, champion2 = bool(self.champion1), bool(self.champion2)
+            charge1, charge2 = bool(self.charge1), bool(self.charge2)
+            bonus1 = self.bonus1 if charge1 else ""
+            bonus2 = self.bonus2 if charge2 else ""
+            mc_mode = bool(self.mc_mode)
+            profile_mode = bool(self.profile_mode)
+            self._set_resultado("Simulando...", {}, [], "")
+            self.sim_running = True
+            self.sim_cancel = False
+            self.sim_progress = 0
+
+        from services import almacen_compartido, dependencias, perfilado
+        # Sin perfilado, `en` devuelve la función tal cual
+        perfil = perfilado.sesion("simulate", forzar=profile_mode and perfilado.forzado_permitido())
+        en = (lambda fn: fn) if perfil is None else (lambda fn: functools.partial(perfil.ejecutar, fn))
+        clave = almacen_compartido.clave_resultado(
+            "combate", uid1, uid2, reinforced1, reinforced2, champion1, champion2,
+            charge2 and not charge1, bonus1, bonus2, MAX_RONDAS,
+        )
         try:
-            if bool(self.charge2) and not bool(self.charge1):
-                # Unidad 2 ha cargado: atacará primero
-                salida = simular_combate_completo_str(unidad2, unidad1, max_rondas=10)
+            # Resultado caliente calculado por cualquier worker: se sirve al momento
+            cacheado = await asyncio.to_thread(almacen_compartido.leer_resultado, clave)
+            # Al perfilar se ignora la caché: interesa medir la simulación
+            if perfil is not None:
+                cacheado = None
+            if cacheado and not mc_mode:
+                async with self:
+                    self._set_resultado("Simulación ejecutada", cacheado["summary"], cacheado["rounds"], cacheado["detail"])
+                return
+
+            unidad1, unidad2 = await asyncio.to_thread(
+                en(_preparar_unidades), uid1, uid2, reinforced1, reinforced2, champion1, champion2, bonus1, bonus2
+            )
+            # Si la unidad derecha cargó (y la izquierda no) ataca primero: se invierte el orden
+            if charge2 and not charge1:
+                atacante, defensor = unidad2, unidad1
+            else:
+                atacante, defensor = unidad1, unidad2
+
+            if cacheado:
+                async with self:
+                    self._set_resultado("Simulación ejecutada", cacheado["summary"], cacheado["rounds"], cacheado["detail"])
             else:
-                # Por defecto, unidad1 ataca primero (incluye caso en que ambos o ninguno cargaron)
-                salida = simular_combate_completo_str(unidad1, unidad2, max_rondas=10)
+                from simulador import iterar_combate
+                buf = io.StringIO()
+                gen = iterar_combate(atacante, defensor, max_rondas=MAX_RONDAS, out=buf)
+                rounds: list[list[int]] = []
+                res = None
+                while res is None:
+                    fila, res = await asyncio.to_thread(en(_siguiente_paso), gen)
+                    async with self:
+                        if self.sim_cancel:
+                            gen.close()
+                            self._set_resultado("Simulación cancelada", {}, rounds, buf.getvalue())
+                            return
+                        if fila is not None:
+                            rounds.append(list(fila))
+                            self.result_rounds = rounds
+                            self.sim_progress = min(100, int(fila[0] * 100 / MAX_RONDAS))
+
+                valor = dependencias.resumen_para_cache(res, buf.getvalue())
+                async with self:
+                    self._set_resultado("Simulación ejecutada", valor["summary"], valor["rounds"], valor["detail"])
+                # Con sus dependencias y la receta para rehacerlo si se edita alguna de las unidades
+                receta = {"tipo": "combate", "params": _params_enfrentamiento(
+                    uid1, uid2, reinforced1, reinforced2, champion1, champion2, charge1, charge2, bonus1, bonus2,
+                )}
+                await asyncio.to_thread(_guardar_en_cache, clave, valor, [uid1, uid2], receta)
+
+            if mc_mode:
+                await _stream_montecarlo(self, atacante, defensor, en)
+        except Exception as e:
+            async with self:
+                self._set_resultado("Error al ejecutar simulación", {}, [], str(e))
+                self.result_detail = str(e)
+                self.show_detail = True
+        finally:
+            if perfil is not None:
+                await asyncio.to_thread(perfil.cerrar)
+            async with self:
+                self.sim_running = False
+                self.sim_progress = 100
+
+    def cancel_simulation(self):
+        if self.sim_running:
+            self.sim_cancel = True
 
-            self.result_text = "Simulación ejecutada"
-            self.result_output = salida
-            self.result_lines = salida.splitlines()
+    @rx.event(background=True)
+    async def submit_mc_job(self):
+        """
+        Monte Carlo de MC_ENSAYOS_TRABAJO ensayos en la cola de trabajos: lo ejecuta un
+        proceso aparte y aquí solo se consulta el progreso hasta que termina.
+        """
+        from services import trabajos
+
+        async with self:
+            if self.job_status in ("pendiente", "ejecutando") or not self.unit1_id or not self.unit2_id:
+                return
+            params = _params_enfrentamiento(
+                self.unit1_id, self.unit2_id, bool(self.reinforced1), bool(self.reinforced2),
+                bool(self.champion1), bool(self.champion2), bool(self.charge1), bool(self.charge2),
+                self.bonus1 if self.charge1 else "", self.bonus2 if self.charge2 else "",
+            )
+            params["ensayos"] = MC_ENSAYOS_TRABAJO
+            self.job_status = "pendiente"
+            self.job_progress = 0
+            self.mc_summary = {}
+
+        try:
+            job_id = await asyncio.to_thread(trabajos.enviar, "montecarlo", params)
+            await asyncio.to_thread(trabajos.arrancar)
         except Exception as e:
-            self.result_text = "Error al ejecutar simulación"
-            self.result_output = str(e)
-            self.result_lines = [str(e)]
+            async with self:
+                self.job_status = f"error: {e}"
+            return
+        async with self:
+            self.job_id = job_id
+
+        while True:
+            await asyncio.sleep(TRABAJO_SONDEO_S)
+            e = await asyncio.to_thread(trabajos.estado, job_id)
+            async with self:
+                if self.job_id != job_id:
+                    return
+                if e is None:
+                    self.job_status = "borrado"
+                    return
+                self.job_status = e["estado"]
+                self.job_progress = int(e["progreso"] * 100)
+                if e["estado"] == "hecho":
+                    # El resumen se pinta en el panel de resultados, aunque no se haya simulado antes
+                    self.result_text = self.result_text or "Monte Carlo en cola terminado"
+                    self.mc_summary = _resumen_mc(e["resultado"])
+                elif e["estado"] == "error":
+                    self.job_status = f"error: {e.get('error', '')}"
+                if e["estado"] in trabajos.TERMINADOS:
+                    return
+
+    async def cancel_job(self):
+        from services import trabajos
+        if self.job_id:
+            await asyncio.to_thread(trabajos.cancelar, self.job_id)
+
+    @rx.event(background=True)
+    async def compare_initiative(self):
+        """Los cuatro órdenes de golpe (unidad 1 o 2 primero, con o sin carga) en una sola llamada."""
+        import time
+        from simulador import comparar_iniciativa
+
+        async with self:
+            uid1, uid2 = self.unit1_id, self.unit2_id
+            if not uid1 or not uid2:
+                self.initiative_title = "Selecciona faccion y unidad en ambos lados"
+                self.initiative_rows = []
+                return
+            # Los bonos de carga solo actúan en los escenarios en que su unidad carga
+            args = (uid1, uid2, bool(self.reinforced1), bool(self.reinforced2),
+                    bool(self.champion1), bool(self.champion2), self.bonus1, self.bonus2)
+            self.initiative_title = "Comparando..."
+        try:
+            t0 = time.perf_counter()
+            unidad1, unidad2 = await asyncio.to_thread(_preparar_unidades, *args)
+            res = await asyncio.to_thread(comparar_iniciativa, unidad1, unidad2, MAX_RONDAS)
+            ms = (time.perf_counter() - t0) * 1000
+        except Exception as e:
+            async with self:
+                self.initiative_title = f"Error al comparar: {e}"
+                self.initiative_rows = []
+            return
+        nombres = {"1": unidad1.get("name", "Unidad 1"), "2": unidad2.get("name", "Unidad 2")}
+        async with self:
+            self.initiative_title = f"Orden de golpe ({ms:.0f} ms)"
+            self.initiative_rows = [
+                [nombres[e["primero"]], "Sí" if e["carga"] else "No", e["ganador"], str(e["rondas"]),
+                 str(e["restantes1"]), str(e["restantes2"])]
+                for e in res["escenarios"]
+            ]
+
+    def compute_what_if(self, left: bool):
+        """Heridas medias de la unidad contra toda la rejilla salvación x ward x rend."""
+        import time
+        from modificadores import con_bono_carga
+        from services.unidad_service import obtener_unidad_por_id
+        from simulador import rejilla_que_pasaria
+
+        uid = self.unit1_id if left else self.unit2_id
+        if not uid:
+            self.what_if_title = ""
+            self.what_if_rows = []
+            return
+        unidad = dict(obtener_unidad_por_id(uid) or {})
+        unidad["reinforced"] = bool(self.reinforced1 if left else self.reinforced2)
+        carga = bool(self.charge1 if left else self.charge2)
+        if carga:
+            unidad = con_bono_carga(unidad, self.bonus1 if left else self.bonus2)
+        t0 = time.perf_counter()
+        grid = rejilla_que_pasaria(unidad, carga=carga)
+        ms = (time.perf_counter() - t0) * 1000
+        self.what_if_title = f"{unidad.get('name', '')}: heridas medias por salvación / ward ({ms:.2f} ms)"
+        self.what_if_rows = _filas_rejilla(grid)
+
+    def set_search_query(self, q: str):
+        """Buscar mientras se escribe: índice en memoria, sin ir a la base de datos."""
+        from services import buscador
+        self._sincronizar_catalogo()
+        self.search_query = q
+        self.search_results = [
+            {k: str(v) for k, v in r.items() if k != "puntos"} for r in buscador.buscar(q, limite=8)
+        ] if q.strip() else []
+
+    def pick_search_result(self, unit_id: str, left: bool):
+        """Coloca la unidad elegida en el buscador en el lado indicado."""
+        from services import catalogo
+        fid = catalogo.unit_faction(unit_id)
+        if left:
+            self.faction1_id, self.unit1_id = fid, unit_id
+            self.update_unit1_attrs()
+        else:
+            self.faction2_id, self.unit2_id = fid, unit_id
+            self.update_unit2_attrs()
+        self.search_query = ""
+        self.search_results = []
+
+    def toggle_detail(self):
+        """Carga bajo demanda el texto completo de la simulación."""
+        self.show_detail = not self.show_detail
+        self.result_detail = self._result_detail if self.show_detail else ""
 
     def clear_all(self):
         """Resetea todos los valores seleccionados y el output de la simulación"""
-        self.faction1_name = ""
-        self.faction2_name = ""
-        self.unit1_name = ""
-        self.unit2_name = ""
+        self.cancel_simulation()
+        self.faction1_id = ""
+        self.faction2_id = ""
+        self.unit1_id = ""
+        self.unit2_id = ""
         self.charge1 = False
         self.charge2 = False
         self.bonus1 = ""
@@ -282,17 +483,174 @@ class SimState(rx.State):
         self.reinforced2 = False
         self.champion1 = False
         self.champion2 = False
-        self.result_text = ""
-        self.result_lines = []
-        self.result_output = ""
-        self.units1_names = []
-        self.units1_map = {}
-        self.units2_names = []
-        self.units2_map = {}
+        self._set_resultado("", {}, [], "")
         self.unit1_attrs = {}
         self.unit2_attrs = {}
+        self.search_query = ""
+        self.search_results = []
+        self.job_id = ""
+        self.job_status = ""
+        self.job_progress = 0
+        self.initiative_title = ""
+        self.initiative_rows = []
+
+def _calcular_attrs(unit_id: str, reinforced: bool, champion: bool, charge: bool, bonus: str) -> dict:
+    from modificadores import con_bono_carga
+    from services.imagenes import url_publica
+    from services.unidad_service import obtener_unidad_por_id, obtener_armas_de_unidad, obtener_ataques_totales
+    from simulador import construir_perfil_ataque
+    from utils import formula_texto
+    if not unit_id:
+        return {}
+    unidad = obtener_unidad_por_id(unit_id)
+    if not unidad:
+        return {}
+    base_size = int(unidad.get("base_size", 1))
+    wounds = int(unidad.get("wounds", 1))
+    attacks = obtener_ataques_totales(unit_id)
+    can_be_reinforced = bool(unidad.get("reinforced", False))
+    reinforced = reinforced if can_be_reinforced else False
+    models = base_size * (2 if reinforced else 1)
+    total_attacks = models * attacks + (1 if champion else 0)
+    total_wounds = models * wounds
+
+    # Arma principal con los mismos modificadores que aplicará el motor al cargar
+    armas = obtener_armas_de_unidad(unit_id)
+    arma = armas[0] if armas else {}
+    rend = 0
+    damage = arma.get("damage_formula", "1")
+    if arma:
+        perfil = construir_perfil_ataque(con_bono_carga(unidad, bonus if charge else ""), arma, carga=charge)
+        rend = perfil["rend"]
+        damage = formula_texto(perfil["damage_terms"])
+
+    return {
+        "models": models,
+        "wounds_per_model": wounds,
+        "total_wounds": total_wounds,
+        "attacks_per_model": attacks,
+        "total_attacks": total_attacks,
+        "champion": champion,
+        "reinforced": reinforced,
+        "can_be_reinforced": can_be_reinforced,
+        "arma_nombre": arma.get("name", "-"),
+        "arma_rend": rend,
+        "arma_damage": damage,
+        # Miniatura servida por el propio backend (ver proyecto_aos/api.py), no la original remota
+        "img_url": url_publica(config.api_url, unit_id, unidad.get("img_url") or ""),
+    }
+
+
+def _preparar_unidades(uid1: str, uid2: str, reinforced1: bool, reinforced2: bool,
+                       champion1: bool, champion2: bool, bonus1: str = "", bonus2: str = "") -> tuple[dict, dict]:
+    """
+    Construye los diccionarios de unidad con los atributos actuales para el simulador.
+    `bonus1`/`bonus2` son los bonos de carga elegidos (vacíos si la unidad no cargó):
+    el motor los aplica como modificadores solo en la ronda de carga.
+    """
+    from modificadores import con_bono_carga
+    from services.unidad_service import obtener_unidad_por_id
+
+    unidad1 = dict(obtener_unidad_por_id(uid1) or {})
+    unidad2 = dict(obtener_unidad_por_id(uid2) or {})
+    # No multipliques base_size aquí: el simulador ya respeta la bandera 'reinforced'
+    unidad1['base_size'] = int(unidad1.get('base_size', 1))
+    unidad2['base_size'] = int(unidad2.get('base_size', 1))
+    unidad1['reinforced'] = reinforced1
+    unidad2['reinforced'] = reinforced2
+    # ¡IMPORTANTE! Pasar la bandera de campeón al diccionario que recibe el simulador
+    unidad1['champion'] = champion1
+    unidad2['champion'] = champion2
+    return con_bono_carga(unidad1, bonus1), con_bono_carga(unidad2, bonus2)
+
+
+def _params_enfrentamiento(uid1: str, uid2: str, reinforced1: bool, reinforced2: bool, champion1: bool,
+                           champion2: bool, charge1: bool, charge2: bool, bonus1: str = "", bonus2: str = "") -> dict:
+    """
+    Opciones de la pantalla como fila de `lotes.py`, con el mismo orden que `simulate`:
+    si solo cargó la unidad derecha, ataca ella. El bono del defensor no se pasa: solo
+    carga el atacante.
+    """
+    n = ("2", "1") if charge2 and not charge1 else ("1", "2")
+    valores = {
+        "1": (uid1, reinforced1, champion1, bonus1),
+        "2": (uid2, reinforced2, champion2, bonus2),
+    }
+    (ida, ra, ca, ba), (idd, rd, cd, _) = valores[n[0]], valores[n[1]]
+    return {
+        "atacante": ida, "defensor": idd,
+        "reforzada_atacante": ra, "reforzada_defensor": rd,
+        "campeon_atacante": ca, "campeon_defensor": cd,
+        "bono_atacante": ba,
+        "max_rondas": MAX_RONDAS,
+    }
+
+
+def _guardar_en_cache(clave: str, valor: dict, unit_ids: list, receta: dict) -> None:
+    from services import almacen_compartido, dependencias
+
+    almacen_compartido.guardar_resultado(clave, valor, huellas=dependencias.huellas(unit_ids), receta=receta)
+
+
+def _siguiente_paso(gen) -> tuple:
+    """Avanza un generador del simulador: (parcial, None) por paso y (None, resultado) al terminar."""
+    try:
+        return next(gen), None
+    except StopIteration as fin:
+        return None, fin.value
+
+
+def _resumen_mc(r: dict) -> dict:
+    """Resumen compacto (cadenas ya formateadas) de un resultado Monte Carlo."""
+    v = r["victoria_atacante"]
+    resumen = {
+        "ensayos": int(r["ensayos"]),
+        "victoria": f"{v['media'] * 100:.1f}%",
+        "ic": "" if v["ic_inf"] is None else f"[{v['ic_inf'] * 100:.1f}%, {v['ic_sup'] * 100:.1f}%]",
+        "sup_atac": f"{r['supervivientes_atacante']['media']:.1f}",
+        "sup_def": f"{r['supervivientes_defensor']['media']:.1f}",
+    }
+    if "motivo" in r:
+        resumen["motivo"] = r["motivo"]
+    return resumen
+
+
+async def _stream_montecarlo(state, atacante: dict, defensor: dict, en=lambda fn: fn):
+    """Lanza el Monte Carlo adaptativo enviando el resumen parcial tras cada lote."""
+    from montecarlo import iterar_montecarlo_adaptativo
+
+    gen = iterar_montecarlo_adaptativo(atacante, defensor, ancho_ic=MC_ANCHO_IC,
+                                       presupuesto_s=MC_PRESUPUESTO_S, max_rondas=MAX_RONDAS)
+    final = None
+    while final is None:
+        parcial, final = await asyncio.to_thread(en(_siguiente_paso), gen)
+        async with state:
+            if state.sim_cancel:
+                gen.close()
+                return
+            state.mc_summary = _resumen_mc(parcial if final is None else final)
+
+
+def _filas_rejilla(grid: dict) -> list:
+    """Convierte la rejilla en filas [etiqueta, celdas...] con color de mapa de calor."""
+    maximo = max((v for mod in grid["heridas"] for fila in mod for v in fila), default=0.0) or 1.0
+    cabecera = [["", ""]] + [[f"Ward {w}+" if w else "Sin ward", ""] for w in grid["wards"]]
+    filas = [cabecera]
+    for mod, filas_mod in zip(grid["mods_rend"], grid["heridas"]):
+        for save, valores in zip(grid["saves"], filas_mod):
+            etiqueta = f"Salv. {save}+" + (f" / rend -{mod}" if mod else "")
+            celdas = [[f"{v:.1f}", f"rgba(26, 171, 138, {0.1 + 0.8 * v / maximo:.2f})"] for v in valores]
+            filas.append([[etiqueta, ""]] + celdas)
+    return filas
+
+
+def _medir_payload(*valores) -> int:
+    """Tamaño aproximado en bytes de lo que se enviará al cliente."""
+    return len(json.dumps(valores, ensure_ascii=False, default=str).encode("utf-8"))
+
 
 def side_card(title: str, left: bool) -> rx.Component:
+    from modificadores import BONOS_CARGA
     S = SimState
     fac_val, set_fac = (S.faction1_name, S.set_faction1_name) if left else (S.faction2_name, S.set_faction2_name)
     unit_val, set_unit = (S.unit1_name, S.set_unit1_name) if left else (S.unit2_name, S.set_unit2_name)
@@ -334,7 +692,7 @@ def side_card(title: str, left: bool) -> rx.Component:
     overlay = rx.cond(
         img_url & (img_url != ""),
         rx.box(
-            rx.image(src=img_url, class_name="h-40", style=overlay_style),
+            rx.image(src=img_url, loading="lazy", class_name="h-40", style=overlay_style),
             rx.box(style=gradient_style)
         )
     )
@@ -367,7 +725,7 @@ def side_card(title: str, left: bool) -> rx.Component:
             charge_val,
             rx.box(
                 rx.radio_group(
-                    items=["Rend -1", "Daño +1"],
+                    items=list(BONOS_CARGA),
                     value=bonus_val,
                     on_change=set_bonus,
                     class_name="gap-2",
@@ -397,11 +755,205 @@ def side_card(title: str, left: bool) -> rx.Component:
         class_name=box_class,
     )
 
+def heat_cell(cell) -> rx.Component:
+    return rx.table.cell(cell[0], style={"background": cell[1], "textAlign": "center"})
+
+def heat_row(row) -> rx.Component:
+    return rx.table.row(rx.foreach(row, heat_cell))
+
+def search_row(r) -> rx.Component:
+    S = SimState
+    return rx.hstack(
+        rx.text(r["nombre"], class_name="font-semibold"),
+        rx.cond(r["tipo"] == "arma", rx.text(r["unidad"], class_name="opacity-70")),
+        rx.text(r["faccion"], class_name="opacity-50 text-xs"),
+        rx.spacer(),
+        rx.button("→ 1", size="1", variant="outline", on_click=S.pick_search_result(r["unit_id"], True)),
+        rx.button("→ 2", size="1", variant="outline", on_click=S.pick_search_result(r["unit_id"], False)),
+        class_name="w-full items-center gap-2 text-sm",
+    )
+
+def search_panel() -> rx.Component:
+    S = SimState
+    return rx.box(
+        rx.debounce_input(
+            rx.input(
+                placeholder="Buscar unidad o arma en todas las facciones...",
+                value=S.search_query,
+                on_change=S.set_search_query,
+                class_name="w-full",
+            ),
+            debounce_timeout=150,
+        ),
+        rx.cond(
+            S.search_results.length() > 0,
+            rx.vstack(rx.foreach(S.search_results, search_row), class_name="w-full mt-2 gap-1"),
+        ),
+        class_name="p-4 rounded bg-zinc-800 w-full",
+    )
+
+def what_if_panel() -> rx.Component:
+    S = SimState
+    return rx.box(
+        rx.hstack(
+            rx.button("¿Qué pasaría? Unidad 1", on_click=S.compute_what_if(True), variant="outline"),
+            rx.button("¿Qué pasaría? Unidad 2", on_click=S.compute_what_if(False), variant="outline"),
+            class_name="gap-2",
+        ),
+        rx.cond(
+            S.what_if_rows.length() > 0,
+            rx.box(
+                rx.text(S.what_if_title, class_name="text-sm font-semibold mt-2"),
+                rx.table.root(
+                    rx.table.body(rx.foreach(S.what_if_rows, heat_row)),
+                    class_name="w-full mt-2 text-xs",
+                ),
+            ),
+        ),
+        class_name="p-4 rounded bg-zinc-800 w-full",
+    )
+
+def job_panel() -> rx.Component:
+    S = SimState
+    activo = (S.job_status == "pendiente") | (S.job_status == "ejecutando")
+    return rx.box(
+        rx.hstack(
+            rx.button(
+                f"Monte Carlo {MC_ENSAYOS_TRABAJO:,} ensayos (en cola)".replace(",", "."),
+                on_click=S.submit_mc_job,
+                disabled=activo,
+                variant="outline",
+            ),
+            rx.cond(activo, rx.button("Cancelar trabajo", on_click=S.cancel_job, variant="outline", color_scheme="gray")),
+            rx.cond(S.job_status != "", rx.text(f"Trabajo: {S.job_status}", class_name="text-xs")),
+            class_name="gap-2 items-center",
+        ),
+        rx.cond(activo, rx.progress(value=S.job_progress, max=100, class_name="w-full mt-2")),
+        class_name="p-4 rounded bg-zinc-800 w-full",
+    )
+
+def initiative_row(row) -> rx.Component:
+    return rx.table.row(
+        rx.table.cell(row[0]),
+        rx.table.cell(row[1]),
+        rx.table.cell(row[2]),
+        rx.table.cell(row[3]),
+        rx.table.cell(row[4]),
+        rx.table.cell(row[5]),
+    )
+
+def initiative_panel() -> rx.Component:
+    S = SimState
+    return rx.box(
+        rx.hstack(
+            rx.button("Comparar iniciativa", on_click=S.compare_initiative, variant="outline"),
+            rx.cond(S.initiative_title != "", rx.text(S.initiative_title, class_name="text-xs")),
+            class_name="gap-2 items-center",
+        ),
+        rx.cond(
+            S.initiative_rows.length() > 0,
+            rx.table.root(
+                rx.table.header(
+                    rx.table.row(
+                        rx.table.column_header_cell("Golpea primero"),
+                        rx.table.column_header_cell("Carga"),
+                        rx.table.column_header_cell("Ganador"),
+                        rx.table.column_header_cell("Rondas"),
+                        rx.table.column_header_cell("Minis U1"),
+                        rx.table.column_header_cell("Minis U2"),
+                    )
+                ),
+                rx.table.body(rx.foreach(S.initiative_rows, initiative_row)),
+                class_name="w-full mt-2 text-xs",
+            ),
+        ),
+        class_name="p-4 rounded bg-zinc-800 w-full",
+    )
+
+def round_row(row) -> rx.Component:
+    return rx.table.row(
+        rx.table.cell(row[0]),
+        rx.table.cell(row[1]),
+        rx.table.cell(row[2]),
+        rx.table.cell(row[3]),
+        rx.table.cell(row[4]),
+        rx.table.cell(row[5]),
+        rx.table.cell(row[6]),
+    )
+
+def result_panel() -> rx.Component:
+    S = SimState
+    summary = S.result_summary
+    return rx.cond(
+        S.result_text != "",
+        rx.box(
+            rx.text(S.result_text, class_name="text-sm font-semibold"),
+            rx.cond(
+                S.sim_running,
+                rx.progress(value=S.sim_progress, max=100, class_name="w-full mt-2"),
+            ),
+            rx.cond(
+                summary != {},
+                rx.box(
+                    rx.text(f"Victoria para: {summary.get('ganador', '-')}", class_name="text-lg font-bold"),
+                    rx.text(
+                        f"Rondas: {summary.get('rondas', '-')} | "
+                        f"{summary.get('atacante', '-')}: {summary.get('atacante_restante', '-')} minis | "
+                        f"{summary.get('defensor', '-')}: {summary.get('defensor_restante', '-')} minis",
+                        class_name="text-xs",
+                    ),
+                    rx.table.root(
+                        rx.table.header(
+                            rx.table.row(
+                                rx.table.column_header_cell("Ronda"),
+                                rx.table.column_header_cell("Minis atac."),
+                                rx.table.column_header_cell("Heridas atac."),
+                                rx.table.column_header_cell("Bajas def."),
+                                rx.table.column_header_cell("Minis def."),
+                                rx.table.column_header_cell("Heridas def."),
+                                rx.table.column_header_cell("Bajas atac."),
+                            )
+                        ),
+                        rx.table.body(rx.foreach(S.result_rounds, round_row)),
+                        class_name="w-full mt-2 text-xs",
+                    ),
+                ),
+            ),
+            rx.cond(
+                S.mc_summary != {},
+                rx.text(
+                    f"Monte Carlo ({S.mc_summary.get('ensayos', 0)} ensayos): "
+                    f"victoria atacante {S.mc_summary.get('victoria', '-')} {S.mc_summary.get('ic', '')} | "
+                    f"supervivientes {S.mc_summary.get('sup_atac', '-')} / {S.mc_summary.get('sup_def', '-')}",
+                    class_name="text-xs mt-2",
+                ),
+            ),
+            rx.button(
+                rx.cond(S.show_detail, "Ocultar detalle", "Ver detalle"),
+                on_click=S.toggle_detail,
+                class_name="mt-2",
+                variant="outline",
+            ),
+            rx.cond(
+                S.show_detail,
+                rx.text_area(
+                    value=S.result_detail,
+                    read_only=True,
+                    class_name="w-full h-80 mt-2 p-2 bg-zinc-900 text-sm",
+                    style={"width": "100%"},
+                ),
+            ),
+            class_name="p-4 rounded bg-zinc-800 w-full",
+            style={"width": "100%"},
+        ),
+    )
+
 def index() -> rx.Component:
     return rx.box(
         rx.vstack(
             rx.text("Simulador de Combate", class_name="text-3xl font-bold text-center"),
             rx.text("Warhammer Age of Sigmar", class_name="text-sm opacity-70 text-center"),
+            search_panel(),
             rx.grid(
                 side_card("Unidad 1", True),
                 side_card("Unidad 2", False),
@@ -409,9 +961,12 @@ def index() -> rx.Component:
             ),
             rx.hstack(
                 rx.spacer(),
+                rx.checkbox("Monte Carlo", is_checked=SimState.mc_mode, on_change=SimState.set_mc_mode),
+                rx.checkbox("Perfilar", is_checked=SimState.profile_mode, on_change=SimState.set_profile_mode),
                 rx.button(
                     "Simular", 
                     on_click=SimState.simulate,
+                    disabled=SimState.sim_running,
                     style={
                         "background": "#fff",
                         "color": "#1AAB8A",
@@ -435,6 +990,16 @@ def index() -> rx.Component:
                         }
                     }
                 ),
+                rx.cond(
+                    SimState.sim_running,
+                    rx.button(
+                        "Cancelar",
+                        on_click=SimState.cancel_simulation,
+                        variant="outline",
+                        color_scheme="gray",
+                        style={"marginLeft": "8px", "height": "60px"},
+                    ),
+                ),
                 rx.button(
                     "Reset", 
                     on_click=SimState.clear_all,
@@ -469,24 +1034,40 @@ def index() -> rx.Component:
                     "minHeight": "70px"
                 }
             ),
-            rx.cond(
-                SimState.result_output != "",
-                rx.box(
-                    rx.text("Salida de la simulación:", class_name="text-sm font-semibold"),
-                    rx.text_area(
-                        value=SimState.result_output,
-                        read_only=True,
-                        class_name="w-full h-80 mt-2 p-2 bg-zinc-900 text-sm",
-                        style={"width": "100%"},
-                    ),
-                    class_name="p-4 rounded bg-zinc-800 w-full",
-                    style={"width": "100%"},
-                ),
-            ),
+            result_panel(),
+            job_panel(),
+            initiative_panel(),
+            what_if_panel(),
             class_name="w-full py-8 space-y-4",
         ),
         class_name="w-full px-0",  # quitar padding lateral para ocupar todo el ancho
     )
 
-app = rx.App()
+async def precargar_catalogo():
+    """Carga el catálogo al arrancar para que la primera sesión no espere."""
+    def _cargar():
+        # Importación diferida: el catálogo y Supabase no retrasan el arranque del backend
+        from services.catalogo import asegurar_cargado
+        asegurar_cargado()
+
+    try:
+        await asyncio.to_thread(_cargar)
+    except Exception as e:
+        print(f"[catalogo] No se pudo precargar el catálogo: {e}")
+
+
+async def arrancar_trabajos():
+    """Arranca el despachador de la cola: retoma los trabajos que quedaron pendientes."""
+    from services import trabajos
+    try:
+        await asyncio.to_thread(trabajos.arrancar)
+    except Exception as e:
+        print(f"[trabajos] No se pudo arrancar la cola: {e}")
+
+
+from proyecto_aos.api import api, frontal
+
+app = rx.App(api_transformer=[api, frontal])
+app.register_lifespan_task(precargar_catalogo)
+app.register_lifespan_task(arrancar_trabajos)
 app.add_page(index, on_load=SimState.on_load, title="Simulador AoS")
\ No newline at end of file
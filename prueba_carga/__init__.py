@@ -0,0 +1 @@
+"""Prueba de carga del backend contra un PostgREST falso local (ver __main__.py)."""
@@ -0,0 +1,241 @@
+"""
+Prueba de carga de la app contra un PostgREST falso.
+
+    python -m prueba_carga --sesiones 50 --iteraciones 20 --facciones 20 --unidades 40
+    python -m prueba_carga --solo-motor --sesiones 50
+
+Arranca el servidor falso con un catálogo sintético y un backend real
+(`reflex run --env prod --backend-only`) apuntado a él, y lanza `--sesiones` clientes
+concurrentes que hablan con el backend por websocket como el navegador (ver
+`eventos.py`): hidratar y on_load, elegir facción y unidad, marcar opciones y simular.
+Cada evento se mide hasta su actualización final; `simulate`, que va en segundo plano,
+hasta que la tarea termina. Al final muestra, por tipo de evento, eventos por segundo
+y latencias p50/p95/p99: lo que responde una instancia con esos usuarios a la vez.
+
+Con `--solo-motor` no hay backend: los handlers se llaman en este proceso, sin cola
+de eventos, proxy de estado ni serialización de deltas, y `simulate` se sustituye por
+preparar las unidades y simular (sin la caché de resultados ni el envío por rondas).
+Sirve para perfilar el motor, no para dimensionar instancias, y el informe lo indica.
+"""
+
+import argparse
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from typing import Dict, List
+
+from prueba_carga.postgrest_falso import PostgrestFalso, generar_catalogo
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    orden = sorted(valores)
+    k = min(len(orden) - 1, max(0, int(round(p / 100.0 * (len(orden) - 1)))))
+    return orden[k]
+
+
+class _Medidor:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencias: Dict[str, List[float]] = defaultdict(list)
+        self.errores: Dict[str, int] = defaultdict(int)
+
+    def medir(self, evento: str, fn, *args):
+        t0 = time.perf_counter()
+        try:
+            fn(*args)
+        except Exception:
+            with self.lock:
+                self.errores[evento] += 1
+        dt = time.perf_counter() - t0
+        with self.lock:
+            self.latencias[evento].append(dt)
+
+
+def _sesion_eventos(medidor: _Medidor, url: str, iteraciones: int, semilla: int) -> None:
+    """Una pestaña del navegador contra el backend: todos los eventos pasan por Reflex."""
+    from reflex.event import get_hydrate_event
+    from reflex.state import State
+
+    from prueba_carga.eventos import ClienteEventos
+    from proyecto_aos.proyecto_aos import SimState
+    from services import catalogo
+
+    rng = random.Random(semilla)
+    ev = lambda nombre: f"{SimState.get_full_name()}.{nombre}"  # noqa: E731
+    try:
+        cliente = ClienteEventos(url)
+    except Exception:
+        with medidor.lock:
+            medidor.errores["conexion"] += 1
+        return
+    try:
+        # Hidratar encadena los on_load de la página, como al abrirla
+        medidor.medir("on_load", cliente.enviar, get_hydrate_event(State))
+        facciones = catalogo.faction_names()
+        for _ in range(iteraciones):
+            medidor.medir("search", cliente.enviar, ev("set_search_query"), {"q": f"unidad {rng.randrange(100):03d}"})
+            for lado in ("1", "2"):
+                faccion = rng.choice(facciones)
+                medidor.medir("set_faction", cliente.enviar, ev(f"set_faction{lado}_name"), {"name": faccion})
+                unidades = catalogo.unit_names(catalogo.faction_id(faccion))
+                if unidades:
+                    medidor.medir("set_unit", cliente.enviar, ev(f"set_unit{lado}_name"), {"name": rng.choice(unidades)})
+                medidor.medir("toggle", cliente.enviar, ev(f"set_charge{lado}"), {"v": rng.random() < 0.5})
+                medidor.medir("toggle", cliente.enviar, ev(f"set_bonus{lado}"), {"v": rng.choice(["Rend -1", "Daño +1"])})
+                medidor.medir("toggle", cliente.enviar, ev(f"set_reinforced{lado}"), {"v": rng.random() < 0.5})
+                medidor.medir("toggle", cliente.enviar, ev(f"set_champion{lado}"), {"v": rng.random() < 0.5})
+            if cliente.valor("unit1_id") and cliente.valor("unit2_id"):
+                # Tarea en segundo plano: pone sim_running a True y al acabar a False
+                cliente.olvidar("sim_running")
+                medidor.medir("simulate", cliente.enviar, ev("simulate"), None,
+                              lambda c: c.valor("sim_running") is False)
+    finally:
+        cliente.cerrar()
+
+
+def _sesion_motor(medidor: _Medidor, iteraciones: int, semilla: int) -> None:
+    """
+    Solo motor: los handlers de SimState llamados en este proceso, sin Reflex de por
+    medio. No mide lo que ve un usuario (ver la cabecera del módulo).
+    """
+    from proyecto_aos.proyecto_aos import MAX_RONDAS, SimState, _preparar_unidades
+    from services import catalogo
+    from simulador import simular_combate_con_detalle
+
+    rng = random.Random(semilla)
+    state = SimState(_reflex_internal_init=True)
+    h = lambda nombre: getattr(SimState, nombre).fn  # noqa: E731
+
+    medidor.medir("on_load", h("on_load"), state)
+    facciones = catalogo.faction_names()
+    for _ in range(iteraciones):
+        medidor.medir("search", h("set_search_query"), state, f"unidad {rng.randrange(100):03d}")
+        for lado in ("1", "2"):
+            medidor.medir("set_faction", h(f"set_faction{lado}_name"), state, rng.choice(facciones))
+            unidades = catalogo.unit_names(getattr(state, f"faction{lado}_id"))
+            if unidades:
+                medidor.medir("set_unit", h(f"set_unit{lado}_name"), state, rng.choice(unidades))
+            medidor.medir("toggle", h(f"set_charge{lado}"), state, rng.random() < 0.5)
+            medidor.medir("toggle", h(f"set_bonus{lado}"), state, rng.choice(["Rend -1", "Daño +1"]))
+            medidor.medir("toggle", h(f"set_reinforced{lado}"), state, rng.random() < 0.5)
+            medidor.medir("toggle", h(f"set_champion{lado}"), state, rng.random() < 0.5)
+
+        # simulate es un evento en segundo plano (necesita el proxy de estado de Reflex):
+        # solo su parte de cálculo, preparar unidades y simular, sin la caché de resultados
+        def _simular():
+            u1, u2 = _preparar_unidades(state.unit1_id, state.unit2_id, state.reinforced1, state.reinforced2,
+                                        state.champion1, state.champion2,
+                                        state.bonus1 if state.charge1 else "", state.bonus2 if state.charge2 else "")
+            if state.charge2 and not state.charge1:
+                u1, u2 = u2, u1
+            simular_combate_con_detalle(u1, u2, max_rondas=MAX_RONDAS)
+
+        medidor.medir("simulate", _simular)
+
+
+def _arrancar_backend(puerto: int, espera_s: float) -> subprocess.Popen:
+    """`reflex run` solo backend, con el entorno ya apuntando al PostgREST falso."""
+    log_ruta = os.path.join(os.path.dirname(os.environ["AOS_SHARED_DB"]), "prueba_carga_backend.log")
+    log = open(log_ruta, "w")
+    # reflex lanza su servidor (granian) por nombre: el de este entorno aunque no esté activado
+    entorno = dict(os.environ, PATH=os.pathsep.join([os.path.dirname(sys.executable), os.environ.get("PATH", "")]))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "reflex", "run", "--env", "prod", "--backend-only", "--backend-port", str(puerto)],
+        cwd=RAIZ, env=entorno, stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+    )
+    limite = time.monotonic() + espera_s
+    while time.monotonic() < limite:
+        if proc.poll() is not None:
+            raise SystemExit(f"el backend terminó al arrancar (código {proc.returncode}); ver {log_ruta}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{puerto}/ping", timeout=1):
+                return proc
+        except OSError:
+            time.sleep(0.5)
+    _parar_backend(proc)
+    raise SystemExit(f"el backend no respondió en {espera_s:.0f} s; ver {log_ruta}")
+
+
+def _parar_backend(proc: subprocess.Popen) -> None:
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=15)
+    except (OSError, subprocess.TimeoutExpired):
+        proc.kill()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sesiones", type=int, default=20)
+    parser.add_argument("--iteraciones", type=int, default=10)
+    parser.add_argument("--facciones", type=int, default=10)
+    parser.add_argument("--unidades", type=int, default=30, help="unidades por facción")
+    parser.add_argument("--armas", type=int, default=2, help="armas por unidad")
+    parser.add_argument("--latencia-ms", type=float, default=0.0, help="latencia artificial del PostgREST falso")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--puerto", type=int, default=8765, help="puerto del backend que se arranca")
+    parser.add_argument("--espera-arranque", type=float, default=180.0, help="segundos máximos de arranque del backend")
+    parser.add_argument("--solo-motor", action="store_true",
+                        help="handlers en este proceso, sin backend: no mide usuarios concurrentes")
+    args = parser.parse_args()
+
+    fake = PostgrestFalso(generar_catalogo(args.facciones, args.unidades, args.armas, args.semilla),
+                          latencia_ms=args.latencia_ms)
+    url = fake.arrancar()
+    # Antes de importar la app: unidad_service lee la configuración al importarse
+    os.environ["SUPABASE_URL"] = url
+    os.environ["SUPABASE_ANON_KEY"] = "prueba.carga.local"
+    os.environ.setdefault("AOS_SHARED_DB", os.path.join(os.getcwd(), ".cache", "prueba_carga.db"))
+    os.makedirs(os.path.dirname(os.environ["AOS_SHARED_DB"]), exist_ok=True)
+
+    from services import catalogo
+    catalogo.asegurar_cargado()
+
+    backend = None
+    if args.solo_motor:
+        modo = "SOLO MOTOR: handlers en proceso, sin cola de eventos ni serialización de Reflex"
+        objetivo, extra = _sesion_motor, ()
+    else:
+        backend = _arrancar_backend(args.puerto, args.espera_arranque)
+        modo = f"eventos de Reflex por websocket contra el backend en el puerto {args.puerto}"
+        objetivo, extra = _sesion_eventos, (f"http://127.0.0.1:{args.puerto}",)
+
+    medidor = _Medidor()
+    hilos = [threading.Thread(target=objetivo, args=(medidor, *extra, args.iteraciones, args.semilla + i))
+             for i in range(args.sesiones)]
+    t0 = time.perf_counter()
+    try:
+        for t in hilos:
+            t.start()
+        for t in hilos:
+            t.join()
+    finally:
+        total_s = time.perf_counter() - t0
+        if backend is not None:
+            _parar_backend(backend)
+        fake.parar()
+
+    print(f"Modo: {modo}")
+    print(f"{args.sesiones} sesiones x {args.iteraciones} iteraciones en {total_s:.2f} s "
+          f"({fake.peticiones} peticiones al PostgREST falso)")
+    if medidor.errores.get("conexion"):
+        print(f"{medidor.errores['conexion']} sesiones no pudieron conectar con el backend")
+    print(f"{'evento':<12}{'n':>8}{'ev/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errores':>9}")
+    for evento, lat in sorted(medidor.latencias.items()):
+        print(f"{evento:<12}{len(lat):>8}{len(lat) / total_s:>10.1f}"
+              f"{_percentil(lat, 50) * 1000:>10.2f}{_percentil(lat, 95) * 1000:>10.2f}"
+              f"{_percentil(lat, 99) * 1000:>10.2f}{medidor.errores.get(evento, 0):>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Cliente mínimo del canal de eventos de Reflex, para que la prueba de carga entre por
+el mismo camino que el navegador: websocket, cola de eventos por sesión, bloqueo del
+estado, tareas en segundo plano y serialización de deltas.
+
+Habla Engine.IO v4 / Socket.IO v5 sobre `simple_websocket` (lo instala Reflex a
+través de python-engineio), sin cliente de Socket.IO completo: solo hace falta
+conectar al espacio de nombres de eventos, contestar los pings y mandar y recibir
+"event".
+"""
+
+import json
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ESPACIO = "/_event"
+RUTA_INICIAL = {"pathname": "/", "query": {}, "asPath": "/"}
+
+
+class ErrorEventos(Exception):
+    pass
+
+
+class ClienteEventos:
+    """Una pestaña del navegador: un token, un websocket y la copia local del estado."""
+
+    def __init__(self, url_backend: str, timeout_s: float = 120.0):
+        import simple_websocket
+
+        self.token = str(uuid.uuid4())
+        self.timeout_s = timeout_s
+        self.estado: Dict[str, Dict[str, Any]] = {}
+        url = url_backend.rstrip("/").replace("http", "ws", 1)
+        self.ws = simple_websocket.Client.connect(
+            f"{url}{ESPACIO}/?EIO=4&transport=websocket&token={self.token}"
+        )
+        if not self._paquete().startswith("0"):
+            raise ErrorEventos("el backend no abrió la sesión de Engine.IO")
+        self.ws.send(f"40{ESPACIO},")
+        while not self._paquete().startswith(f"40{ESPACIO}"):
+            pass
+
+    def cerrar(self) -> None:
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+    def _paquete(self) -> str:
+        """Siguiente paquete de Engine.IO que no sea un ping (los pings se contestan aquí)."""
+        limite = time.monotonic() + self.timeout_s
+        while True:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                raise ErrorEventos(f"sin respuesta del backend en {self.timeout_s:.0f} s")
+            msg = self.ws.receive(timeout=restante)
+            if msg is None:
+                continue
+            if msg == "2":
+                self.ws.send("3")
+                continue
+            return msg
+
+    def _actualizacion(self) -> Dict[str, Any]:
+        """Siguiente StateUpdate (delta, events, final), ya aplicado al estado local."""
+        prefijo = f"42{ESPACIO},"
+        while True:
+            msg = self._paquete()
+            if not msg.startswith(prefijo):
+                if msg.startswith(f"44{ESPACIO}"):
+                    raise ErrorEventos(f"el backend rechazó la conexión: {msg[len(prefijo):]}")
+                continue
+            nombre, *datos = json.loads(msg[len(prefijo):])
+            if nombre != "event" or not datos:
+                continue
+            update = json.loads(datos[0]) if isinstance(datos[0], str) else datos[0]
+            for estado, campos in (update.get("delta") or {}).items():
+                self.estado.setdefault(estado, {}).update(campos)
+            return update
+
+    def enviar(self, nombre: str, payload: Optional[Dict[str, Any]] = None,
+               hasta: Optional[Callable[["ClienteEventos"], bool]] = None) -> None:
+        """
+        Manda un evento y espera como el navegador: a la actualización final de cada
+        evento, encadenando los de backend que devuelva el servidor (p. ej. los on_load
+        tras hidratar). Con `hasta`, sigue leyendo actualizaciones (las de una tarea en
+        segundo plano) hasta que el predicado se cumpla.
+        """
+        pendientes: List[Tuple[str, Dict[str, Any]]] = [(nombre, payload or {})]
+        while pendientes:
+            n, p = pendientes.pop(0)
+            evento = {"token": self.token, "name": n, "payload": p, "router_data": RUTA_INICIAL}
+            self.ws.send(f"42{ESPACIO}," + json.dumps(["event", evento]))
+            while True:
+                update = self._actualizacion()
+                # Los que no tienen estado ("_call_script", "_redirect"...) son del navegador
+                pendientes.extend((e["name"], e.get("payload") or {})
+                                  for e in update.get("events") or [] if "." in e.get("name", ""))
+                if update.get("final"):
+                    break
+        while hasta is not None and not hasta(self):
+            self._actualizacion()
+
+    def olvidar(self, var: str) -> None:
+        """Borra la copia local de una variable para esperar a su próximo valor."""
+        for campos in self.estado.values():
+            for clave in [c for c in campos if c == var or c.startswith(var + "_rx_state_")]:
+                del campos[clave]
+
+    def valor(self, var: str, defecto: Any = None) -> Any:
+        """Último valor recibido de una variable de estado, por su nombre en Python."""
+        for campos in self.estado.values():
+            for clave, v in campos.items():
+                if clave == var or clave.startswith(var + "_rx_state_"):
+                    return v
+        return defecto
@@ -0,0 +1,206 @@
+"""
+Servidor local que imita los endpoints REST de Supabase (PostgREST) que usa la app,
+con un catálogo sintético en memoria del tamaño que se pida.
+
+Soporta lo que generan las consultas de services/unidad_service.py:
+select (incluido el embebido `units(...)`), filtros eq./in., order y limit.
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl, urlparse
+
+CRIT_EFFECTS = ["none", "none", "none", "mortal_wounds", "auto_wound", "impactos_dobles"]
+
+
+def generar_catalogo(facciones: int = 10, unidades: int = 30, armas: int = 2, semilla: int = 0) -> Dict[str, List[dict]]:
+    """Catálogo sintético: `facciones` x `unidades` por facción x `armas` por unidad."""
+    rng = random.Random(semilla)
+    tablas: Dict[str, List[dict]] = {"factions": [], "units": [], "unit_weapons": []}
+    for f in range(facciones):
+        fid = str(uuid.UUID(int=rng.getrandbits(128)))
+        tablas["factions"].append({"id": fid, "name": f"Facción {f:03d}"})
+        for u in range(unidades):
+            uid = str(uuid.UUID(int=rng.getrandbits(128)))
+            tablas["units"].append({
+                "id": uid, "faction_id": fid, "name": f"Unidad {f:03d}-{u:03d}",
+                "base_size": rng.choice([1, 3, 5, 10, 20]), "wounds": rng.choice([1, 1, 2, 3, 5, 8]),
+                "save": rng.choice([3, 4, 5, 6]), "ward_save": rng.choice([None, None, 6, 5]),
+                "reinforced": rng.random() < 0.5, "points": rng.randrange(80, 400, 10),
+                "img_url": "",
+            })
+            for a in range(armas):
+                tablas["unit_weapons"].append({
+                    "id": str(uuid.UUID(int=rng.getrandbits(128))), "unit_id": uid, "name": f"Arma {a}",
+                    "attacks_formula": rng.choice(["1", "2", "3", "4", "d3", "d6"]),
+                    "to_hit": rng.choice([3, 4, 5]), "to_wound": rng.choice([3, 4, 5]),
+                    "rend": rng.choice([0, 0, 1, 1, 2]), "damage_formula": rng.choice(["1", "1", "2", "d3"]),
+                    "crit_effect": rng.choice(CRIT_EFFECTS),
+                })
+    return tablas
+
+
+def _valor(v: str) -> Any:
+    if v == "null":
+        return None
+    if v in ("true", "false"):
+        return v == "true"
+    return v
+
+
+def _cumple(fila: dict, col: str, expr: str) -> bool:
+    op, _, arg = expr.partition(".")
+    actual = fila.get(col)
+    actual = None if actual is None else str(actual).lower() if isinstance(actual, bool) else str(actual)
+    if op == "eq":
+        return actual == arg
+    if op == "in":
+        valores = [x.strip().strip('"') for x in arg.strip("()").split(",")]
+        return actual in valores
+    if op == "is":
+        return actual is None if arg == "null" else actual == arg
+    return True
+
+
+def _partir_select(select: str) -> List[str]:
+    """Divide 'id,name,units(id,name)' respetando los paréntesis."""
+    partes, nivel, actual = [], 0, ""
+    for c in select:
+        if c == "," and nivel == 0:
+            partes.append(actual)
+            actual = ""
+            continue
+        nivel += c == "("
+        nivel -= c == ")"
+        actual += c
+    if actual:
+        partes.append(actual)
+    return [p.strip() for p in partes if p.strip()]
+
+
+# Relaciones embebibles: tabla -> {embebida: (columna local, columna remota)}
+_RELACIONES = {
+    "factions": {"units": ("id", "faction_id")},
+    "units": {"unit_weapons": ("id", "unit_id")},
+}
+
+
+class PostgrestFalso:
+    def __init__(self, tablas: Dict[str, List[dict]], latencia_ms: float = 0.0):
+        self.tablas = tablas
+        self.latencia_s = latencia_ms / 1000.0
+        self.lock = threading.Lock()
+        self.peticiones = 0
+        self._servidor: Optional[ThreadingHTTPServer] = None
+
+    def _proyectar(self, tabla: str, fila: dict, select: str) -> dict:
+        if not select or select == "*":
+            return dict(fila)
+        out = {}
+        for campo in _partir_select(select):
+            if "(" in campo:
+                nombre, sub = campo[:-1].split("(", 1)
+                local, remota = _RELACIONES.get(tabla, {}).get(nombre, ("id", ""))
+                hijos = [h for h in self.tablas.get(nombre, []) if h.get(remota) == fila.get(local)]
+                out[nombre] = [self._proyectar(nombre, h, sub) for h in hijos]
+            elif campo == "*":
+                out.update(fila)
+            else:
+                out[campo] = fila.get(campo)
+        return out
+
+    def consultar(self, tabla: str, params: List[tuple]) -> List[dict]:
+        filas = self.tablas.get(tabla, [])
+        select, orden, limite = "*", None, None
+        for k, v in params:
+            if k == "select":
+                select = v
+            elif k == "order":
+                orden = v
+            elif k == "limit":
+                limite = int(v)
+            elif k not in ("offset",):
+                filas = [f for f in filas if _cumple(f, k, v)]
+        if orden:
+            col, _, direc = orden.partition(".")
+            filas = sorted(filas, key=lambda f: (f.get(col) is None, f.get(col)), reverse=direc.startswith("desc"))
+        if limite is not None:
+            filas = filas[:limite]
+        return [self._proyectar(tabla, f, select) for f in filas]
+
+    def upsert(self, tabla: str, filas: List[dict], clave: str = "id") -> List[dict]:
+        with self.lock:
+            existentes = {f.get(clave): f for f in self.tablas.setdefault(tabla, [])}
+            for fila in filas:
+                if fila.get(clave) in existentes:
+                    existentes[fila.get(clave)].update(fila)
+                else:
+                    nueva = dict(fila)
+                    self.tablas[tabla].append(nueva)
+                    existentes[nueva.get(clave)] = nueva
+        return filas
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _responder(self, datos: Any, estado: int = 200):
+                cuerpo = json.dumps(datos).encode("utf-8")
+                self.send_response(estado)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def _tabla(self):
+                url = urlparse(self.path)
+                if not url.path.startswith("/rest/v1/"):
+                    return None, []
+                return url.path[len("/rest/v1/"):].strip("/"), parse_qsl(url.query, keep_blank_values=True)
+
+            def do_GET(self):
+                with fake.lock:
+                    fake.peticiones += 1
+                if fake.latencia_s:
+                    time.sleep(fake.latencia_s)
+                tabla, params = self._tabla()
+                if tabla is None:
+                    return self._responder({"message": "not found"}, 404)
+                filas = fake.consultar(tabla, params)
+                if "vnd.pgrst.object" in self.headers.get("Accept", ""):
+                    if len(filas) != 1:
+                        return self._responder({"code": "PGRST116", "message": "not single"}, 406)
+                    return self._responder(filas[0])
+                self._responder(filas)
+
+            def do_POST(self):
+                with fake.lock:
+                    fake.peticiones += 1
+                tabla, params = self._tabla()
+                if tabla is None:
+                    return self._responder({"message": "not found"}, 404)
+                largo = int(self.headers.get("Content-Length", 0))
+                datos = json.loads(self.rfile.read(largo) or b"[]")
+                filas = datos if isinstance(datos, list) else [datos]
+                clave = dict(params).get("on_conflict", "id")
+                self._responder(fake.upsert(tabla, filas, clave), 201)
+
+        return Handler
+
+    def arrancar(self, puerto: int = 0) -> str:
+        """Arranca el servidor en un hilo y devuelve su URL base."""
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", puerto), self._handler())
+        threading.Thread(target=self._servidor.serve_forever, name="postgrest-falso", daemon=True).start()
+        return f"http://127.0.0.1:{self._servidor.server_address[1]}"
+
+    def parar(self) -> None:
+        if self._servidor is not None:
+            self._servidor.shutdown()
@@ -0,0 +1,391 @@
+"""
+Almacén compartido entre workers del backend.
+
+Un fichero SQLite en modo WAL, leído vía mmap, guarda el catálogo resuelto y los
+resultados de simulación más usados. Los lectores abren la base en solo lectura y
+nunca se bloquean (WAL). Escribe un único proceso, elegido con un flock sobre un
+fichero de bloqueo: el catálogo lo publica él directamente y los resultados que
+calculan los demás (workers del backend, procesos de la cola de trabajos) le llegan
+por una cola de ficheros, uno por proceso en `PENDIENTES`, que un hilo del escritor
+vacía cada DRENAR_CADA_S. Añadir una línea a la cola propia no compite con nadie,
+así que un resultado solo se pierde si la cola supera MAX_PENDIENTES_BYTES o falla
+el disco; esas pérdidas se cuentan en `contadores()` (ver `resiliencia.metricas`).
+La única escritura que no pasa por el escritor es `invalidar_por_huellas`, que
+espera su turno y propaga el error. Un worker nuevo arranca leyendo lo que ya hay,
+sin esperar a la red.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin elección de escritor, cada proceso escribe
+    fcntl = None
+
+RUTA = os.getenv("AOS_SHARED_DB", os.path.join(tempfile.gettempdir(), "proyecto_aos_shared.db"))
+MMAP_BYTES = 64 * 1024 * 1024
+MAX_RESULTADOS = 5000
+PODAR_CADA = 200
+PENDIENTES = RUTA + ".pendientes"
+DRENAR_CADA_S = 0.2
+MAX_PENDIENTES_BYTES = 16 * 1024 * 1024
+# Las escrituras directas son del escritor (en hilos de fondo) o invalidaciones: pueden esperar
+ESPERA_S = 2.0
+
+_local = threading.local()
+_lock = threading.Lock()
+_fd_escritor = None
+_es_escritor: Optional[bool] = None
+_escrituras_resultados = 0
+_contadores = {"encoladas": 0, "escritas": 0, "obsoletas": 0, "descartadas": 0}
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    ns TEXT NOT NULL,
+    clave TEXT NOT NULL,
+    valor TEXT NOT NULL,
+    actualizado REAL NOT NULL,
+    PRIMARY KEY (ns, clave)
+);
+-- Qué entradas usaron cada unidad (con sus armas) y con qué huella de sus datos
+CREATE TABLE IF NOT EXISTS deps (
+    unit_id TEXT NOT NULL,
+    ns TEXT NOT NULL,
+    clave TEXT NOT NULL,
+    huella TEXT NOT NULL,
+    receta TEXT,
+    PRIMARY KEY (unit_id, ns, clave)
+);
+CREATE INDEX IF NOT EXISTS deps_entrada ON deps (ns, clave);
+-- Última huella conocida de cada unidad en el catálogo; `actualizado` es cuándo se avisó
+-- de su último cambio (0 si nunca), y lo consultan todos los procesos para vaciar sus cachés
+CREATE TABLE IF NOT EXISTS huellas (
+    unit_id TEXT PRIMARY KEY,
+    huella TEXT NOT NULL,
+    actualizado REAL NOT NULL
+);
+"""
+
+
+def es_escritor() -> bool:
+    """
+    True si este proceso tiene el rol de escritor único (se conserva toda su vida). Quien
+    lo gana arranca el hilo que vacía las colas de escrituras de todos los procesos.
+    """
+    global _fd_escritor, _es_escritor
+    if _es_escritor:
+        return True
+    with _lock:
+        if _es_escritor:
+            return True
+        if fcntl is None:
+            _es_escritor = True
+            return True
+        fd = os.open(RUTA + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            _es_escritor = False
+            return False
+        _fd_escritor = fd
+        _es_escritor = True
+    threading.Thread(target=_bucle_drenado, name="almacen-escritor", daemon=True).start()
+    return True
+
+
+def _conexion_escritura() -> sqlite3.Connection:
+    con = getattr(_local, "escritura", None)
+    if con is None:
+        con = sqlite3.connect(RUTA, timeout=ESPERA_S)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.executescript(_ESQUEMA)
+        con.commit()
+        _local.escritura = con
+    return con
+
+
+def _conexion_lectura() -> Optional[sqlite3.Connection]:
+    con = getattr(_local, "lectura", None)
+    if con is None:
+        if not os.path.exists(RUTA):
+            return None
+        try:
+            con = sqlite3.connect(f"file:{RUTA}?mode=ro", uri=True)
+            con.execute(f"PRAGMA mmap_size={MMAP_BYTES}")
+        except sqlite3.Error:
+            return None
+        _local.lectura = con
+    return con
+
+
+def leer(ns: str, clave: str, max_edad: Optional[float] = None) -> Any:
+    """Devuelve el valor guardado o None si no existe, está caducado o no hay almacén."""
+    con = _conexion_lectura()
+    if con is None:
+        return None
+    try:
+        fila = con.execute("SELECT valor, actualizado FROM kv WHERE ns = ? AND clave = ?", (ns, clave)).fetchone()
+    except sqlite3.Error:
+        return None
+    if not fila:
+        return None
+    valor, actualizado = fila
+    if max_edad is not None and time.time() - actualizado > max_edad:
+        return None
+    return json.loads(valor)
+
+
+def escribir(ns: str, clave: str, valor: Any) -> bool:
+    """Guarda un valor directamente (lo usa el escritor). False si la base sigue ocupada tras ESPERA_S."""
+    try:
+        con = _conexion_escritura()
+        with con:
+            con.execute(
+                "INSERT OR REPLACE INTO kv (ns, clave, valor, actualizado) VALUES (?, ?, ?, ?)",
+                (ns, clave, json.dumps(valor, ensure_ascii=False), time.time()),
+            )
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def podar(ns: str, max_filas: int = MAX_RESULTADOS) -> None:
+    """Conserva solo las `max_filas` entradas más recientes de un espacio de nombres."""
+    try:
+        con = _conexion_escritura()
+        with con:
+            con.execute(
+                "DELETE FROM kv WHERE ns = ? AND clave NOT IN "
+                "(SELECT clave FROM kv WHERE ns = ? ORDER BY actualizado DESC LIMIT ?)",
+                (ns, ns, max_filas),
+            )
+            con.execute("DELETE FROM deps WHERE ns = ? AND clave NOT IN (SELECT clave FROM kv WHERE ns = ?)", (ns, ns))
+    except sqlite3.Error:
+        pass
+
+
+def clave_resultado(*partes: Any) -> str:
+    return hashlib.sha1(json.dumps(partes, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def leer_resultado(clave: str) -> Any:
+    return leer("resultados", clave)
+
+
+def guardar_resultado(clave: str, valor: Any, huellas: Optional[Dict[str, str]] = None, receta: Any = None) -> bool:
+    """Con `huellas`, la entrada queda en el índice de dependencias (ver `escribir_con_dependencias`)."""
+    return guardar("resultados", clave, valor, huellas, receta)
+
+
+def guardar(ns: str, clave: str, valor: Any, huellas: Optional[Dict[str, str]] = None, receta: Any = None) -> bool:
+    """
+    Deja un valor en la cola de este proceso para que lo escriba el escritor (en menos
+    de DRENAR_CADA_S si está vivo). Devuelve False si no se pudo encolar; que luego se
+    descarte por huellas viejas se ve en `contadores()["obsoletas"]`.
+    """
+    es_escritor()  # si no hay escritor, este proceso toma el relevo y vacía las colas
+    if fcntl is None:
+        return _aplicar(ns, clave, valor, huellas, receta)
+    linea = json.dumps({"ns": ns, "clave": clave, "valor": valor, "huellas": huellas, "receta": receta},
+                       ensure_ascii=False) + "\n"
+    try:
+        ok = _encolar(linea.encode("utf-8"))
+    except OSError:
+        ok = False
+    with _lock:
+        _contadores["encoladas" if ok else "descartadas"] += 1
+    return ok
+
+
+def contadores() -> Dict[str, Any]:
+    """Escrituras de resultados de este proceso: encoladas, escritas, obsoletas y descartadas."""
+    with _lock:
+        return dict(_contadores, escritor=bool(_es_escritor))
+
+
+def _encolar(linea: bytes) -> bool:
+    os.makedirs(PENDIENTES, exist_ok=True)
+    ruta = os.path.join(PENDIENTES, f"{os.getpid()}.jsonl")
+    for _ in range(3):
+        fd = os.open(ruta, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            st = os.fstat(fd)
+            if st.st_nlink == 0:
+                # El escritor se llevó el fichero entre el open y el flock: se abre uno nuevo
+                continue
+            if st.st_size + len(linea) > MAX_PENDIENTES_BYTES:
+                return False
+            os.write(fd, linea)
+            return True
+        finally:
+            os.close(fd)
+    return False
+
+
+def _aplicar(ns: str, clave: str, valor: Any, huellas: Optional[Dict[str, str]], receta: Any) -> bool:
+    """Escribe una entrada de la cola y lleva la cuenta. Solo en el escritor."""
+    global _escrituras_resultados
+    try:
+        con = _conexion_escritura()
+        if huellas is None:
+            with con:
+                con.execute(
+                    "INSERT OR REPLACE INTO kv (ns, clave, valor, actualizado) VALUES (?, ?, ?, ?)",
+                    (ns, clave, json.dumps(valor, ensure_ascii=False), time.time()),
+                )
+            ok = True
+        else:
+            ok = _escribir_con_dependencias(con, ns, clave, valor, huellas, receta)
+    except sqlite3.Error:
+        with _lock:
+            _contadores["descartadas"] += 1
+        return False
+    with _lock:
+        _contadores["escritas" if ok else "obsoletas"] += 1
+    if ok and ns == "resultados":
+        _escrituras_resultados += 1
+        if _escrituras_resultados % PODAR_CADA == 0:
+            podar("resultados")
+    return ok
+
+
+def drenar() -> int:
+    """
+    Vacía las colas de todos los procesos; devuelve cuántas entradas procesó. Cada
+    fichero se renombra antes de leerlo, así que quien escriba después abre uno nuevo.
+    Si el escritor muere a medias, el siguiente repite los `.drenando` que queden
+    (las escrituras son idempotentes).
+    """
+    try:
+        nombres = os.listdir(PENDIENTES)
+    except OSError:
+        return 0
+    for nombre in nombres:
+        if nombre.endswith(".jsonl"):
+            base = os.path.join(PENDIENTES, nombre)
+            try:
+                os.rename(base, f"{base[:-len('.jsonl')]}.{time.time_ns()}.drenando")
+            except OSError:
+                pass
+    n = 0
+    for nombre in sorted(os.listdir(PENDIENTES)):
+        if not nombre.endswith(".drenando"):
+            continue
+        ruta = os.path.join(PENDIENTES, nombre)
+        try:
+            fd = os.open(ruta, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            # Espera a quien abrió el fichero antes del rename y aún está escribiendo
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            with os.fdopen(os.dup(fd), "rb") as f:
+                lineas = f.read().splitlines()
+            for linea in lineas:
+                try:
+                    e = json.loads(linea)
+                except ValueError:
+                    continue
+                _aplicar(e["ns"], e["clave"], e["valor"], e.get("huellas"), e.get("receta"))
+                n += 1
+            os.unlink(ruta)
+        finally:
+            os.close(fd)
+    return n
+
+
+def _bucle_drenado() -> None:
+    while True:
+        try:
+            drenar()
+        except Exception as e:
+            print(f"[almacen] error vaciando la cola de escrituras: {e}")
+        time.sleep(DRENAR_CADA_S)
+
+
+# --- Índice de dependencias (ver services/dependencias.py) ---------------------------
+
+def escribir_con_dependencias(ns: str, clave: str, valor: Any, huellas: Dict[str, str], receta: Any = None) -> bool:
+    """
+    Guarda un valor junto con las unidades que usó y la huella de sus datos, en la
+    misma transacción. Si alguna huella no coincide con la última conocida del catálogo
+    los datos eran viejos: no se guarda nada y se devuelve False (igual que si la base
+    está ocupada).
+    """
+    try:
+        return _escribir_con_dependencias(_conexion_escritura(), ns, clave, valor, huellas, receta)
+    except sqlite3.Error:
+        return False
+
+
+def _escribir_con_dependencias(con: sqlite3.Connection, ns: str, clave: str, valor: Any,
+                               huellas: Dict[str, str], receta: Any) -> bool:
+    with con:
+        for uid, h in huellas.items():
+            fila = con.execute("SELECT huella FROM huellas WHERE unit_id = ?", (uid,)).fetchone()
+            if fila and fila[0] != h:
+                return False
+        ahora = time.time()
+        con.execute(
+            "INSERT OR REPLACE INTO kv (ns, clave, valor, actualizado) VALUES (?, ?, ?, ?)",
+            (ns, clave, json.dumps(valor, ensure_ascii=False), ahora),
+        )
+        receta_json = None if receta is None else json.dumps(receta, ensure_ascii=False)
+        con.executemany(
+            "INSERT OR REPLACE INTO deps (unit_id, ns, clave, huella, receta) VALUES (?, ?, ?, ?, ?)",
+            [(uid, ns, clave, h, receta_json) for uid, h in huellas.items()],
+        )
+        con.executemany(
+            "INSERT OR IGNORE INTO huellas (unit_id, huella, actualizado) VALUES (?, ?, 0)",
+            list(huellas.items()),
+        )
+    return True
+
+
+def invalidar_por_huellas(huellas: Dict[str, str]) -> List[Tuple[str, str, Any]]:
+    """
+    Fija las huellas nuevas de esas unidades y borra las entradas que se calcularon con
+    otra huella de alguna de ellas. Devuelve las borradas como (ns, clave, receta). A
+    diferencia del resto del almacén, aquí un error se propaga: no se puede perder.
+    """
+    con = _conexion_escritura()
+    afectadas: Dict[Tuple[str, str], Any] = {}
+    with con:
+        for uid, h in huellas.items():
+            for ns, clave, receta in con.execute(
+                "SELECT ns, clave, receta FROM deps WHERE unit_id = ? AND huella != ?", (uid, h)
+            ):
+                afectadas[(ns, clave)] = receta
+        for ns, clave in afectadas:
+            con.execute("DELETE FROM kv WHERE ns = ? AND clave = ?", (ns, clave))
+            con.execute("DELETE FROM deps WHERE ns = ? AND clave = ?", (ns, clave))
+        ahora = time.time()
+        # Solo se marca como cambiada (y se vacía en las cachés de los procesos) si la huella es otra
+        con.executemany(
+            "INSERT INTO huellas (unit_id, huella, actualizado) VALUES (?, ?, ?) "
+            "ON CONFLICT (unit_id) DO UPDATE SET huella = excluded.huella, actualizado = excluded.actualizado "
+            "WHERE huellas.huella != excluded.huella",
+            [(uid, h, ahora) for uid, h in huellas.items()],
+        )
+    return [(ns, clave, json.loads(r) if r else None) for (ns, clave), r in afectadas.items()]
+
+
+def cambios_desde(marca: float) -> List[Tuple[str, float]]:
+    """Unidades con un cambio avisado después de `marca`: [(unit_id, cuándo)]."""
+    con = _conexion_lectura()
+    if con is None:
+        return []
+    try:
+        return con.execute("SELECT unit_id, actualizado FROM huellas WHERE actualizado > ?", (marca,)).fetchall()
+    except sqlite3.Error:
+        return []
@@ -0,0 +1,165 @@
+"""
+Buscador en memoria de unidades y armas de todas las facciones.
+
+El índice se construye a partir del snapshot del catálogo (una vez por versión) y
+combina dos estructuras:
+
+- un trie de prefijos sobre cada palabra del nombre, para el "buscar mientras
+  escribes" ("sau" -> "Saurus Warriors", "Guerreros Saurios");
+- un índice de trigramas para tolerar erratas ("kroxygor" -> "Kroxigor").
+
+Los nombres y la consulta se normalizan igual: minúsculas y sin tildes ni diéresis,
+así que "dano" encuentra "Daño" y "lanceros" encuentra "Lanceros".
+"""
+
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from services import catalogo
+
+# Ids guardados por nodo del trie: basta para rellenar una página de resultados
+MAX_IDS_NODO = 64
+UMBRAL_DIFUSO = 0.3
+MAX_LISTA_TRIGRAMA = 500
+
+
+class Entrada(NamedTuple):
+    tipo: str          # "unidad" o "arma"
+    nombre: str
+    unit_id: str
+    faction_id: str
+    plegado: str       # nombre normalizado
+
+
+def plegar(texto: str) -> str:
+    """Minúsculas, sin acentos y con los separadores reducidos a un espacio."""
+    descompuesto = unicodedata.normalize("NFKD", texto or "")
+    sin_marcas = "".join(c for c in descompuesto if not unicodedata.combining(c)).lower()
+    return " ".join("".join(c if c.isalnum() else " " for c in sin_marcas).split())
+
+
+def _trigramas(texto: str) -> set:
+    t = f"  {texto} "
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+
+class Indice:
+    def __init__(self, entradas: List[Entrada], version: int = 0):
+        self.version = version
+        # Las unidades primero y los nombres cortos antes: es el orden de desempate
+        self.entradas = sorted(entradas, key=lambda e: (e.tipo != "unidad", len(e.plegado), e.plegado))
+        self._trie: Dict = {}
+        self._trigramas: Dict[str, List[int]] = {}
+        self._n_trigramas: List[int] = []
+        for i, e in enumerate(self.entradas):
+            for palabra in set(e.plegado.split()):
+                nodo = self._trie
+                for c in palabra:
+                    nodo = nodo.setdefault(c, {"": [], "#": 0})
+                    ids = nodo[""]
+                    if not ids or ids[-1] != i:
+                        # "#" cuenta todas las entradas bajo el nodo; "" guarda solo las primeras
+                        nodo["#"] += 1
+                        if len(ids) < MAX_IDS_NODO:
+                            ids.append(i)
+            tris = _trigramas(e.plegado)
+            self._n_trigramas.append(len(tris))
+            for t in tris:
+                self._trigramas.setdefault(t, []).append(i)
+
+    def _nodo(self, palabra: str) -> Optional[Dict]:
+        nodo = self._trie
+        for c in palabra:
+            nodo = nodo.get(c)
+            if nodo is None:
+                return None
+        return nodo
+
+    def buscar(self, consulta: str, limite: int = 10) -> List[Tuple[float, Entrada]]:
+        """Resultados ordenados por puntuación: exacto > prefijo del nombre > prefijo de palabras > difuso."""
+        q = plegar(consulta)
+        if not q:
+            return []
+        palabras = q.split()
+        puntos: Dict[int, float] = {}
+
+        # Prefijos: candidatos de la palabra más selectiva (el nodo con menos entradas);
+        # el resto de palabras de la consulta deben empezar alguna palabra del nombre
+        nodos = [self._nodo(p) for p in palabras]
+        if all(nodos):
+            k = min(range(len(palabras)), key=lambda j: nodos[j]["#"])
+            resto = palabras[:k] + palabras[k + 1:]
+            for i in nodos[k][""]:
+                nombre = self.entradas[i].plegado
+                if resto:
+                    propias = nombre.split()
+                    if not all(any(w.startswith(p) for w in propias) for p in resto):
+                        continue
+                puntos[i] = 3.0 if nombre == q else 2.0 if nombre.startswith(q) else 1.5
+
+        # Difuso por trigramas (similitud de Jaccard) solo si faltan resultados. Los
+        # trigramas muy comunes no discriminan y son los que más cuestan: se saltan
+        if len(puntos) < limite and len(q) >= 4:
+            tris_q = _trigramas(q)
+            max_lista = max(MAX_LISTA_TRIGRAMA, len(self.entradas) // 20)
+            comunes: Counter = Counter()
+            for t in tris_q:
+                lista = self._trigramas.get(t, ())
+                if len(lista) <= max_lista:
+                    comunes.update(lista)
+            for i, n in comunes.items():
+                if i in puntos:
+                    continue
+                sim = n / (len(tris_q) + self._n_trigramas[i] - n)
+                if sim >= UMBRAL_DIFUSO:
+                    puntos[i] = sim
+
+        # Los índices ya siguen el orden de desempate
+        orden = sorted(puntos, key=lambda i: (-puntos[i], i))[:limite]
+        return [(puntos[i], self.entradas[i]) for i in orden]
+
+
+def _construir(snap) -> Indice:
+    entradas = []
+    for uid, nombre in snap.unit_name_by_id.items():
+        fid = snap.faction_by_unit.get(uid, "")
+        entradas.append(Entrada("unidad", nombre, uid, fid, plegar(nombre)))
+        for arma in dict.fromkeys(snap.weapon_names_by_unit.get(uid, ())):
+            entradas.append(Entrada("arma", arma, uid, fid, plegar(arma)))
+    return Indice(entradas, snap.version)
+
+
+_lock = threading.Lock()
+_indice: Optional[Indice] = None
+
+
+def indice() -> Indice:
+    """Índice de la versión actual del catálogo (se reconstruye solo cuando cambia)."""
+    global _indice
+    snap = catalogo.snapshot()
+    actual = _indice
+    if actual is not None and actual.version == snap.version:
+        return actual
+    with _lock:
+        if _indice is None or _indice.version != snap.version:
+            _indice = _construir(snap)
+        return _indice
+
+
+def buscar(consulta: str, limite: int = 10) -> List[Dict[str, object]]:
+    """Resultados listos para la API y la interfaz."""
+    snap = catalogo.snapshot()
+    resultados = []
+    for puntos, e in indice().buscar(consulta, limite):
+        resultados.append({
+            "tipo": e.tipo,
+            "nombre": e.nombre,
+            "unidad": snap.unit_name_by_id.get(e.unit_id, ""),
+            "unit_id": e.unit_id,
+            "faction_id": e.faction_id,
+            "faccion": snap.faction_name_by_id.get(e.faction_id, ""),
+            "puntos": round(puntos, 3),
+        })
+    return resultados
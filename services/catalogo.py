@@ -0,0 +1,165 @@
+"""
+Catálogo de facciones y unidades compartido por todo el proceso.
+
+Se carga con una única consulta al arrancar y se refresca en segundo plano,
+de forma que los desplegables filtran en memoria sin ir a la base de datos.
+Las sesiones no guardan copias: solo los ids seleccionados, y consultan aquí
+los nombres y listas a partir de ellos.
+"""
+
+import threading
+import time
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Tuple
+
+from services import almacen_compartido
+from services.perfilado import perfilado
+from services.unidad_service import get_catalog_index
+
+# Segundos entre refrescos en segundo plano
+REFRESCO_SEGUNDOS = 300
+
+class _Snapshot(NamedTuple):
+    """Catálogo inmutable: se comparte entre todas las sesiones y se sustituye entero al refrescar."""
+    version: int
+    factions: Tuple[Tuple[str, str], ...]                      # ((id, name), ...)
+    faction_names: Tuple[str, ...]
+    faction_by_name: Mapping[str, str]                         # name -> faction_id
+    faction_name_by_id: Mapping[str, str]
+    units_by_faction: Mapping[str, Tuple[Tuple[str, str], ...]]  # faction_id -> ((id, name), ...)
+    unit_names_by_faction: Mapping[str, Tuple[str, ...]]
+    unit_by_name: Mapping[str, Mapping[str, str]]              # faction_id -> {name: unit_id}
+    unit_name_by_id: Mapping[str, str]
+    faction_by_unit: Mapping[str, str]                         # unit_id -> faction_id
+    weapon_names_by_unit: Mapping[str, Tuple[str, ...]]
+
+
+_VACIO = _Snapshot(0, (), (), {}, {}, {}, {}, {}, {}, {}, {})
+
+_lock_carga = threading.Lock()
+_snap: _Snapshot = _VACIO
+_cargado_en = 0.0
+_hilo_refresco = None
+
+
+def _leer_o_consultar(desde_almacen: bool) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str, str]], List[Tuple[str, str]]]:
+    """
+    Los workers que no son escritores leen el catálogo del almacén compartido si está
+    fresco; solo el escritor (o quien no encuentre nada) consulta la base de datos.
+    """
+    if desde_almacen:
+        snap = almacen_compartido.leer("catalogo", "indice", max_edad=2 * REFRESCO_SEGUNDOS)
+        # Los índices publicados por versiones anteriores no traen armas: se ignoran
+        if snap and len(snap) == 3:
+            factions, units, weapons = snap
+            return [tuple(f) for f in factions], [tuple(u) for u in units], [tuple(w) for w in weapons]
+    factions, units, weapons = get_catalog_index()
+    if almacen_compartido.es_escritor():
+        almacen_compartido.escribir("catalogo", "indice", [factions, units, weapons])
+    return factions, units, weapons
+
+
+@perfilado("catalogo_cargar")
+def _cargar(desde_almacen: bool = True) -> None:
+    global _snap, _cargado_en
+    factions, units, weapons = _leer_o_consultar(desde_almacen)
+    armas_por_unidad: Dict[str, List[str]] = {}
+    for (uid, nombre) in weapons:
+        armas_por_unidad.setdefault(uid, []).append(nombre)
+    por_faccion: Dict[str, List[Tuple[str, str]]] = {fid: [] for (fid, _n) in factions}
+    for (uid, name, fid) in units:
+        por_faccion.setdefault(fid, []).append((uid, name))
+    units_by_faction = {fid: tuple(sorted(filas, key=lambda r: r[1])) for fid, filas in por_faccion.items()}
+    # Sustituir la referencia de golpe: los lectores nunca ven un estado a medias
+    _snap = _Snapshot(
+        version=_snap.version + 1,
+        factions=tuple(factions),
+        faction_names=tuple(n for (_id, n) in factions),
+        faction_by_name=MappingProxyType({n: fid for (fid, n) in factions}),
+        faction_name_by_id=MappingProxyType({fid: n for (fid, n) in factions}),
+        units_by_faction=MappingProxyType(units_by_faction),
+        unit_names_by_faction=MappingProxyType({fid: tuple(n for (_u, n) in filas) for fid, filas in units_by_faction.items()}),
+        unit_by_name=MappingProxyType({fid: MappingProxyType({n: uid for (uid, n) in filas}) for fid, filas in units_by_faction.items()}),
+        unit_name_by_id=MappingProxyType({uid: n for (uid, n, _f) in units}),
+        faction_by_unit=MappingProxyType({uid: fid for (uid, _n, fid) in units}),
+        weapon_names_by_unit=MappingProxyType({uid: tuple(ns) for uid, ns in armas_por_unidad.items()}),
+    )
+    _cargado_en = time.monotonic()
+
+
+def _bucle_refresco() -> None:
+    evento = threading.Event()
+    while not evento.wait(REFRESCO_SEGUNDOS):
+        try:
+            # El escritor refresca desde la red; el resto recoge lo que él publica
+            _cargar(desde_almacen=not almacen_compartido.es_escritor())
+        except Exception as e:
+            # Si falla el refresco seguimos sirviendo el último catálogo bueno
+            print(f"[catalogo] Error refrescando catálogo: {e}")
+
+
+def asegurar_cargado() -> None:
+    """Carga el catálogo la primera vez y arranca el hilo de refresco."""
+    global _hilo_refresco
+    if not _snap.version:
+        with _lock_carga:
+            if not _snap.version:
+                _cargar()
+    if _hilo_refresco is None:
+        with _lock_carga:
+            if _hilo_refresco is None:
+                _hilo_refresco = threading.Thread(target=_bucle_refresco, name="catalogo-refresco", daemon=True)
+                _hilo_refresco.start()
+
+
+def snapshot() -> _Snapshot:
+    """Catálogo actual (solo lectura)."""
+    asegurar_cargado()
+    return _snap
+
+
+def edad_s() -> float:
+    """Segundos desde la última carga correcta (-1 si aún no se ha cargado)."""
+    return time.monotonic() - _cargado_en if _snap.version else -1.0
+
+
+def version() -> int:
+    return snapshot().version
+
+
+def get_factions() -> Tuple[Tuple[str, str], ...]:
+    return snapshot().factions
+
+
+def get_units_by_faction(faction_id: str) -> Tuple[Tuple[str, str], ...]:
+    if not faction_id:
+        return ()
+    return snapshot().units_by_faction.get(faction_id, ())
+
+
+def faction_names() -> Tuple[str, ...]:
+    return snapshot().faction_names
+
+
+def faction_id(name: str) -> str:
+    return snapshot().faction_by_name.get(name, "")
+
+
+def faction_name(fid: str) -> str:
+    return snapshot().faction_name_by_id.get(fid, "") if fid else ""
+
+
+def unit_names(fid: str) -> Tuple[str, ...]:
+    return snapshot().unit_names_by_faction.get(fid, ()) if fid else ()
+
+
+def unit_id(fid: str, name: str) -> str:
+    return snapshot().unit_by_name.get(fid, {}).get(name, "")
+
+
+def unit_name(uid: str) -> str:
+    return snapshot().unit_name_by_id.get(uid, "") if uid else ""
+
+
+def unit_faction(uid: str) -> str:
+    return snapshot().faction_by_unit.get(uid, "") if uid else ""
@@ -0,0 +1,116 @@
+"""
+Recálculo incremental de resultados precalculados cuando cambia el catálogo.
+
+Cada entrada cacheada en el almacén compartido (resultados de `simulate`, celdas de
+las matrices de enfrentamientos) se registra con las unidades que usó y la huella de
+sus datos: la fila de la unidad y las de todas sus armas. Así el índice va de cada
+unidad (y, a través de su huella, de cada una de sus armas) a las entradas que
+dependen de ella.
+
+Tras editar el catálogo, `actualizar` recibe las unidades tocadas con sus datos nuevos,
+borra solo las entradas calculadas con otra huella y encola su recálculo en la cola de
+trabajos con la receta guardada. El aviso queda además marcado en el almacén compartido
+y cada proceso (workers del backend, pool de trabajos) vacía en menos de un segundo sus
+cachés de esas unidades (ver `unidad_service`). Solo `ingesta.py` avisa sola: una
+edición directa en Supabase necesita llamar a `POST /api/catalogo/actualizado`.
+
+El coste depende de cuántas entradas usaban las unidades cambiadas, no del tamaño del
+catálogo: en una matriz, cambiar un arma recalcula la fila y la columna de su unidad.
+"""
+
+import hashlib
+import io
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from services import almacen_compartido
+
+# Columnas que no influyen en ningún cálculo
+_IGNORAR = {"created_at", "updated_at", "img_url", "armas"}
+
+
+def huella(unidad: Dict[str, Any], armas: Iterable[Dict[str, Any]]) -> str:
+    """Huella de los datos de una unidad y sus armas (independiente del orden de las armas)."""
+    datos = {
+        "unidad": {k: v for k, v in unidad.items() if k not in _IGNORAR},
+        "armas": sorted(
+            ({k: v for k, v in a.items() if k not in _IGNORAR} for a in armas),
+            key=lambda a: (str(a.get("id", "")), str(a.get("name", ""))),
+        ),
+    }
+    return hashlib.sha1(json.dumps(datos, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def huellas(unit_ids: Iterable[str]) -> Dict[str, str]:
+    """Huellas con los mismos datos (y cachés) que usa la simulación."""
+    from services.unidad_service import obtener_armas_de_unidad, obtener_unidad_por_id
+
+    return {uid: huella(obtener_unidad_por_id(uid) or {}, obtener_armas_de_unidad(uid)) for uid in set(unit_ids) if uid}
+
+
+# --- Recetas: cómo recalcular cada tipo de entrada ---------------------------------------
+# Los parámetros son los de una fila de `lotes.py` (atacante, defensor, reforzada_*...)
+
+def resumen_para_cache(res: Dict[str, Any], detalle: str) -> Dict[str, Any]:
+    """Lo que `SimState.simulate` guarda por enfrentamiento."""
+    from simulador import resumen_combate
+
+    return {"summary": resumen_combate(res), "rounds": res.get("rondas_detalle", []), "detail": detalle}
+
+
+def calcular(receta: Dict[str, Any], unidades: Optional[Dict[str, dict]] = None) -> Tuple[Any, Dict[str, str]]:
+    """
+    Ejecuta una receta y devuelve (valor, huellas de las unidades usadas). `unidades`
+    permite pasar ya resueltas las de una matriz entera.
+    """
+    from lotes import preparar, resolver_unidades
+    from simulador import simular_combate_completo
+
+    # Las recetas guardadas antes de quitar bono_defensor lo traen, pero nunca se aplicaba
+    params = {k: v for k, v in receta["params"].items() if k != "bono_defensor"}
+    ids = [str(params.get("atacante", "")), str(params.get("defensor", ""))]
+    if unidades is None:
+        unidades = resolver_unidades(ids)
+    atacante, defensor = preparar(params, unidades)
+    if atacante is None:
+        raise ValueError("unidad no encontrada")
+    usadas = {uid: huella(unidades[uid], unidades[uid].get("armas", [])) for uid in ids}
+    buf = io.StringIO()
+    res = simular_combate_completo(atacante, defensor, max_rondas=int(params.get("max_rondas") or 10), out=buf)
+    if receta["tipo"] == "combate":
+        return resumen_para_cache(res, buf.getvalue()), usadas
+    if receta["tipo"] == "celda":
+        res.pop("rondas_detalle", None)
+        return res, usadas
+    raise ValueError(f"Receta desconocida: {receta['tipo']!r}")
+
+
+def recalcular(ns: str, clave: str, receta: Dict[str, Any]) -> bool:
+    """
+    Rehace una entrada invalidada y la encola para el escritor; False si no se pudo
+    encolar. Si entretanto hubo otra edición, el escritor la descarta por su huella.
+    """
+    valor, usadas = calcular(receta)
+    return almacen_compartido.guardar(ns, clave, valor, usadas, receta)
+
+
+def actualizar(unidades: Dict[str, dict], recalcular_: bool = True) -> Dict[str, Any]:
+    """
+    Tras un cambio en el catálogo: `unidades` son las tocadas, ya con sus armas en
+    unidad["armas"] (ver `lotes.resolver_unidades`). Borra lo que dependía de sus datos
+    anteriores, vacía sus cachés en este proceso y encola el recálculo de lo borrado.
+    """
+    from services import unidad_service
+
+    nuevas = {uid: huella(u, u.get("armas", [])) for uid, u in unidades.items()}
+    afectadas = almacen_compartido.invalidar_por_huellas(nuevas)
+    unidad_service.invalidar_unidades(list(unidades))
+    trabajos_: List[str] = []
+    if recalcular_:
+        from services import trabajos
+        for ns, clave, receta in afectadas:
+            if receta:
+                trabajos_.append(trabajos.enviar("recalcular", {"ns": ns, "clave": clave, "receta": receta}))
+    print(f"[dependencias] {len(unidades)} unidades, {len(afectadas)} entradas invalidadas, "
+          f"{len(trabajos_)} recálculos encolados")
+    return {"unidades": len(unidades), "invalidadas": len(afectadas), "recalculos": trabajos_}
@@ -0,0 +1,120 @@
+"""
+Miniaturas locales de las imágenes de unidad.
+
+Cada imagen remota se descarga una sola vez, se redimensiona y se guarda en disco;
+después se sirve siempre desde ahí. La miniatura va ligada a la URL de origen: si
+cambia el img_url de la unidad se genera otra (y se borra la vieja), y la URL pública
+lleva `v=` con la versión para que el navegador no siga mostrando la anterior. Con
+AOS_IMG_ORIGEN_DIR se puede usar una carpeta local como origen en lugar del host
+remoto (misma ruta final de la URL).
+"""
+
+import glob
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+import urllib.parse
+import urllib.request
+from typing import Optional, Tuple
+
+CACHE_DIR = os.getenv("AOS_IMG_CACHE_DIR", os.path.join(os.getcwd(), ".cache", "miniaturas"))
+ORIGEN_DIR = os.getenv("AOS_IMG_ORIGEN_DIR", "")
+ANCHOS = (240, 480, 960)
+ANCHO_POR_DEFECTO = 480
+TIMEOUT_S = 10
+
+_locks: dict = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_para(clave: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(clave, threading.Lock())
+
+
+def _ancho_valido(ancho: Optional[int]) -> int:
+    """Solo se admiten unos pocos anchos para no llenar el disco con variantes."""
+    if not ancho:
+        return ANCHO_POR_DEFECTO
+    return min(ANCHOS, key=lambda a: abs(a - int(ancho)))
+
+
+def version(url: str) -> str:
+    """Versión corta de una URL de origen, para la clave en disco y el `v=` de la URL pública."""
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:8]
+
+
+def url_publica(api_url: str, unit_id: str, img_url: str, ancho: int = ANCHO_POR_DEFECTO) -> str:
+    """URL de la miniatura servida por el backend ("" si la unidad no tiene imagen)."""
+    return f"{api_url}/api/img/{unit_id}?w={ancho}&v={version(img_url)}" if img_url else ""
+
+
+def _descargar(url: str) -> bytes:
+    if ORIGEN_DIR:
+        nombre = os.path.basename(urllib.parse.urlparse(url).path)
+        with open(os.path.join(ORIGEN_DIR, nombre), "rb") as f:
+            return f.read()
+    with urllib.request.urlopen(url, timeout=TIMEOUT_S) as r:
+        return r.read()
+
+
+def _redimensionar(datos: bytes, ancho: int, url: str) -> Tuple[bytes, str]:
+    """Devuelve (bytes, media_type). Sin Pillow instalado se guarda la imagen original."""
+    try:
+        from PIL import Image
+    except ImportError:
+        media_type = mimetypes.guess_type(urllib.parse.urlparse(url).path)[0]
+        return datos, media_type or "application/octet-stream"
+    img = Image.open(io.BytesIO(datos))
+    if img.width > ancho:
+        img = img.resize((ancho, max(1, round(img.height * ancho / img.width))), Image.LANCZOS)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA")
+    out = io.BytesIO()
+    img.save(out, format="WEBP", quality=80)
+    return out.getvalue(), "image/webp"
+
+
+def miniatura(unit_id: str, ancho: Optional[int] = None) -> Optional[Tuple[str, str, str, str]]:
+    """
+    Ruta en disco de la miniatura de una unidad, generándola si hace falta.
+
+    Returns:
+        (ruta, etag, media_type, version) o None si la unidad no tiene imagen.
+    """
+    from services.unidad_service import obtener_unidad_por_id
+
+    ancho = _ancho_valido(ancho)
+    # La unidad sale de la caché en memoria; su img_url decide qué miniatura toca
+    url = (obtener_unidad_por_id(unit_id) or {}).get("img_url") or ""
+    if not url:
+        return None
+    base = os.path.join(CACHE_DIR, f"{unit_id}_{ancho}_{version(url)}")
+    with _lock_para(base):
+        # El .meta se escribe el último: si existe, la miniatura está completa
+        if os.path.exists(base + ".meta"):
+            with open(base + ".meta", encoding="ascii") as f:
+                etag, media_type = f.read().split()
+            return base + ".bin", etag, media_type, version(url)
+
+        datos, media_type = _redimensionar(_descargar(url), ancho, url)
+        etag = hashlib.sha1(datos).hexdigest()
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Escrituras atómicas: otro worker nunca lee un fichero a medias
+        for ext, contenido in ((".bin", datos), (".meta", f"{etag} {media_type}".encode("ascii"))):
+            tmp = f"{base}{ext}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(contenido)
+            os.replace(tmp, base + ext)
+        # Las de URLs anteriores ya no se van a pedir (antes de las versiones no llevaban sufijo)
+        viejas = glob.glob(os.path.join(CACHE_DIR, f"{glob.escape(unit_id)}_{ancho}_*.*"))
+        viejas += glob.glob(os.path.join(CACHE_DIR, f"{glob.escape(unit_id)}_{ancho}.*"))
+        for vieja in viejas:
+            if not vieja.startswith(base + ".") and not vieja.endswith(".tmp"):
+                try:
+                    os.remove(vieja)
+                except OSError:
+                    pass
+        return base + ".bin", etag, media_type, version(url)
@@ -0,0 +1,191 @@
+"""
+Perfilado bajo demanda de simulaciones, lotes y consultas al catálogo.
+
+Se activa con la variable de entorno AOS_PERFIL o por petición (`forzar=True`: la
+casilla *Perfilar*, `?perfil=1`), esto último solo si AOS_PERFIL_PERMITIR=1 o, en la
+API, si la petición llega desde la propia máquina:
+
+    AOS_PERFIL=1          cProfile + muestreo de pilas
+    AOS_PERFIL=cprofile   solo cProfile (determinista, resumen por función)
+    AOS_PERFIL=muestreo   solo muestreo (menos intrusivo, para flamegraph)
+
+Cada sesión escribe en AOS_PERFIL_DIR (por defecto ./.cache/perfiles):
+
+    <fecha>_<nombre>_<pid>.prof     estadísticas de pstats (snakeviz, pstats)
+    <fecha>_<nombre>_<pid>.txt      resumen por función, ordenado por tiempo acumulado
+    <fecha>_<nombre>_<pid>.folded   pilas plegadas (flamegraph.pl, speedscope, inferno)
+
+Se conservan los AOS_PERFIL_MAX ficheros más recientes (150 por defecto); los demás se
+borran al cerrar cada sesión.
+
+Desactivado no cuesta nada: `perfilado` devuelve la función sin envolver y `sesion`
+devuelve None tras mirar una variable de entorno.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from typing import Any, Callable, Optional, Set
+
+DIRECTORIO = os.getenv("AOS_PERFIL_DIR", os.path.join(".", ".cache", "perfiles"))
+INTERVALO_S = float(os.getenv("AOS_PERFIL_INTERVALO_MS", "2")) / 1000.0
+LINEAS_RESUMEN = 40
+MAX_FICHEROS = int(os.getenv("AOS_PERFIL_MAX", "150"))
+
+# Hilos que ya están dentro de una sesión: las anidadas se ejecutan sin perfilar
+_local = threading.local()
+# Un solo profiler activo a la vez en el proceso (en 3.12+ cProfile es global): con el
+# perfilado encendido los pasos perfilados de sesiones concurrentes se serializan
+_lock_perfil = threading.Lock()
+
+
+def forzado_permitido() -> bool:
+    """True si se admite perfilar por petición (AOS_PERFIL_PERMITIR=1)."""
+    return os.environ.get("AOS_PERFIL_PERMITIR", "").strip().lower() in ("1", "true", "si", "sí", "yes")
+
+
+def modo(forzar: bool = False) -> str:
+    """
+    Modo pedido por AOS_PERFIL ("" si está desactivado y no se fuerza). Quien pasa
+    `forzar` debe haber comprobado antes que la petición puede pedirlo.
+    """
+    valor = os.environ.get("AOS_PERFIL", "").strip().lower()
+    if valor in ("", "0", "false", "no"):
+        return "ambos" if forzar else ""
+    return valor if valor in ("cprofile", "muestreo") else "ambos"
+
+
+class _Muestreador(threading.Thread):
+    """Toma la pila de los hilos registrados cada INTERVALO_S y la acumula plegada."""
+
+    def __init__(self):
+        super().__init__(name="perfil-muestreo", daemon=True)
+        self.hilos: Set[int] = set()
+        self.pilas: Counter = Counter()
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.wait(INTERVALO_S):
+            frames = sys._current_frames()
+            for tid in list(self.hilos):
+                frame = frames.get(tid)
+                if frame is None:
+                    continue
+                pila = []
+                while frame is not None:
+                    co = frame.f_code
+                    pila.append(f"{os.path.basename(co.co_filename)}:{co.co_name}")
+                    frame = frame.f_back
+                self.pilas[";".join(reversed(pila))] += 1
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+
+class Sesion:
+    """
+    Una sesión de perfilado que puede recorrer varios hilos (una simulación en segundo
+    plano avanza en `asyncio.to_thread` y cada paso puede caer en un hilo distinto).
+    Los pasos se ejecutan con `ejecutar` y `cerrar` escribe los ficheros.
+    """
+
+    def __init__(self, nombre: str, modo_: str):
+        self.nombre = nombre
+        self.inicio = time.time()
+        self.perfil = cProfile.Profile() if modo_ in ("ambos", "cprofile") else None
+        self.muestreador = _Muestreador() if modo_ in ("ambos", "muestreo") else None
+        if self.muestreador:
+            self.muestreador.start()
+
+    def ejecutar(self, fn: Callable, *args, **kwargs) -> Any:
+        if getattr(_local, "activo", False):
+            return fn(*args, **kwargs)
+        tid = threading.get_ident()
+        _local.activo = True
+        with _lock_perfil:
+            if self.muestreador:
+                self.muestreador.hilos.add(tid)
+            if self.perfil:
+                self.perfil.enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if self.perfil:
+                    self.perfil.disable()
+                if self.muestreador:
+                    self.muestreador.hilos.discard(tid)
+                _local.activo = False
+
+    def cerrar(self) -> Optional[str]:
+        """Escribe los ficheros y devuelve la ruta base (sin extensión)."""
+        if self.muestreador:
+            self.muestreador.parar()
+        os.makedirs(DIRECTORIO, exist_ok=True)
+        fecha = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.inicio))
+        base = os.path.join(DIRECTORIO, f"{fecha}_{self.nombre}_{os.getpid()}")
+        if self.perfil:
+            self.perfil.dump_stats(base + ".prof")
+            texto = io.StringIO()
+            stats = pstats.Stats(self.perfil, stream=texto)
+            stats.sort_stats("cumulative").print_stats(LINEAS_RESUMEN)
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                f.write(texto.getvalue())
+        if self.muestreador and self.muestreador.pilas:
+            with open(base + ".folded", "w", encoding="utf-8") as f:
+                for pila, n in self.muestreador.pilas.most_common():
+                    f.write(f"{pila} {n}\n")
+        _rotar()
+        print(f"[perfil] {self.nombre}: {base}.*")
+        return base
+
+
+def _rotar() -> None:
+    """Borra los ficheros más antiguos del directorio por encima de MAX_FICHEROS."""
+    try:
+        rutas = [e.path for e in os.scandir(DIRECTORIO)
+                 if e.is_file() and e.name.endswith((".prof", ".txt", ".folded"))]
+        rutas.sort(key=os.path.getmtime)
+        for ruta in rutas[:max(0, len(rutas) - MAX_FICHEROS)]:
+            os.remove(ruta)
+    except OSError:
+        pass
+
+
+def sesion(nombre: str, forzar: bool = False) -> Optional[Sesion]:
+    """Abre una sesión si el perfilado está activo (o se fuerza); si no, None."""
+    m = modo(forzar)
+    return Sesion(nombre, m) if m else None
+
+
+def perfilar(nombre: str, fn: Callable, *args, forzar: bool = False, **kwargs) -> Any:
+    """Ejecuta `fn` en su propia sesión de perfilado si está activo; si no, la llama sin más."""
+    s = sesion(nombre, forzar) if not getattr(_local, "activo", False) else None
+    if s is None:
+        return fn(*args, **kwargs)
+    try:
+        return s.ejecutar(fn, *args, **kwargs)
+    finally:
+        s.cerrar()
+
+
+def perfilado(nombre: str) -> Callable[[Callable], Callable]:
+    """
+    Decorador para funciones de servicio (catálogo, consultas). Se decide al importar:
+    sin AOS_PERFIL la función se devuelve tal cual, sin envoltorio.
+    """
+    def decorador(fn: Callable) -> Callable:
+        if not modo():
+            return fn
+
+        @wraps(fn)
+        def envuelta(*args, **kwargs):
+            return perfilar(nombre, fn, *args, **kwargs)
+        return envuelta
+    return decorador
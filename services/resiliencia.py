@@ -0,0 +1,222 @@
+"""
+Protecciones para las consultas a Supabase: timeout por llamada, circuit breaker
+y caché stale-while-revalidate.
+
+Si la base de datos va lenta o cae, los handlers reciben al momento el último dato
+bueno en lugar de esperar al timeout completo, y el breaker evita amontonar
+peticiones contra un servicio que ya está fallando.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="supabase")
+
+_breakers: List["CircuitBreaker"] = []
+_caches: List["CacheSWR"] = []
+
+
+class CircuitoAbierto(RuntimeError):
+    """El breaker está abierto: no se intenta la llamada."""
+
+
+def con_timeout(fn: Callable[[], Any], timeout_s: float) -> Any:
+    """
+    Ejecuta `fn` en el pool y lanza TimeoutError si tarda más de `timeout_s`. El hilo
+    no se puede interrumpir: `fn` debe tener su propio timeout (p. ej. el de HTTP del
+    cliente) o unas pocas llamadas colgadas agotan el pool.
+    """
+    futuro = _pool.submit(fn)
+    try:
+        return futuro.result(timeout=timeout_s)
+    except FuturesTimeout:
+        futuro.cancel()
+        raise TimeoutError(f"Consulta sin respuesta en {timeout_s} s")
+
+
+class CircuitBreaker:
+    """
+    Cerrado: las llamadas pasan. Tras `umbral` fallos seguidos se abre y rechaza
+    todo durante `reset_s`; después deja pasar una llamada de prueba (semiabierto)
+    y vuelve a cerrarse si sale bien.
+    """
+
+    def __init__(self, nombre: str, umbral: int = 5, reset_s: float = 30.0):
+        self.nombre = nombre
+        self.umbral = umbral
+        self.reset_s = reset_s
+        self.fallos = 0
+        self.abierto_desde = 0.0
+        self.aperturas = 0
+        self.rechazadas = 0
+        self._lock = threading.Lock()
+        self._prueba_en_curso = False
+        _breakers.append(self)
+
+    @property
+    def estado(self) -> str:
+        if self.fallos < self.umbral:
+            return "cerrado"
+        if time.monotonic() - self.abierto_desde >= self.reset_s:
+            return "semiabierto"
+        return "abierto"
+
+    def llamar(self, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            estado = self.estado
+            if estado == "abierto" or (estado == "semiabierto" and self._prueba_en_curso):
+                self.rechazadas += 1
+                raise CircuitoAbierto(f"Circuito '{self.nombre}' abierto")
+            if estado == "semiabierto":
+                self._prueba_en_curso = True
+        try:
+            resultado = fn()
+        except Exception:
+            with self._lock:
+                self._prueba_en_curso = False
+                self.fallos += 1
+                if self.fallos >= self.umbral:
+                    if estado != "abierto":
+                        self.aperturas += 1
+                    self.abierto_desde = time.monotonic()
+            raise
+        with self._lock:
+            self._prueba_en_curso = False
+            self.fallos = 0
+        return resultado
+
+
+class CacheSWR:
+    """
+    Caché stale-while-revalidate por clave.
+
+    - Dato fresco (< fresco_s): se devuelve tal cual.
+    - Dato viejo: se devuelve al momento y se refresca en segundo plano.
+    - Sin dato: se carga en el momento; si la carga falla y hay un dato anterior
+      (aunque supere max_s) se sirve ese como último valor bueno.
+
+    Los valores se comparten entre llamadas: no deben modificarse.
+    """
+
+    def __init__(self, nombre: str, fresco_s: float = 60.0, max_s: float = 3600.0, max_claves: int = 10000):
+        self.nombre = nombre
+        self.fresco_s = fresco_s
+        self.max_s = max_s
+        self.max_claves = max_claves
+        self._datos: Dict[Hashable, Tuple[float, Any]] = {}
+        self._refrescando: set = set()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.viejos_servidos = 0
+        self.fallos_carga = 0
+        self.cargas = 0
+        _caches.append(self)
+
+    def get(self, clave: Hashable, cargar: Callable[[], Any]) -> Any:
+        entrada = self._datos.get(clave)
+        ahora = time.monotonic()
+        if entrada is not None:
+            edad = ahora - entrada[0]
+            if edad < self.fresco_s:
+                self.aciertos += 1
+                return entrada[1]
+            if edad < self.max_s:
+                self.viejos_servidos += 1
+                self._refrescar_en_fondo(clave, cargar)
+                return entrada[1]
+        try:
+            return self._cargar(clave, cargar)
+        except Exception:
+            if entrada is not None:
+                self.viejos_servidos += 1
+                return entrada[1]
+            raise
+
+    def _cargar(self, clave: Hashable, cargar: Callable[[], Any]) -> Any:
+        try:
+            valor = cargar()
+        except Exception:
+            self.fallos_carga += 1
+            raise
+        self.cargas += 1
+        with self._lock:
+            if len(self._datos) >= self.max_claves and clave not in self._datos:
+                # Descartar la entrada más antigua
+                viejo = min(self._datos, key=lambda k: self._datos[k][0])
+                del self._datos[viejo]
+            self._datos[clave] = (time.monotonic(), valor)
+        return valor
+
+    def _refrescar_en_fondo(self, clave: Hashable, cargar: Callable[[], Any]) -> None:
+        with self._lock:
+            if clave in self._refrescando:
+                return
+            self._refrescando.add(clave)
+
+        def _tarea():
+            try:
+                self._cargar(clave, cargar)
+            except Exception:
+                pass
+            finally:
+                with self._lock:
+                    self._refrescando.discard(clave)
+
+        threading.Thread(target=_tarea, name=f"swr-{self.nombre}", daemon=True).start()
+
+    def edad_maxima(self) -> float:
+        """Edad en segundos de la entrada más antigua (0 si está vacía)."""
+        if not self._datos:
+            return 0.0
+        ahora = time.monotonic()
+        return max(ahora - t for (t, _v) in list(self._datos.values()))
+
+    def invalidar(self, clave: Hashable = None) -> None:
+        with self._lock:
+            if clave is None:
+                self._datos.clear()
+            else:
+                self._datos.pop(clave, None)
+
+
+def metricas() -> Dict[str, Any]:
+    """Estado de breakers, cachés y escrituras al almacén compartido para exponer como métricas."""
+    from services import almacen_compartido
+
+    return {
+        "breakers": {
+            b.nombre: {"estado": b.estado, "fallos": b.fallos, "aperturas": b.aperturas, "rechazadas": b.rechazadas}
+            for b in _breakers
+        },
+        "caches": {
+            c.nombre: {
+                "entradas": len(c._datos), "aciertos": c.aciertos, "viejos_servidos": c.viejos_servidos,
+                "cargas": c.cargas, "fallos_carga": c.fallos_carga, "edad_maxima_s": c.edad_maxima(),
+            }
+            for c in _caches
+        },
+        "almacen": almacen_compartido.contadores(),
+    }
+
+
+def metricas_prometheus() -> str:
+    """Las mismas métricas en formato de texto de Prometheus."""
+    m = metricas()
+    estados = {"cerrado": 0, "semiabierto": 1, "abierto": 2}
+    lineas = []
+    for nombre, b in m["breakers"].items():
+        lineas.append(f'aos_breaker_estado{{breaker="{nombre}"}} {estados[b["estado"]]}')
+        lineas.append(f'aos_breaker_fallos{{breaker="{nombre}"}} {b["fallos"]}')
+        lineas.append(f'aos_breaker_aperturas_total{{breaker="{nombre}"}} {b["aperturas"]}')
+        lineas.append(f'aos_breaker_rechazadas_total{{breaker="{nombre}"}} {b["rechazadas"]}')
+    for nombre, c in m["caches"].items():
+        for campo in ("entradas", "aciertos", "viejos_servidos", "cargas", "fallos_carga", "edad_maxima_s"):
+            sufijo = "_total" if campo in ("aciertos", "viejos_servidos", "cargas", "fallos_carga") else ""
+            lineas.append(f'aos_cache_{campo}{sufijo}{{cache="{nombre}"}} {c[campo]}')
+    a = m["almacen"]
+    lineas.append(f'aos_almacen_escritor {int(a["escritor"])}')
+    for campo in ("encoladas", "escritas", "obsoletas", "descartadas"):
+        lineas.append(f'aos_almacen_escrituras_{campo}_total {a[campo]}')
+    return "\n".join(lineas) + "\n"
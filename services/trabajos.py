@@ -0,0 +1,523 @@
+"""
+Cola local de trabajos largos: combates, matrices de enfrentamientos y Monte Carlo grandes.
+
+Los trabajos se guardan en SQLite (AOS_TRABAJOS_DB) y los ejecuta un pool de procesos,
+así que ni un handler de Reflex ni una petición HTTP se quedan esperando: se envía el
+trabajo, se recibe un id y se consulta su estado hasta que termina.
+
+    id = enviar("montecarlo", {"atacante": uid1, "defensor": uid2, "ensayos": 10**6})
+    estado(id)    -> {"estado": "ejecutando", "progreso": 0.42, ...}
+    cancelar(id)
+
+Estados: pendiente -> ejecutando -> hecho | error | cancelado. El proceso que ejecuta
+un trabajo escribe el progreso en la base y en esa misma escritura lee si se ha pedido
+cancelarlo, de modo que funciona igual desde cualquier worker del backend. Cada proceso
+del backend puede tener su despachador: los trabajos se reclaman con un UPDATE
+condicional y nunca se ejecutan dos veces. Los terminados se conservan
+AOS_TRABAJOS_RETENCION_H horas (24 por defecto) y luego se borran.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+
+RUTA = os.getenv("AOS_TRABAJOS_DB", os.path.join(tempfile.gettempdir(), "proyecto_aos_trabajos.db"))
+PROCESOS = int(os.getenv("AOS_TRABAJOS_PROCESOS", str(max(1, (os.cpu_count() or 2) - 1))))
+RETENCION_S = float(os.getenv("AOS_TRABAJOS_RETENCION_H", "24")) * 3600.0
+# Cada cuánto escribe su progreso un trabajo (y mira si lo han cancelado)
+INTERVALO_AVANCE_S = 0.5
+# Un trabajo "ejecutando" sin escribir progreso en este tiempo se da por huérfano
+HUERFANO_S = 300.0
+MANTENIMIENTO_S = 60.0
+BLOQUE_MONTECARLO = 20_000
+# Límites de lo que se acepta en la cola: un trabajo no debe ocupar un proceso horas
+MAX_ENSAYOS = int(os.getenv("AOS_TRABAJOS_MAX_ENSAYOS", "10000000"))
+MAX_CELDAS = int(os.getenv("AOS_TRABAJOS_MAX_CELDAS", "2500"))
+MAX_RONDAS = 50
+
+TERMINADOS = ("hecho", "error", "cancelado")
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id TEXT PRIMARY KEY,
+    tipo TEXT NOT NULL,
+    params TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    progreso REAL NOT NULL DEFAULT 0,
+    mensaje TEXT NOT NULL DEFAULT '',
+    cancelar INTEGER NOT NULL DEFAULT 0,
+    resultado TEXT,
+    error TEXT,
+    creado REAL NOT NULL,
+    iniciado REAL,
+    terminado REAL,
+    actualizado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trabajos_estado ON trabajos (estado, creado);
+"""
+
+_local = threading.local()
+
+
+class Cancelado(Exception):
+    """Se lanza dentro del trabajo cuando alguien ha pedido cancelarlo."""
+
+
+def _conexion() -> sqlite3.Connection:
+    con = getattr(_local, "con", None)
+    if con is None:
+        # A diferencia del almacén de resultados aquí no se descarta nada: se espera al lock
+        con = sqlite3.connect(RUTA, timeout=10.0)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.executescript(_ESQUEMA)
+        _local.con = con
+    return con
+
+
+def _a_dict(fila: sqlite3.Row, con_resultado: bool = True) -> Dict[str, Any]:
+    d = {
+        "id": fila["id"],
+        "tipo": fila["tipo"],
+        "estado": fila["estado"],
+        "progreso": fila["progreso"],
+        "mensaje": fila["mensaje"],
+        "params": json.loads(fila["params"]),
+        "creado": fila["creado"],
+        "iniciado": fila["iniciado"],
+        "terminado": fila["terminado"],
+    }
+    if fila["error"]:
+        d["error"] = fila["error"]
+    if con_resultado and fila["resultado"] is not None:
+        d["resultado"] = json.loads(fila["resultado"])
+    return d
+
+
+# --- API de la cola ---------------------------------------------------------------
+
+def _entero(params: Dict[str, Any], clave: str, defecto: int, minimo: int, maximo: int) -> int:
+    valor = params.get(clave)
+    if valor is None or valor == "":
+        return defecto
+    try:
+        n = int(float(valor))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"'{clave}' debe ser un entero")
+    if not minimo <= n <= maximo:
+        raise ValueError(f"'{clave}' debe estar entre {minimo} y {maximo}")
+    return n
+
+
+def _ids(valor: Any, clave: str) -> List[str]:
+    if not isinstance(valor, list) or not valor:
+        raise ValueError(f"'{clave}' debe ser una lista de ids no vacía")
+    return [str(u) for u in valor]
+
+
+def validar(tipo: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Comprueba y normaliza los parámetros antes de encolar: acota ensayos, rondas y
+    tamaño de matriz, y rechaza unidades que no existen en lugar de fallar ya en el
+    pool. Lanza ValueError.
+    """
+    if tipo not in TIPOS:
+        raise ValueError(f"Tipo de trabajo desconocido: {tipo!r} (válidos: {', '.join(TIPOS)})")
+    if not isinstance(params, dict):
+        raise ValueError("'params' debe ser un objeto")
+    params = dict(params)
+    if tipo == "recalcular":
+        # Solo lo encola services/dependencias con recetas ya guardadas
+        if not isinstance(params.get("receta"), dict) or not params.get("ns") or not params.get("clave"):
+            raise ValueError("'recalcular' necesita 'ns', 'clave' y 'receta'")
+        return params
+    params["max_rondas"] = _entero(params, "max_rondas", 10, 1, MAX_RONDAS)
+    if params.get("bono_defensor"):
+        from lotes import ERROR_BONO_DEFENSOR
+        raise ValueError(ERROR_BONO_DEFENSOR)
+    if tipo == "matriz":
+        atacantes = _ids(params.get("atacantes"), "atacantes")
+        defensores = _ids(params.get("defensores"), "defensores")
+        if len(atacantes) * len(defensores) > MAX_CELDAS:
+            raise ValueError(f"la matriz no puede pasar de {MAX_CELDAS} celdas")
+        params["atacantes"], params["defensores"] = atacantes, defensores
+        ids = atacantes + defensores
+    else:
+        if not params.get("atacante") or not params.get("defensor"):
+            raise ValueError("faltan 'atacante' y 'defensor'")
+        params["atacante"], params["defensor"] = str(params["atacante"]), str(params["defensor"])
+        ids = [params["atacante"], params["defensor"]]
+    if tipo == "montecarlo":
+        params["ensayos"] = _entero(params, "ensayos", 100_000, 1, MAX_ENSAYOS)
+        try:
+            confianza = float(params.get("confianza") or 0.95)
+        except (TypeError, ValueError):
+            confianza = -1.0
+        if not 0.5 <= confianza < 1.0:
+            raise ValueError("'confianza' debe estar entre 0.5 y 1")
+        params["confianza"] = confianza
+
+    from services.unidad_service import obtener_unidades_por_ids
+
+    existentes = obtener_unidades_por_ids(ids)
+    faltan = sorted({u for u in ids if u not in existentes})
+    if faltan:
+        raise ValueError(f"unidades no encontradas: {', '.join(faltan)}")
+    return params
+
+
+def enviar(tipo: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Encola un trabajo y devuelve su id. Lanza ValueError si el tipo o los parámetros no son válidos."""
+    params = validar(tipo, {} if params is None else params)
+    id_ = uuid.uuid4().hex
+    ahora = time.time()
+    con = _conexion()
+    with con:
+        con.execute(
+            "INSERT INTO trabajos (id, tipo, params, estado, creado, actualizado) VALUES (?, ?, ?, 'pendiente', ?, ?)",
+            (id_, tipo, json.dumps(params, ensure_ascii=False), ahora, ahora),
+        )
+    if _despachador is not None:
+        _despachador.despertar.set()
+    return id_
+
+
+def estado(id_: str, con_resultado: bool = True) -> Optional[Dict[str, Any]]:
+    """Registro del trabajo (None si no existe o ya se ha borrado por retención)."""
+    fila = _conexion().execute("SELECT * FROM trabajos WHERE id = ?", (id_,)).fetchone()
+    return _a_dict(fila, con_resultado) if fila else None
+
+
+def listar(limite: int = 20) -> List[Dict[str, Any]]:
+    """Los trabajos más recientes, sin resultados (de todos: no exponer en la API pública)."""
+    filas = _conexion().execute("SELECT * FROM trabajos ORDER BY creado DESC LIMIT ?", (limite,)).fetchall()
+    return [_a_dict(f, con_resultado=False) for f in filas]
+
+
+def cancelar(id_: str) -> bool:
+    """
+    Un pendiente se cancela al momento; uno en ejecución se marca y se detiene en su
+    siguiente aviso de progreso. False si no existe o ya había terminado.
+    """
+    ahora = time.time()
+    con = _conexion()
+    with con:
+        cur = con.execute(
+            "UPDATE trabajos SET estado = 'cancelado', cancelar = 1, terminado = ?, actualizado = ? "
+            "WHERE id = ? AND estado = 'pendiente'", (ahora, ahora, id_),
+        )
+        if cur.rowcount:
+            return True
+        cur = con.execute("UPDATE trabajos SET cancelar = 1 WHERE id = ? AND estado = 'ejecutando'", (id_,))
+        return cur.rowcount > 0
+
+
+def podar(retencion_s: float = RETENCION_S) -> int:
+    """Borra los trabajos terminados hace más de `retencion_s` y recupera los huérfanos."""
+    ahora = time.time()
+    con = _conexion()
+    with con:
+        # Ejecutando sin dar señales de vida: su proceso murió, vuelve a la cola
+        con.execute(
+            "UPDATE trabajos SET estado = 'pendiente', progreso = 0, mensaje = '', actualizado = ? "
+            "WHERE estado = 'ejecutando' AND actualizado < ?", (ahora, ahora - HUERFANO_S),
+        )
+        cur = con.execute(
+            "DELETE FROM trabajos WHERE estado IN ('hecho', 'error', 'cancelado') AND terminado < ?",
+            (ahora - retencion_s,),
+        )
+    return cur.rowcount
+
+
+def _reclamar() -> Optional[str]:
+    """Pasa a 'ejecutando' el pendiente más antiguo; el UPDATE condicional evita duplicados."""
+    con = _conexion()
+    while True:
+        fila = con.execute(
+            "SELECT id FROM trabajos WHERE estado = 'pendiente' ORDER BY creado LIMIT 1"
+        ).fetchone()
+        if fila is None:
+            return None
+        ahora = time.time()
+        with con:
+            cur = con.execute(
+                "UPDATE trabajos SET estado = 'ejecutando', iniciado = ?, actualizado = ? "
+                "WHERE id = ? AND estado = 'pendiente'", (ahora, ahora, fila["id"]),
+            )
+        if cur.rowcount:
+            return fila["id"]
+
+
+def _terminar(id_: str, estado_: str, resultado: Any = None, error: Optional[str] = None) -> None:
+    ahora = time.time()
+    con = _conexion()
+    with con:
+        con.execute(
+            "UPDATE trabajos SET estado = ?, resultado = ?, error = ?, terminado = ?, actualizado = ?, "
+            "progreso = CASE WHEN ? = 'hecho' THEN 1 ELSE progreso END "
+            "WHERE id = ? AND estado = 'ejecutando'",
+            (estado_, None if resultado is None else json.dumps(resultado, ensure_ascii=False),
+             error, ahora, ahora, estado_, id_),
+        )
+
+
+# --- Ejecución (en los procesos del pool) ------------------------------------------
+
+class _Avance:
+    """
+    Callback de progreso que recibe cada trabajo: `avance(fraccion, mensaje)`.
+    Escribe como mucho cada INTERVALO_AVANCE_S y lanza Cancelado si se ha pedido.
+    """
+
+    def __init__(self, id_: str):
+        self.id = id_
+        self._ultimo = 0.0
+
+    def __call__(self, fraccion: float, mensaje: str = "") -> None:
+        ahora = time.time()
+        if ahora - self._ultimo < INTERVALO_AVANCE_S:
+            return
+        self._ultimo = ahora
+        con = _conexion()
+        with con:
+            con.execute(
+                "UPDATE trabajos SET progreso = ?, mensaje = ?, actualizado = ? WHERE id = ?",
+                (max(0.0, min(1.0, float(fraccion))), mensaje, ahora, self.id),
+            )
+            fila = con.execute("SELECT cancelar FROM trabajos WHERE id = ?", (self.id,)).fetchone()
+        if fila is None or fila["cancelar"]:
+            raise Cancelado()
+
+
+def _ejecutar(id_: str) -> str:
+    """Ejecuta un trabajo ya reclamado y deja su estado final en la base."""
+    fila = _conexion().execute("SELECT tipo, params, cancelar FROM trabajos WHERE id = ?", (id_,)).fetchone()
+    if fila is None:
+        return "borrado"
+    if fila["cancelar"]:
+        _terminar(id_, "cancelado")
+        return "cancelado"
+    try:
+        from services.perfilado import perfilar
+        resultado = perfilar(f"trabajo_{fila['tipo']}", TIPOS[fila["tipo"]], json.loads(fila["params"]), _Avance(id_))
+    except Cancelado:
+        _terminar(id_, "cancelado")
+        return "cancelado"
+    except Exception as e:
+        _terminar(id_, "error", error=f"{type(e).__name__}: {e}")
+        return "error"
+    _terminar(id_, "hecho", resultado)
+    return "hecho"
+
+
+# --- Tipos de trabajo ----------------------------------------------------------------
+# Cada tipo es una función (params, avance) -> resultado serializable en JSON. Los
+# enfrentamientos usan las mismas claves que una fila de `lotes.py`.
+
+def _enfrentamiento(params: Dict[str, Any]):
+    from lotes import preparar, resolver_unidades
+
+    unidades = resolver_unidades([str(params.get("atacante", "")), str(params.get("defensor", ""))])
+    atacante, defensor = preparar(params, unidades)
+    if atacante is None:
+        raise ValueError("unidad no encontrada")
+    return atacante, defensor
+
+
+def _trabajo_combate(params: Dict[str, Any], avance: Callable) -> Dict[str, Any]:
+    """Combate por medias completo, con el detalle de texto."""
+    import io
+    from simulador import iterar_combate
+
+    atacante, defensor = _enfrentamiento(params)
+    max_rondas = int(params.get("max_rondas") or 10)
+    buf = io.StringIO()
+    gen = iterar_combate(atacante, defensor, max_rondas=max_rondas, out=buf)
+    while True:
+        try:
+            fila = next(gen)
+        except StopIteration as fin:
+            res = fin.value
+            break
+        avance(fila[0] / max_rondas, f"ronda {fila[0]}")
+    res["detalle"] = buf.getvalue()
+    return res
+
+
+def _trabajo_montecarlo(params: Dict[str, Any], avance: Callable) -> Dict[str, Any]:
+    """Monte Carlo de `ensayos` fijos, por bloques para informar del progreso."""
+    import random
+    from statistics import NormalDist
+    from montecarlo import _Preparado
+
+    atacante, defensor = _enfrentamiento(params)
+    ensayos = int(params.get("ensayos") or 100_000)
+    max_rondas = int(params.get("max_rondas") or 10)
+    confianza = float(params.get("confianza") or 0.95)
+    prep = _Preparado(atacante, defensor, atacante["armas"], defensor["armas"])
+    rng = random.Random(params.get("semilla"))
+    agregado = prep.agregado(max_rondas)
+    inicio = time.perf_counter()
+    hechos = 0
+    while hechos < ensayos:
+        n = min(BLOQUE_MONTECARLO, ensayos - hechos)
+        prep.acumular(agregado, rng, n, max_rondas)
+        hechos += n
+        avance(hechos / ensayos, f"{hechos} ensayos")
+    final = agregado.resumen(NormalDist().inv_cdf(0.5 + confianza / 2.0))
+    final["segundos"] = time.perf_counter() - inicio
+    final["motivo"] = "max_ensayos"
+    final["confianza"] = confianza
+    return final
+
+
+def _trabajo_matriz(params: Dict[str, Any], avance: Callable) -> Dict[str, Any]:
+    """
+    Matriz de enfrentamientos por medias: cada atacante de `atacantes` contra cada
+    defensor de `defensores`. Las opciones (reforzada_*, bono_atacante...) se aplican
+    a todas las celdas.
+
+    Cada celda se guarda en el almacén compartido con sus dos unidades como
+    dependencias: al repetir la matriz tras editar una unidad solo se recalculan su
+    fila y su columna (ver services/dependencias.py).
+    """
+    from lotes import resolver_unidades
+    from services import almacen_compartido, dependencias
+
+    atacantes = [str(u) for u in params.get("atacantes") or []]
+    defensores = [str(u) for u in params.get("defensores") or []]
+    if not atacantes or not defensores:
+        raise ValueError("la matriz necesita 'atacantes' y 'defensores'")
+    opciones = {k: v for k, v in params.items() if k not in ("atacantes", "defensores")}
+    opciones["max_rondas"] = int(params.get("max_rondas") or 10)
+    unidades = resolver_unidades(atacantes + defensores)
+    total = len(atacantes) * len(defensores)
+    celdas = []
+    cacheadas = calculadas = 0
+    for i, a in enumerate(atacantes):
+        fila_res = []
+        for j, d in enumerate(defensores):
+            clave = almacen_compartido.clave_resultado("celda", a, d, opciones)
+            res = almacen_compartido.leer_resultado(clave)
+            if res is not None:
+                cacheadas += 1
+            elif a in unidades and d in unidades:
+                receta = {"tipo": "celda", "params": dict(opciones, atacante=a, defensor=d)}
+                res, usadas = dependencias.calcular(receta, unidades)
+                almacen_compartido.guardar_resultado(clave, res, huellas=usadas, receta=receta)
+                calculadas += 1
+            fila_res.append(res)
+            avance((i * len(defensores) + j + 1) / total, f"{i * len(defensores) + j + 1}/{total} celdas")
+        celdas.append(fila_res)
+    return {"atacantes": atacantes, "defensores": defensores, "celdas": celdas,
+            "cacheadas": cacheadas, "calculadas": calculadas}
+
+
+def _trabajo_recalcular(params: Dict[str, Any], avance: Callable) -> Dict[str, Any]:
+    """Rehace una entrada de caché invalidada por un cambio en el catálogo."""
+    from services import dependencias
+
+    encolada = dependencias.recalcular(params["ns"], params["clave"], params["receta"])
+    return {"ns": params["ns"], "clave": params["clave"], "encolada": encolada}
+
+
+TIPOS: Dict[str, Callable[[Dict[str, Any], Callable], Any]] = {
+    "combate": _trabajo_combate,
+    "montecarlo": _trabajo_montecarlo,
+    "matriz": _trabajo_matriz,
+    "recalcular": _trabajo_recalcular,
+}
+# Los que se pueden enviar desde la API; "recalcular" es interno
+PUBLICOS = ("combate", "montecarlo", "matriz")
+
+
+# --- Despachador ------------------------------------------------------------------------
+
+class _Despachador(threading.Thread):
+    """Hilo que reclama trabajos pendientes mientras haya procesos libres en el pool."""
+
+    def __init__(self, procesos: int):
+        super().__init__(name="trabajos-despachador", daemon=True)
+        self.procesos = procesos
+        self.libres = threading.Semaphore(procesos)
+        self.despertar = threading.Event()
+        self.pool = self._nuevo_pool()
+
+    def _nuevo_pool(self) -> ProcessPoolExecutor:
+        import multiprocessing
+        # spawn: el backend tiene hilos (bucle de eventos, refresco del catálogo) y un
+        # fork de un proceso con hilos puede heredar locks tomados
+        return ProcessPoolExecutor(max_workers=self.procesos, mp_context=multiprocessing.get_context("spawn"))
+
+    def _fin(self, id_: str, fut) -> None:
+        self.libres.release()
+        exc = fut.exception()
+        if exc is not None:
+            # El proceso murió a mitad (memoria, señal): el trabajo queda en error
+            print(f"[trabajos] {id_} falló en el pool: {exc!r}")
+            _terminar(id_, "error", error=f"{type(exc).__name__}: {exc}")
+        self.despertar.set()
+
+    def run(self):
+        ultimo_mantenimiento = 0.0
+        while True:
+            self.libres.acquire()
+            id_ = None
+            while id_ is None:
+                if time.time() - ultimo_mantenimiento >= MANTENIMIENTO_S:
+                    ultimo_mantenimiento = time.time()
+                    try:
+                        podar()
+                    except sqlite3.Error as e:
+                        print(f"[trabajos] Error podando: {e}")
+                try:
+                    id_ = _reclamar()
+                except sqlite3.Error as e:
+                    print(f"[trabajos] Error reclamando: {e}")
+                if id_ is None:
+                    self.despertar.wait(1.0)
+                    self.despertar.clear()
+            try:
+                fut = self.pool.submit(_ejecutar, id_)
+            except BrokenProcessPool:
+                self.pool = self._nuevo_pool()
+                fut = self.pool.submit(_ejecutar, id_)
+            fut.add_done_callback(lambda f, id_=id_: self._fin(id_, f))
+
+
+_lock = threading.Lock()
+_despachador: Optional[_Despachador] = None
+
+
+def arrancar(procesos: Optional[int] = None) -> bool:
+    """
+    Arranca el despachador de este proceso (idempotente). Con AOS_TRABAJOS_PROCESOS=0
+    el proceso solo encola y consulta: ejecutan los trabajos otros workers.
+    """
+    global _despachador
+    procesos = PROCESOS if procesos is None else procesos
+    if procesos <= 0:
+        return False
+    with _lock:
+        if _despachador is None:
+            _despachador = _Despachador(procesos)
+            _despachador.start()
+    return True
+
+
+def esperar(id_: str, timeout_s: float = 60.0, intervalo_s: float = 0.2) -> Optional[Dict[str, Any]]:
+    """Espera (bloqueando) a que el trabajo termine o pase `timeout_s`; devuelve su estado."""
+    limite = time.time() + timeout_s
+    while True:
+        e = estado(id_)
+        if e is None or e["estado"] in TERMINADOS or time.time() >= limite:
+            return e
+        time.sleep(intervalo_s)
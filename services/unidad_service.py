@@ -1,25 +1,61 @@
 import os
-from supabase import create_client
+import threading
+import time
 from dotenv import load_dotenv
 from typing import Optional, Dict, List
+from services.perfilado import perfilado
+from services.resiliencia import CacheSWR, CircuitBreaker, con_timeout
 
 # Cargar variables de entorno desde .env
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY", os.getenv("SUPABASE_KEY", ""))
-sb = create_client(SUPABASE_URL, SUPABASE_KEY)
+TIMEOUT_S = float(os.getenv("AOS_DB_TIMEOUT_S", "3"))
+_sb = None
 
-def obtener_unidad_por_id(unit_id: str) -> dict:
-    res = sb.table("units").select("*").eq("id", unit_id).single().execute()
-    return res.data if res and res.data else {}
+# Todas las consultas pasan por el mismo breaker: si Supabase falla, fallan juntas
+_breaker = CircuitBreaker("supabase", umbral=5, reset_s=30.0)
+_cache_unidades = CacheSWR("unidades", fresco_s=300.0, max_s=6 * 3600.0)
+_cache_armas = CacheSWR("armas", fresco_s=300.0, max_s=6 * 3600.0)
+_cache_ataques = CacheSWR("ataques_totales", fresco_s=300.0, max_s=6 * 3600.0)
 
-def obtener_armas_de_unidad(unit_id: str) -> List[Dict]:
-    res = sb.table("unit_weapons").select("*").eq("unit_id", unit_id).execute()
+# Cambios del catálogo avisados por otro proceso (ver services/dependencias.py): se miran
+# en el almacén compartido como mucho cada COMPROBAR_CAMBIOS_S segundos
+COMPROBAR_CAMBIOS_S = 1.0
+_ultimo_cambio = time.time()
+_proxima_comprobacion = 0.0
+_lock_cambios = threading.Lock()
+
+
+def _client():
+    """
+    Cliente de Supabase creado en el primer uso, no al importar el módulo. El timeout
+    de HTTP es el mismo que el de `con_timeout`: una consulta abandonada corta también
+    su socket y libera el hilo del pool en vez de ocuparlo hasta que la conexión muera.
+    """
+    global _sb
+    if _sb is None:
+        from supabase import ClientOptions, create_client
+        _sb = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(postgrest_client_timeout=TIMEOUT_S))
+    return _sb
+
+
+def _ejecutar(consulta):
+    """Ejecuta una consulta con timeout y a través del circuit breaker."""
+    return _breaker.llamar(lambda: con_timeout(consulta.execute, TIMEOUT_S))
+
+
+def _consultar_unidad(unit_id: str) -> dict:
+    res = _ejecutar(_client().table("units").select("*").eq("id", unit_id).limit(1))
+    return res.data[0] if res and res.data else {}
+
+def _consultar_armas(unit_id: str) -> List[Dict]:
+    res = _ejecutar(_client().table("unit_weapons").select("*").eq("unit_id", unit_id))
     return res.data if res and res.data else []
 
-def obtener_ataques_totales(unit_id: str) -> int:
-    res = sb.table("unit_weapons").select("attacks_formula").eq("unit_id", unit_id).execute()
+def _consultar_ataques_totales(unit_id: str) -> int:
+    res = _ejecutar(_client().table("unit_weapons").select("attacks_formula").eq("unit_id", unit_id))
     armas = res.data if res and res.data else []
     total = 0
     for arma in armas:
@@ -29,14 +65,90 @@ def obtener_ataques_totales(unit_id: str) -> int:
             pass  # Si es "1d3" o similar, ignóralo o implementa un parser si lo necesitas
     return total
 
+def _aplicar_cambios_catalogo() -> None:
+    """Vacía de las cachés de este proceso las unidades que otro proceso ha marcado como cambiadas."""
+    global _ultimo_cambio, _proxima_comprobacion
+    ahora = time.monotonic()
+    if ahora < _proxima_comprobacion or not _lock_cambios.acquire(blocking=False):
+        return
+    try:
+        _proxima_comprobacion = ahora + COMPROBAR_CAMBIOS_S
+        from services import almacen_compartido
+        cambios = almacen_compartido.cambios_desde(_ultimo_cambio)
+        if cambios:
+            invalidar_unidades([uid for uid, _ in cambios])
+            _ultimo_cambio = max(t for _, t in cambios)
+    finally:
+        _lock_cambios.release()
+
+# Las funciones públicas sirven desde caché (stale-while-revalidate): no modificar lo devuelto
+@perfilado("obtener_unidad_por_id")
+def obtener_unidad_por_id(unit_id: str) -> dict:
+    _aplicar_cambios_catalogo()
+    return _cache_unidades.get(unit_id, lambda: _consultar_unidad(unit_id))
+
+@perfilado("obtener_armas_de_unidad")
+def obtener_armas_de_unidad(unit_id: str) -> List[Dict]:
+    _aplicar_cambios_catalogo()
+    return _cache_armas.get(unit_id, lambda: _consultar_armas(unit_id))
+
+def obtener_ataques_totales(unit_id: str) -> int:
+    _aplicar_cambios_catalogo()
+    return _cache_ataques.get(unit_id, lambda: _consultar_ataques_totales(unit_id))
+
+def invalidar_unidades(unit_ids: List[str]) -> None:
+    """Descarta de las cachés los datos de unidades editadas en el catálogo."""
+    for uid in unit_ids:
+        for cache in (_cache_unidades, _cache_armas, _cache_ataques):
+            cache.invalidar(uid)
+
 def get_factions() -> List[tuple[str, str]]:
-    res = sb.table("factions").select("id,name").order("name").execute()
+    res = _ejecutar(_client().table("factions").select("id,name").order("name"))
     rows = res.data or []
     return [(r["id"], r["name"]) for r in rows]
 
 def get_units_by_faction(faction_id: str) -> List[tuple[str, str]]:
     if not faction_id:
         return []
-    res = sb.table("units").select("id,name").eq("faction_id", faction_id).order("name").execute()
+    res = _ejecutar(_client().table("units").select("id,name").eq("faction_id", faction_id).order("name"))
     rows = res.data or []
     return [(r["id"], r["name"]) for r in rows]
+
+@perfilado("get_catalog_index")
+def get_catalog_index() -> tuple[List[tuple[str, str]], List[tuple[str, str, str]], List[tuple[str, str]]]:
+    """
+    Carga en una sola consulta las facciones y un índice ligero de sus unidades y
+    de los nombres de sus armas (para el buscador).
+
+    Returns:
+        ([(faction_id, name)], [(unit_id, name, faction_id)], [(unit_id, weapon_name)])
+    """
+    res = _ejecutar(_client().table("factions").select("id,name,units(id,name,faction_id,unit_weapons(name))").order("name"))
+    rows = res.data or []
+    factions = [(r["id"], r["name"]) for r in rows]
+    units = [(u["id"], u["name"], u.get("faction_id") or r["id"]) for r in rows for u in (r.get("units") or [])]
+    weapons = [(u["id"], w["name"]) for r in rows for u in (r.get("units") or [])
+               for w in (u.get("unit_weapons") or []) if w.get("name")]
+    return factions, units, weapons
+
+@perfilado("obtener_unidades_por_ids")
+def obtener_unidades_por_ids(unit_ids: List[str], lote: int = 200) -> Dict[str, dict]:
+    """Resuelve muchas unidades con pocas consultas: {unit_id: unidad}."""
+    ids = list(dict.fromkeys(i for i in unit_ids if i))
+    unidades = {}
+    for i in range(0, len(ids), lote):
+        res = _ejecutar(_client().table("units").select("*").in_("id", ids[i:i + lote]))
+        for r in res.data or []:
+            unidades[r["id"]] = r
+    return unidades
+
+@perfilado("obtener_armas_de_unidades")
+def obtener_armas_de_unidades(unit_ids: List[str], lote: int = 200) -> Dict[str, List[Dict]]:
+    """Armas de muchas unidades con pocas consultas: {unit_id: [arma, ...]}."""
+    ids = list(dict.fromkeys(i for i in unit_ids if i))
+    armas: Dict[str, List[Dict]] = {i: [] for i in ids}
+    for i in range(0, len(ids), lote):
+        res = _ejecutar(_client().table("unit_weapons").select("*").in_("unit_id", ids[i:i + lote]))
+        for r in res.data or []:
+            armas.setdefault(r["unit_id"], []).append(r)
+    return armas
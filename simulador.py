@@ -3,11 +3,12 @@ Simulador de combate para Age of Sigmar.
 Versión limpia y consistente: un único conjunto de funciones.
 """
 
-from typing import Dict, List, Tuple, Any, Union
+from typing import Dict, List, Tuple, Any, Union, Optional
 import re
 from services.unidad_service import obtener_unidad_por_id, obtener_armas_de_unidad
-from combar_logic import combate_media
-from utils import redondear
+from combar_logic import combate_media, rejilla_defensor
+from modificadores import Pipeline, pipeline_de
+from utils import redondear, parsear_formula
 
 _dice_term = re.compile(r"\s*([+-]?)\s*(?:(\d*)[dD](\d+)|(\d+))\s*")
 
@@ -44,36 +45,77 @@ def dice_average(expr: Union[str, int, float, None]) -> float:
     return total
 
 
-def construir_perfil_ataque(unidad: Dict[str, Any], arma: Dict[str, Any], carga: bool = False) -> Dict[str, Any]:
-    rend_total = arma.get("rend", 0) or 0
-    if carga and unidad.get("rend_on_charge"):
-        try:
-            rend_total += int(unidad["rend_on_charge"])
-        except (ValueError, TypeError):
-            pass
+def armas_de(unidad: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Armas de la unidad: las ya resueltas en unidad['armas'] o, si no hay, las de la base de datos."""
+    armas = unidad.get("armas")
+    if armas is not None:
+        return armas
+    return obtener_armas_de_unidad(unidad.get("id", ""))
+
+
+def _terminos(valor_fijo: Any, formula: Any, media: float) -> List[Tuple[int, int, int]]:
+    try:
+        return parsear_formula(valor_fijo if valor_fijo is not None else formula)
+    except ValueError:
+        # Fórmula que el parser no entiende: se usa su media redondeada
+        return parsear_formula(int(round(media)))
+
+
+def construir_perfil_ataque(unidad: Dict[str, Any], arma: Dict[str, Any], carga: bool = False,
+                            pipeline: Optional[Pipeline] = None) -> Dict[str, Any]:
+    """
+    Perfil de ataque de un arma con los modificadores de la unidad ya aplicados
+    (habilidades y bonos de carga, ver `modificadores`). `pipeline` permite pasar el
+    ya compilado para no resolverlo en cada llamada.
+    """
     attacks = arma.get("attacks")
     if attacks is None:
         attacks = dice_average(arma.get("attacks_formula"))
     damage = arma.get("damage")
     if damage is None:
         damage = dice_average(arma.get("damage_formula"))
-    return {
+    perfil = {
         "base_size": int(unidad.get("base_size", 1)),
         "reinforced": bool(unidad.get("reinforced", False)),
         "points": int(unidad.get("points", 0)),
         "attacks": float(attacks),
+        "attacks_terms": _terminos(arma.get("attacks"), arma.get("attacks_formula"), float(attacks)),
         "to_hit": int(arma.get("to_hit", 7)),
         "to_wound": int(arma.get("to_wound", 7)),
-        "rend": int(rend_total),
+        "rend": -abs(int(arma.get("rend", 0) or 0)),
         "damage": float(damage),
+        "damage_terms": _terminos(arma.get("damage"), arma.get("damage_formula"), float(damage)),
         "crit_effect": arma.get("crit_effect", unidad.get("crit_effect", "none")),
         "crit_value": arma.get("crit_value", unidad.get("crit_value")),
     }
+    if pipeline is None:
+        pipeline = pipeline_de(unidad)
+    return pipeline.aplicar(perfil, carga=carga)
 
 
-def combate_media_multiarmas(unidad_atac: Dict[str, Any], unidad_def: Dict[str, Any], carga: bool = False) -> Tuple[float, List[Tuple[str, Dict[str, Any]]], Dict[str, Any], Dict[str, Any]]:
-    armas = obtener_armas_de_unidad(unidad_atac.get("id", ""))
-    if not armas:
+def resolver_armas(unidad_atac: Dict[str, Any], unidad_def: Dict[str, Any], carga: bool = False,
+                   pipeline: Optional[Pipeline] = None) -> List[Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]]:
+    """
+    (arma, perfil, medias contra el defensor) de cada arma del atacante. No depende de
+    las miniaturas vivas, así que puede reutilizarse en todas las rondas.
+    """
+    if pipeline is None:
+        pipeline = pipeline_de(unidad_atac)
+    resueltas = []
+    for arma in armas_de(unidad_atac):
+        perfil = construir_perfil_ataque(unidad_atac, arma, carga=carga, pipeline=pipeline)
+        resueltas.append((arma, perfil, combate_media(perfil, unidad_def)))
+    return resueltas
+
+
+def combate_media_multiarmas(unidad_atac: Dict[str, Any], unidad_def: Dict[str, Any], carga: bool = False,
+                             pipeline: Optional[Pipeline] = None,
+                             resueltas: Optional[List[Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]]] = None,
+                             ) -> Tuple[float, List[Tuple[str, Dict[str, Any]]], Dict[str, Any], Dict[str, Any]]:
+    """`resueltas` permite pasar el resultado de `resolver_armas` ya calculado."""
+    if resueltas is None:
+        resueltas = resolver_armas(unidad_atac, unidad_def, carga=carga, pipeline=pipeline)
+    if not resueltas:
         return 0.0, [], {}, {}
 
     if unidad_atac.get("current_models") is not None:
@@ -81,20 +123,15 @@ def combate_media_multiarmas(unidad_atac: Dict[str, Any], unidad_def: Dict[str,
     else:
         models_atac = int(unidad_atac.get("base_size", 1)) * (2 if bool(unidad_atac.get("reinforced", False)) else 1)
 
-    ataques_pm_total = 0.0
-    perfiles_armas = []
-    for arma in armas:
-        perfil = construir_perfil_ataque(unidad_atac, arma, carga=carga)
-        perfiles_armas.append((arma, perfil))
-        ataques_pm_total += float(perfil.get("attacks", 0.0))
+    ataques_pm_total = sum(float(perfil.get("attacks", 0.0)) for _, perfil, _ in resueltas)
 
     champion_flag = bool(unidad_atac.get("champion", False))
     ataques_totales = ataques_pm_total * models_atac + (1 if champion_flag else 0)
 
     total_heridas = 0.0
     detalle = []
-    for idx, (arma, perfil) in enumerate(perfiles_armas):
-        out = combate_media(perfil, unidad_def, carga=carga)
+    for idx, (arma, perfil, medias) in enumerate(resueltas):
+        out = dict(medias)
         out['attacks'] = perfil['attacks']
 
         total_attacks_arma = perfil['attacks'] * models_atac
@@ -154,9 +191,20 @@ def combate_media_multiarmas(unidad_atac: Dict[str, Any], unidad_def: Dict[str,
     return total_heridas, detalle, resumen_atac, resumen_def
 
 
-def mostrar_detalle_armas_en_combate(unidad: Dict[str, Any], detalle: List[Tuple[str, Dict[str, Any]]], miniaturas_vivas: int) -> None:
+def rejilla_que_pasaria(unidad_atac: Dict[str, Any], carga: bool = False, mods_rend=(0, 1)) -> Dict[str, Any]:
+    """
+    Todas las armas de una unidad contra la rejilla completa de salvación x ward x
+    modificador de rend (ver `combar_logic.rejilla_defensor`) en una sola pasada.
+    """
+    pipeline = pipeline_de(unidad_atac)
+    perfiles = [construir_perfil_ataque(unidad_atac, arma, carga=carga, pipeline=pipeline)
+                for arma in armas_de(unidad_atac)]
+    return rejilla_defensor(perfiles, mods_rend=mods_rend)
+
+
+def mostrar_detalle_armas_en_combate(unidad: Dict[str, Any], detalle: List[Tuple[str, Dict[str, Any]]], miniaturas_vivas: int, salida=None) -> None:
     from utils import redondear as _r
-    armas = obtener_armas_de_unidad(unidad.get('id', ''))
+    armas = armas_de(unidad)
     champion_flag = bool(unidad.get('champion', False))
     
     for idx, (nombre_arma, out) in enumerate(detalle):
@@ -198,11 +246,23 @@ def mostrar_detalle_armas_en_combate(unidad: Dict[str, Any], detalle: List[Tuple
         if heridas_mortales > 0:
             desglose = f" (normal={_r(heridas_normales)} + mort={_r(heridas_mortales)})"
 
-        print(f"    - {nombre_arma}: ataques={_r(ataques_arma)} | criticos={num_criticos}{crit_info} | heridas={_r(out['total_heridas'])}{desglose} | salvadas={_r(out.get('heridas_salvadas', 0))}")
+        print(f"    - {nombre_arma}: ataques={_r(ataques_arma)} | criticos={num_criticos}{crit_info} | heridas={_r(out['total_heridas'])}{desglose} | salvadas={_r(out.get('heridas_salvadas', 0))}", file=salida)
 
 
-def simular_combate_completo(atacante_u: Dict[str, Any], defensor_u: Dict[str, Any], max_rondas: int = 10) -> Dict[str, Any]:
-    print("\n=== SIMULACIÓN DE COMBATE COMPLETO ===")
+def iterar_combate(atacante_u: Dict[str, Any], defensor_u: Dict[str, Any], max_rondas: int = 10, out=None,
+                   carga: bool = True, media=None, detalle_armas: bool = True):
+    """
+    Generador del combate completo: produce la fila compacta de cada ronda en cuanto
+    se resuelve y devuelve (vía StopIteration.value) el resultado final.
+
+    El texto detallado se escribe en `out` (por defecto stdout). `carga` indica si el
+    atacante cargó (sus bonos de carga se aplican en la primera ronda) y `media`
+    sustituye a `combate_media_multiarmas`, p. ej. por una versión memorizada. Con
+    `detalle_armas=False` se omite el desglose por arma del texto.
+    """
+    if media is None:
+        media = combate_media_multiarmas
+    print("\n=== SIMULACIÓN DE COMBATE COMPLETO ===", file=out)
     ronda = 1
     atacante_vivo = int(atacante_u.get('base_size', 1)) * (2 if bool(atacante_u.get('reinforced', False)) else 1)
     defensor_vivo = int(defensor_u.get('base_size', 1)) * (2 if bool(defensor_u.get('reinforced', False)) else 1)
@@ -219,11 +279,18 @@ def simular_combate_completo(atacante_u: Dict[str, Any], defensor_u: Dict[str, A
     wounds_per_model_atacante = int(atacante_u.get('wounds', 1))
     wounds_per_model_defensor = int(defensor_u.get('wounds', 1))
 
+    # Modificadores de ambas unidades compilados una vez para todo el combate
+    pipeline_atac = pipeline_de(atacante_u)
+    pipeline_def = pipeline_de(defensor_u)
+
+    # Filas compactas por ronda: [ronda, minis_atac, heridas_atac, bajas_def, minis_def, heridas_def, bajas_atac]
+    rondas_detalle: List[List[int]] = []
+
     while atacante_vivo > 0 and defensor_vivo > 0 and ronda <= max_rondas:
-        print(f"\n--- Ronda {ronda} ---")
+        print(f"\n--- Ronda {ronda} ---", file=out)
         atacante_u['current_models'] = atacante_vivo
         defensor_u['current_models'] = defensor_vivo
-        total_general, detalle, res_atac, res_def = combate_media_multiarmas(atacante_u, defensor_u, carga=(ronda==1))
+        total_general, detalle, res_atac, res_def = media(atacante_u, defensor_u, carga=(carga and ronda == 1), pipeline=pipeline_atac)
         
         # Acumular heridas al defensor
         heridas_acumuladas_defensor += total_general
@@ -234,18 +301,22 @@ def simular_combate_completo(atacante_u: Dict[str, Any], defensor_u: Dict[str, A
         # Mostrar ataques totales calculados de forma consistente con combate_media_multiarmas
         ataques_pm = float(res_atac.get('attacks_per_model', 0.0))
         ataques_totales_correctos = ataques_pm * atacante_vivo + (1 if bool(atacante_u.get('champion', False)) else 0)
-        print(f"Atacante: {res_atac['name']} | Minis: {atacante_vivo} | Ataques totales: {redondear(ataques_totales_correctos)}")
-        print(f"  Media de heridas causadas: {redondear(total_general)}")
+        print(f"Atacante: {res_atac['name']} | Minis: {atacante_vivo} | Ataques totales: {redondear(ataques_totales_correctos)}", file=out)
+        print(f"  Media de heridas causadas: {redondear(total_general)}", file=out)
 
-        mostrar_detalle_armas_en_combate(atacante_u, detalle, atacante_vivo)
+        if detalle_armas:
+            mostrar_detalle_armas_en_combate(atacante_u, detalle, atacante_vivo, salida=out)
 
-        print(f"Bajas defensor: {bajas_defensor} | Minis defensor restantes: {defensor_vivo}")
+        print(f"Bajas defensor: {bajas_defensor} | Minis defensor restantes: {defensor_vivo}", file=out)
+        fila = [ronda, atacante_vivo, redondear(total_general), bajas_defensor, defensor_vivo, 0, 0]
+        rondas_detalle.append(fila)
         if defensor_vivo == 0:
-            print(f"El defensor ha sido eliminado. Gana {atacante_nombre}.")
+            print(f"El defensor ha sido eliminado. Gana {atacante_nombre}.", file=out)
+            yield fila
             break
 
         defensor_u['current_models'] = defensor_vivo
-        total_def, detalle_def, res_def_resp, res_atac_resp = combate_media_multiarmas(defensor_u, atacante_u, carga=False)
+        total_def, detalle_def, res_def_resp, res_atac_resp = media(defensor_u, atacante_u, carga=False, pipeline=pipeline_def)
         
         # Acumular heridas al atacante
         heridas_acumuladas_atacante += total_def
@@ -254,14 +325,18 @@ def simular_combate_completo(atacante_u: Dict[str, Any], defensor_u: Dict[str, A
         atacante_vivo = max(atacante_vivo - bajas_atacante, 0)
 
         ataques_totales_defensor = float(res_def_resp.get('attacks_per_model', 0.0)) * defensor_vivo
-        print(f"Defensor: {res_def['name']} | Minis: {defensor_vivo} | Ataques totales: {redondear(ataques_totales_defensor)}")
-        print(f"  Media de heridas causadas: {redondear(total_def)}")
+        print(f"Defensor: {res_def['name']} | Minis: {defensor_vivo} | Ataques totales: {redondear(ataques_totales_defensor)}", file=out)
+        print(f"  Media de heridas causadas: {redondear(total_def)}", file=out)
 
-        mostrar_detalle_armas_en_combate(defensor_u, detalle_def, defensor_vivo)
+        if detalle_armas:
+            mostrar_detalle_armas_en_combate(defensor_u, detalle_def, defensor_vivo, salida=out)
 
-        print(f"Bajas atacante: {bajas_atacante} | Minis atacante restantes: {atacante_vivo}")
+        print(f"Bajas atacante: {bajas_atacante} | Minis atacante restantes: {atacante_vivo}", file=out)
+        fila[5] = redondear(total_def)
+        fila[6] = bajas_atacante
+        yield fila
         if atacante_vivo == 0:
-            print(f"El atacante ha sido eliminado. Gana {defensor_nombre}.")
+            print(f"El atacante ha sido eliminado. Gana {defensor_nombre}.", file=out)
             break
 
         ronda += 1
@@ -275,27 +350,114 @@ def simular_combate_completo(atacante_u: Dict[str, Any], defensor_u: Dict[str, A
     else:
         ganador = "Empate"
 
-    print(f"\n¡Victoria para: {ganador}!")
+    print(f"\n¡Victoria para: {ganador}!", file=out)
     return {
         'ganador': ganador,
         'rondas': ronda,
         'atacante_restante': atacante_vivo,
         'defensor_restante': defensor_vivo,
+        'atacante': atacante_nombre,
+        'defensor': defensor_nombre,
+        'rondas_detalle': rondas_detalle,
     }
 
 
-def simular_combate_completo_str(atacante_u: Dict[str, Any], defensor_u: Dict[str, Any], max_rondas: int = 10) -> str:
-    import io, sys
+def simular_combate_completo(atacante_u: Dict[str, Any], defensor_u: Dict[str, Any], max_rondas: int = 10, out=None) -> Dict[str, Any]:
+    gen = iterar_combate(atacante_u, defensor_u, max_rondas=max_rondas, out=out)
+    while True:
+        try:
+            next(gen)
+        except StopIteration as fin:
+            return fin.value
+
+
+def resumen_combate(res: Dict[str, Any]) -> Dict[str, Any]:
+    """Resumen de un combate tal como lo muestra la interfaz (y se guarda en caché)."""
+    return {
+        "ganador": str(res.get("ganador", "")),
+        "rondas": int(res.get("rondas", 0)),
+        "atacante": str(res.get("atacante", "")),
+        "defensor": str(res.get("defensor", "")),
+        "atacante_restante": int(res.get("atacante_restante", 0)),
+        "defensor_restante": int(res.get("defensor_restante", 0)),
+    }
+
+
+class _MediasCompartidas:
+    """
+    `combate_media_multiarmas` para varios combates entre las mismas dos unidades, con
+    los perfiles y las medias de cada arma (`resolver_armas`) calculados una sola vez
+    por lado y por carga: el resto de cada ronda es solo escalar por miniaturas vivas.
+    Cada unidad se reconoce por su lista de armas ya resuelta, que comparten todas las
+    copias que hace `iterar_combate`.
+    """
+
+    def __init__(self, *unidades: Dict[str, Any]):
+        self.pipelines = {id(u["armas"]): pipeline_de(u) for u in unidades}
+        self.cache: Dict[Tuple[int, bool], list] = {}
+        self.llamadas = 0
+
+    def __call__(self, unidad_atac: Dict[str, Any], unidad_def: Dict[str, Any], carga: bool = False,
+                 pipeline: Optional[Pipeline] = None):
+        self.llamadas += 1
+        lado = id(unidad_atac["armas"])
+        pipeline = self.pipelines[lado]
+        # Sin modificadores de carga, cargar o no da lo mismo
+        clave = (lado, bool(carga and pipeline.carga))
+        if clave not in self.cache:
+            self.cache[clave] = resolver_armas(unidad_atac, unidad_def, carga=clave[1], pipeline=pipeline)
+        return combate_media_multiarmas(unidad_atac, unidad_def, pipeline=pipeline, resueltas=self.cache[clave])
+
+
+def comparar_iniciativa(unidad1: Dict[str, Any], unidad2: Dict[str, Any], max_rondas: int = 10) -> Dict[str, Any]:
+    """
+    Los cuatro escenarios de iniciativa en una sola llamada: golpea primero la unidad 1
+    o la 2, habiendo cargado o no. Solo quien golpea primero aprovecha la carga, igual
+    que en `iterar_combate`. Las unidades llegan preparadas (con su bono de carga, que
+    solo actúa si cargan); armas, perfiles y medias por arma se resuelven una vez por
+    lado y se comparten entre escenarios y rondas, así que cuesta poco más que una
+    simulación.
+    """
+    import io
+
+    u1 = dict(unidad1, armas=list(armas_de(unidad1)))
+    u2 = dict(unidad2, armas=list(armas_de(unidad2)))
+    medias = _MediasCompartidas(u1, u2)
+    escenarios = []
+    for primero, (atac, defe) in (("1", (u1, u2)), ("2", (u2, u1))):
+        for carga in (True, False):
+            gen = iterar_combate(atac, defe, max_rondas=max_rondas, out=io.StringIO(), carga=carga,
+                                 media=medias, detalle_armas=False)
+            while True:
+                try:
+                    next(gen)
+                except StopIteration as fin:
+                    res = resumen_combate(fin.value)
+                    break
+            propios, rivales = res["atacante_restante"], res["defensor_restante"]
+            escenarios.append(dict(
+                res, primero=primero, carga=carga,
+                restantes1=propios if primero == "1" else rivales,
+                restantes2=rivales if primero == "1" else propios,
+            ))
+    return {"escenarios": escenarios, "perfiles_resueltos": len(medias.cache), "rondas_resueltas": medias.llamadas}
+
+
+def simular_combate_con_detalle(atacante_u: Dict[str, Any], defensor_u: Dict[str, Any], max_rondas: int = 10) -> Tuple[Dict[str, Any], str]:
+    """Ejecuta el combate y devuelve (resultado estructurado, salida de texto completa)."""
+    import io
+    # Se escribe en un buffer propio en lugar de redirigir sys.stdout, que es global
+    # al proceso y mezclaría la salida de sesiones concurrentes
     buf = io.StringIO()
-    old_stdout = sys.stdout
-    try:
-        sys.stdout = buf
-        sim_result = simular_combate_completo(atacante_u, defensor_u, max_rondas=max_rondas)
-        print("\nResultado resumido:")
-        print(sim_result)
-    finally:
-        sys.stdout = old_stdout
-    return buf.getvalue()
+    sim_result = simular_combate_completo(atacante_u, defensor_u, max_rondas=max_rondas, out=buf)
+    resumen = {k: v for k, v in sim_result.items() if k != 'rondas_detalle'}
+    print("\nResultado resumido:", file=buf)
+    print(resumen, file=buf)
+    return sim_result, buf.getvalue()
+
+
+def simular_combate_completo_str(atacante_u: Dict[str, Any], defensor_u: Dict[str, Any], max_rondas: int = 10) -> str:
+    return simular_combate_con_detalle(atacante_u, defensor_u, max_rondas=max_rondas)[1]
 
 
 def mostrar_analisis_inicial(atacante_id: str, defensor_id: str, carga: bool = True) -> None:
@@ -312,21 +474,6 @@ def mostrar_analisis_inicial(atacante_id: str, defensor_id: str, carga: bool = T
     # Simular combate completo
     simular_combate_completo(atacante_u, defensor_u)
 
-# IDs de unidades de ejemplo
-# kroxigor = "500c03e5-085b-4c5f-acbf-9d78a8d40591"
-# kurnoths = "7ff18894-a6e9-4203-94fa-fbea1f4ad227"
-# lanceros_en_agradon = "9da7561a-6b28-4eef-a6ee-10b93504d9a5"
-# guerreros saurios = 'a7ad4e3c-87b7-4182-9e8d-ce8dd0b1a03e'
-# reyesplaga = 'cefbb712-fea6-4a20-8549-e88075c0f129'
-if __name__ == "__main__":
-    print("=== SIMULADOR DE COMBATE AGE OF SIGMAR ===")
-    atacante_id = '47b962af-2618-40c1-98ad-ec9f803dd7ba'  
-    defensor_id = '826230c9-009c-4c10-9d3d-7aa97c9b5739'  
-
-    # Ejecutar la simulación desde la función principal
-    mostrar_analisis_inicial(atacante_id, defensor_id, carga=True)
-
-
 def mostrar_resultados_simulacion(total_general: float, detalle: List[Tuple[str, Dict[str, Any]]], 
                            res_atac: Dict[str, Any], res_def: Dict[str, Any]) -> None:
     """
@@ -378,20 +525,14 @@ def mostrar_resultados_simulacion(total_general: float, detalle: List[Tuple[str,
     return models_def_restantes
 
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+# IDs de unidades de ejemplo
+# kroxigor = "500c03e5-085b-4c5f-acbf-9d78a8d40591"
+# kurnoths = "7ff18894-a6e9-4203-94fa-fbea1f4ad227"
+# lanceros_en_agradon = "9da7561a-6b28-4eef-a6ee-10b93504d9a5"
+# guerreros saurios = 'a7ad4e3c-87b7-4182-9e8d-ce8dd0b1a03e'
+# reyesplaga = 'cefbb712-fea6-4a20-8549-e88075c0f129'
+if __name__ == "__main__":
+    # python simulador.py --atacante ID --defensor ID
+    # python simulador.py --entrada enfrentamientos.jsonl --salida resultados.jsonl --procesos 8
+    from lotes import main
+    main()
@@ -0,0 +1,21 @@
+import os
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def almacen(tmp_path, monkeypatch):
+    """Almacén compartido en un directorio temporal, con conexiones nuevas."""
+    from services import almacen_compartido
+
+    ruta = str(tmp_path / "compartido.db")
+    monkeypatch.setenv("AOS_SHARED_DB", ruta)
+    monkeypatch.setattr(almacen_compartido, "RUTA", ruta)
+    monkeypatch.setattr(almacen_compartido, "PENDIENTES", ruta + ".pendientes")
+    monkeypatch.setattr(almacen_compartido, "_local", threading.local())
+    monkeypatch.setattr(almacen_compartido, "_contadores", dict.fromkeys(almacen_compartido._contadores, 0))
+    # Crea la base para que los lectores la encuentren
+    almacen_compartido._conexion_escritura()
+    assert os.path.exists(ruta)
+    return almacen_compartido
@@ -0,0 +1,109 @@
+"""Combinar dos mitades da lo mismo que una sola pasada, e intervalos de confianza."""
+
+import json
+import math
+import random
+
+import pytest
+
+from agregados import AgregadoCombate, Histograma, Momentos, SketchCuantiles
+
+_RNG = random.Random(3)
+DATOS = [_RNG.expovariate(0.2) if i % 7 else 0.0 for i in range(2001)]
+
+
+def _llenar(agregado, datos):
+    for x in datos:
+        agregado.add(x)
+    return agregado
+
+
+def test_momentos_merge_igual_a_una_pasada():
+    mitad = len(DATOS) // 2
+    todo = _llenar(Momentos(), DATOS)
+    combinado = _llenar(Momentos(), DATOS[:mitad]).merge(_llenar(Momentos(), DATOS[mitad:]))
+    assert combinado.n == todo.n
+    assert abs(combinado.media - todo.media) < 1e-9
+    assert abs(combinado.varianza - todo.varianza) < 1e-9
+    assert (combinado.minimo, combinado.maximo) == (todo.minimo, todo.maximo)
+    assert _llenar(Momentos(), []).merge(todo).media == todo.media
+
+
+def test_sketch_merge_igual_a_una_pasada():
+    mitad = len(DATOS) // 3
+    todo = _llenar(SketchCuantiles(), DATOS)
+    combinado = _llenar(SketchCuantiles(), DATOS[:mitad]).merge(_llenar(SketchCuantiles(), DATOS[mitad:]))
+    assert (combinado.n, combinado.ceros, combinado.buckets) == (todo.n, todo.ceros, todo.buckets)
+    for q in (0.05, 0.5, 0.95):
+        assert combinado.cuantil(q) == todo.cuantil(q)
+
+
+def test_histograma_merge_igual_a_una_pasada():
+    datos = [x - 5 for x in DATOS]  # con valores por debajo y por encima del rango
+    mitad = len(datos) // 2
+    todo = _llenar(Histograma(0, 20, 40), datos)
+    combinado = _llenar(Histograma(0, 20, 40), datos[:mitad]).merge(_llenar(Histograma(0, 20, 40), datos[mitad:]))
+    assert combinado.a_dict() == todo.a_dict()
+    assert combinado.bajo and combinado.alto
+    for q in (0.05, 0.5, 0.95):
+        assert combinado.cuantil(q) == todo.cuantil(q)
+    with pytest.raises(ValueError):
+        Histograma(0, 20, 40).merge(Histograma(0, 20, 20))
+
+
+def _combates(n, semilla):
+    rng = random.Random(semilla)
+    return [(rng.choice((-1, 0, 1, 1)), rng.randint(0, 10), rng.randint(0, 20), rng.randint(1, 10),
+             rng.uniform(0, 30), rng.uniform(0, 30)) for _ in range(n)]
+
+
+def _aproximado(a, b):
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_aproximado(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_aproximado(x, y) for x, y in zip(a, b))
+    if isinstance(a, float):
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12)
+    return a == b
+
+
+def test_agregado_combate_merge_igual_a_una_pasada():
+    combates = _combates(3000, 11)
+    todo = AgregadoCombate(10, 10, 20)
+    for c in combates:
+        todo.add(*c)
+    # Como montecarlo_por_bloques: bloques de distinto tamaño combinados en cualquier orden
+    bloques = []
+    for inicio, fin in ((0, 1), (1, 1200), (1200, 3000)):
+        parcial = AgregadoCombate(10, 10, 20)
+        for c in combates[inicio:fin]:
+            parcial.add(*c)
+        bloques.append(parcial)
+    combinado = AgregadoCombate(10, 10, 20)
+    for parcial in reversed(bloques):
+        combinado.merge(parcial)
+    assert combinado.n == todo.n == len(combates)
+    assert _aproximado(combinado.resumen(1.96), todo.resumen(1.96))
+
+
+def test_momentos_intervalo():
+    assert Momentos().intervalo(1.96) == (None, None)
+    assert _llenar(Momentos(), [0.7]).intervalo(1.96) == (None, None)
+    m = _llenar(Momentos(), [1.0] * 9 + [0.0])
+    inf, sup = m.intervalo(1.96)
+    assert sup > 1.0
+    assert m.intervalo(1.96, 0.0, 1.0) == (inf, 1.0)
+    assert math.isclose(sum(m.intervalo(1.96)) / 2, m.media)
+
+
+def test_agregado_combate_resumen_sin_infinitos():
+    agregado = AgregadoCombate(10, 10, 20)
+    agregado.add(1, 5, 0, 3)
+    res = agregado.resumen(1.96)
+    assert res["victoria_atacante"]["ic_inf"] is None and res["supervivientes_atacante"]["ic_sup"] is None
+    json.dumps(res, allow_nan=False)
+    for c in _combates(20, 5):
+        agregado.add(1, *c[1:4])
+    victoria = agregado.resumen(1.96)["victoria_atacante"]
+    assert victoria["media"] == 1.0 and victoria["ic_inf"] == victoria["ic_sup"] == 1.0
+    json.dumps(agregado.resumen(1.96), allow_nan=False)
@@ -0,0 +1,48 @@
+"""Las escrituras de resultados pasan por el escritor único sin perderse."""
+
+import fcntl
+import multiprocessing
+import os
+
+N_PROCESOS = 4
+N_ESCRITURAS = 100
+
+
+def _escribir(proceso: int) -> None:
+    from services import almacen_compartido
+
+    for i in range(N_ESCRITURAS):
+        assert almacen_compartido.guardar_resultado(f"{proceso}-{i}", {"i": i})
+    assert not almacen_compartido.es_escritor()
+
+
+def test_colas_de_varios_procesos_llegan_todas(almacen):
+    # Este proceso hace de escritor: los hijos solo encolan
+    fd = os.open(almacen.RUTA + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    try:
+        ctx = multiprocessing.get_context("spawn")
+        procesos = [ctx.Process(target=_escribir, args=(p,)) for p in range(N_PROCESOS)]
+        for p in procesos:
+            p.start()
+        while any(p.is_alive() for p in procesos):
+            almacen.drenar()
+        assert all(p.exitcode == 0 for p in procesos)
+        almacen.drenar()
+    finally:
+        os.close(fd)
+    for p in range(N_PROCESOS):
+        for i in range(N_ESCRITURAS):
+            assert almacen.leer_resultado(f"{p}-{i}") == {"i": i}
+    c = almacen.contadores()
+    assert c["escritas"] == N_PROCESOS * N_ESCRITURAS and c["descartadas"] == 0
+    assert os.listdir(almacen.PENDIENTES) == []
+
+
+def test_huella_vieja_se_cuenta_como_obsoleta(almacen, monkeypatch):
+    monkeypatch.setattr(almacen, "es_escritor", lambda: False)
+    almacen.invalidar_por_huellas({"u1": "nueva"})
+    assert almacen.guardar_resultado("k", {"v": 1}, huellas={"u1": "vieja"})
+    assert almacen.drenar() == 1
+    assert almacen.leer_resultado("k") is None
+    assert almacen.contadores()["obsoletas"] == 1
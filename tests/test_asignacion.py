@@ -0,0 +1,63 @@
+"""El reparto por programación dinámica coincide con probar todos los repartos."""
+
+from itertools import product
+
+import pytest
+
+from asignacion import (MAX_DEFENSORES, _Potencias, _convolucion, _delta, _dist_ataque, _dist_miniatura,
+                        _esperanza_bajas, optimizar_reparto)
+from montecarlo import compilar_armas
+
+ATACANTE = {
+    "id": "A", "name": "Lanceros", "base_size": 3, "wounds": 1, "save": 4, "champion": False,
+    "armas": [
+        {"name": "lanza", "attacks_formula": "2", "to_hit": 3, "to_wound": 4, "rend": 1, "damage_formula": "1"},
+        {"name": "maza", "attacks_formula": "1", "to_hit": 4, "to_wound": 3, "rend": 0, "damage_formula": "2"},
+    ],
+}
+DEFENSORES = [
+    {"id": "B", "name": "Brutos", "base_size": 2, "wounds": 3, "save": 4},
+    {"id": "C", "name": "Arqueros", "base_size": 1, "wounds": 1, "save": 6},
+]
+
+
+def _bajas(reparto_defensor, defensor):
+    """Bajas esperadas de un defensor con `reparto_defensor[w]` miniaturas en el arma w."""
+    minis_def, heridas = int(defensor["base_size"]), int(defensor["wounds"])
+    tope = minis_def * heridas
+    dist = _delta(tope)
+    for arma, m in zip(compilar_armas(ATACANTE, ATACANTE["armas"]), reparto_defensor):
+        pot = _Potencias(_dist_miniatura(arma, _dist_ataque(arma, defensor, tope), tope), tope)
+        dist = _convolucion(dist, pot(m), tope)
+    return _esperanza_bajas(dist, [min(minis_def, d // heridas) for d in range(tope + 1)])
+
+
+def test_reparto_igual_a_fuerza_bruta():
+    minis = ATACANTE["base_size"]
+    mejor = max(
+        _bajas(a, DEFENSORES[0]) + _bajas(tuple(minis - x for x in a), DEFENSORES[1])
+        for a in product(range(minis + 1), repeat=len(ATACANTE["armas"]))
+    )
+    res = optimizar_reparto(ATACANTE, DEFENSORES, presupuesto_s=30.0)
+    assert res["optimo"] and res["bloque_miniaturas"] == 1
+    assert abs(res["bajas_totales"] - mejor) < 1e-3
+    # El caso solo sirve si repartir supera a concentrar en un objetivo
+    assert res["bajas_totales"] > max(t["bajas_esperadas"] for t in res["todo_a_uno"]) + 1e-3
+
+
+def test_presupuesto_cubre_las_tablas():
+    # Tres armas y 40 miniaturas contra dos objetivos: las tablas tardan casi un segundo
+    atacante = dict(ATACANTE, base_size=40, armas=ATACANTE["armas"] + [
+        {"name": "daga", "attacks_formula": "d6", "to_hit": 4, "to_wound": 4, "rend": 0, "damage_formula": "d3"},
+    ])
+    defensores = [dict(DEFENSORES[0], id=str(i), base_size=10, wounds=5) for i in range(2)]
+    res = optimizar_reparto(atacante, defensores, presupuesto_s=0.05)
+    assert not res["optimo"]
+    assert res["segundos"] < 0.4
+    minis = sum(a["miniaturas"] for d in res["asignacion"] for a in d["armas"])
+    assert minis == atacante["base_size"] * len(atacante["armas"])
+
+
+def test_demasiados_defensores():
+    with pytest.raises(ValueError):
+        optimizar_reparto(ATACANTE, DEFENSORES * MAX_DEFENSORES)
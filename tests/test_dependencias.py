@@ -0,0 +1,58 @@
+"""Editar una unidad solo invalida y recalcula las entradas que la usaron."""
+
+from services import dependencias, trabajos
+
+UNIDADES = {
+    uid: {"id": uid, "name": uid, "base_size": 5, "wounds": 1, "save": 4,
+          "armas": [{"id": uid + "-arma", "name": "espada", "attacks_formula": "2", "to_hit": 3,
+                     "to_wound": 4, "rend": 1, "damage_formula": "1"}]}
+    for uid in ("u1", "u2", "u3")
+}
+
+
+def _huella(unidad):
+    return dependencias.huella(unidad, unidad["armas"])
+
+
+def _llenar_matriz(almacen):
+    """Matriz 3x3 de celdas, cada una dependiente de su atacante y su defensor."""
+    for a in UNIDADES:
+        for d in UNIDADES:
+            receta = {"tipo": "celda", "params": {"atacante": a, "defensor": d}}
+            huellas = {a: _huella(UNIDADES[a]), d: _huella(UNIDADES[d])}
+            assert almacen.escribir_con_dependencias("resultados", f"{a}>{d}", {"celda": [a, d]}, huellas, receta)
+
+
+def test_invalidar_solo_la_fila_y_la_columna(almacen):
+    _llenar_matriz(almacen)
+    editada = dict(UNIDADES["u1"], save=3)
+
+    afectadas = almacen.invalidar_por_huellas({"u1": _huella(editada)})
+
+    esperadas = {f"{a}>{d}" for a in UNIDADES for d in UNIDADES if "u1" in (a, d)}
+    assert {clave for _, clave, _ in afectadas} == esperadas
+    for a in UNIDADES:
+        for d in UNIDADES:
+            valor = almacen.leer_resultado(f"{a}>{d}")
+            assert (valor is None) == (f"{a}>{d}" in esperadas)
+    # Las dependencias de lo que sobrevive siguen ahí: otra edición de u2 las encuentra
+    assert {c for _, c, _ in almacen.invalidar_por_huellas({"u2": "otra"})} == {"u2>u2", "u2>u3", "u3>u2"}
+    # Misma huella otra vez: nada que invalidar
+    assert almacen.invalidar_por_huellas({"u1": _huella(editada)}) == []
+
+
+def test_actualizar_encola_solo_las_afectadas(almacen, monkeypatch):
+    _llenar_matriz(almacen)
+    encolados = []
+    monkeypatch.setattr(trabajos, "enviar", lambda tipo, params: encolados.append((tipo, params)) or str(len(encolados)))
+
+    res = dependencias.actualizar({"u3": dict(UNIDADES["u3"], wounds=2)})
+
+    assert res["invalidadas"] == 5 and len(res["recalculos"]) == 5
+    assert all(tipo == "recalcular" for tipo, _ in encolados)
+    assert {p["clave"] for _, p in encolados} == {"u1>u3", "u2>u3", "u3>u1", "u3>u2", "u3>u3"}
+    assert all("u3" in (p["receta"]["params"]["atacante"], p["receta"]["params"]["defensor"]) for _, p in encolados)
+    # Sin cambios reales en los datos no se encola nada
+    encolados.clear()
+    assert dependencias.actualizar({"u1": UNIDADES["u1"]})["invalidadas"] == 0
+    assert encolados == []
@@ -0,0 +1,30 @@
+"""La miniatura sigue a la URL de origen de la unidad."""
+
+import os
+
+from services import imagenes, unidad_service
+
+
+def test_cambiar_img_url_regenera_la_miniatura(tmp_path, monkeypatch):
+    origen = tmp_path / "origen"
+    origen.mkdir()
+    (origen / "a.png").write_bytes(b"imagen a")
+    (origen / "b.png").write_bytes(b"imagen b")
+    monkeypatch.setattr(imagenes, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(imagenes, "ORIGEN_DIR", str(origen))
+    # Sin Pillow se guarda la imagen tal cual; con Pillow estos bytes no son una imagen
+    monkeypatch.setattr(imagenes, "_redimensionar", lambda datos, ancho, url: (datos, "image/png"))
+    unidad = {"id": "u1", "img_url": "https://img.example/a.png"}
+    monkeypatch.setattr(unidad_service, "obtener_unidad_por_id", lambda uid: unidad)
+
+    ruta_a, etag_a, _, v_a = imagenes.miniatura("u1", 480)
+    assert imagenes.miniatura("u1", 480) == (ruta_a, etag_a, "image/png", v_a)
+    assert f"v={v_a}" in imagenes.url_publica("http://api", "u1", unidad["img_url"])
+
+    unidad["img_url"] = "https://img.example/b.png"
+    ruta_b, etag_b, _, v_b = imagenes.miniatura("u1", 480)
+    assert (ruta_b, etag_b, v_b) != (ruta_a, etag_a, v_a)
+    with open(ruta_b, "rb") as f:
+        assert f.read() == b"imagen b"
+    assert not os.path.exists(ruta_a)
+    assert imagenes.url_publica("http://api", "u1", "") == ""
@@ -0,0 +1,44 @@
+"""Mochila de elección múltiple y límites del presupuesto."""
+
+import random
+from itertools import product
+
+import pytest
+
+from listas import MAX_PRESUPUESTO, _mochila, comprobar_presupuesto, optimizar_lista
+
+
+def _exhaustiva(grupos, capacidad):
+    mejor = 0.0
+    for eleccion in product(*(range(-1, len(g)) for g in grupos)):
+        elegidos = [g[k] for g, k in zip(grupos, eleccion) if k >= 0]
+        if sum(c for c, _ in elegidos) <= capacidad:
+            mejor = max(mejor, sum(v for _, v in elegidos))
+    return mejor
+
+
+def test_mochila_igual_a_exhaustiva():
+    rng = random.Random(7)
+    for _ in range(200):
+        grupos = [[(rng.randint(1, 8), rng.uniform(-2, 10))
+                   for _ in range(rng.randint(1, 3))] for _ in range(rng.randint(1, 4))]
+        capacidad = rng.randint(0, 15)
+        total, elegidos = _mochila(grupos, capacidad)
+        assert abs(total - _exhaustiva(grupos, capacidad)) < 1e-9
+        usados = [g[k] for g, k in zip(grupos, elegidos) if k >= 0]
+        assert sum(c for c, _ in usados) <= capacidad
+        assert abs(sum(v for _, v in usados) - total) < 1e-9
+
+
+@pytest.mark.parametrize("puntos", [-1, MAX_PRESUPUESTO + 1, 1000000001, "mil"])
+def test_presupuesto_fuera_de_rango(puntos):
+    with pytest.raises(ValueError):
+        comprobar_presupuesto(puntos)
+    # Antes de calcular nada: sin candidatas ni rivales también se rechaza
+    with pytest.raises(ValueError):
+        optimizar_lista([], [], presupuesto=puntos)
+
+
+def test_presupuesto_en_rango():
+    assert comprobar_presupuesto("2000") == 2000
+    assert comprobar_presupuesto(MAX_PRESUPUESTO) == MAX_PRESUPUESTO
@@ -0,0 +1,22 @@
+"""Opciones de una fila de lotes."""
+
+import pytest
+
+from lotes import preparar
+
+UNIDADES = {
+    "a": {"id": "a", "name": "A", "base_size": 5, "wounds": 1, "save": 4, "armas": []},
+    "d": {"id": "d", "name": "D", "base_size": 5, "wounds": 1, "save": 4, "armas": []},
+}
+
+
+def test_bono_atacante_se_aplica():
+    atacante, defensor = preparar({"atacante": "a", "defensor": "d", "bono_atacante": "Rend -1"}, UNIDADES)
+    assert atacante["modificadores"] and "modificadores" not in defensor
+
+
+def test_bono_defensor_se_rechaza():
+    with pytest.raises(ValueError):
+        preparar({"atacante": "a", "defensor": "d", "bono_defensor": "Daño +1"}, UNIDADES)
+    # Vacío (p. ej. una columna de CSV sin valor) no molesta
+    assert preparar({"atacante": "a", "defensor": "d", "bono_defensor": ""}, UNIDADES)[0] is not None
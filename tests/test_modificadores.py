@@ -0,0 +1,38 @@
+"""Los modificadores de carga dan los mismos números que el arma ajustada a mano, y solo al cargar."""
+
+import pytest
+
+from modificadores import con_bono_carga
+from simulador import combate_media_multiarmas
+
+DEFENSOR = {"id": "d", "name": "D", "base_size": 5, "wounds": 2, "save": 3, "armas": []}
+
+
+def _unidad(**arma):
+    base = {"name": "Espada", "attacks": 2, "to_hit": 3, "to_wound": 4, "rend": 1, "damage_formula": "D3"}
+    return {"id": "a", "name": "A", "base_size": 10, "armas": [dict(base, **arma)]}
+
+
+def _numeros(unidad, carga):
+    total, detalle, _, _ = combate_media_multiarmas(unidad, DEFENSOR, carga=carga)
+    (_, d), = detalle
+    return total, d["heridas_normales"], d["no_salv_normales"], d["heridas_finales_normales"]
+
+
+@pytest.mark.parametrize("unidad, ajustada", [
+    (dict(_unidad(), rend_on_charge=1), _unidad(rend=2)),
+    (con_bono_carga(_unidad(), "Rend -1"), _unidad(rend=2)),
+    (con_bono_carga(_unidad(), "Daño +1"), _unidad(damage_formula="D3+1")),
+    (con_bono_carga(dict(_unidad(), rend_on_charge=1), "Daño +1"), _unidad(rend=2, damage_formula="D3+1")),
+])
+def test_carga_igual_que_arma_ajustada(unidad, ajustada):
+    assert _numeros(unidad, carga=True) == pytest.approx(_numeros(ajustada, carga=False))
+    # Sin cargar, el arma no cambia
+    assert _numeros(unidad, carga=False) == pytest.approx(_numeros(_unidad(), carga=False))
+    assert _numeros(unidad, carga=True)[0] > _numeros(unidad, carga=False)[0]
+
+
+def test_bono_desconocido_no_cambia_la_unidad():
+    unidad = _unidad()
+    assert con_bono_carga(unidad, "") is unidad
+    assert con_bono_carga(unidad, "Ataques +1") is unidad
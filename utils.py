@@ -1,5 +1,5 @@
 import re
-from typing import Union
+from typing import List, Tuple, Union
 
 _dice_term = re.compile(r"\s*([+-]?)\s*(?:(\d*)[dD](\d+)|(\d+))\s*")
 
@@ -57,3 +57,56 @@ def dice_average(expr: Union[str, int, float, None]) -> float:
         if i < len(s) and s[i] in '+-':
             pass
     return total
+
+
+def parsear_formula(expr: Union[str, int, float, None]) -> List[Tuple[int, int, int]]:
+    """
+    Descompone una fórmula de dados en términos (signo, n_dados, caras).
+    Los valores fijos se devuelven con caras=0 y n_dados=valor: '2d6+1' -> [(1, 2, 6), (1, 1, 0)].
+    Lanza ValueError si la fórmula no es válida.
+    """
+    if expr is None:
+        return []
+    if isinstance(expr, (int, float)):
+        return [(1, int(expr), 0)] if expr else []
+    s = str(expr).strip()
+    terminos = []
+    i = 0
+    while i < len(s):
+        m = _dice_term.match(s, i)
+        if not m or m.end() == i:
+            raise ValueError(f"Fórmula de dados no válida: {expr!r}")
+        sign, n_str, faces_str, flat_str = m.groups()
+        sign_mult = -1 if sign == '-' else 1
+        if faces_str:
+            terminos.append((sign_mult, int(n_str) if n_str else 1, int(faces_str)))
+        else:
+            terminos.append((sign_mult, int(flat_str), 0))
+        i = m.end()
+    return terminos
+
+
+def tirar_formula(terminos: List[Tuple[int, int, int]], rng) -> int:
+    """Tira una fórmula ya parseada con `parsear_formula` usando el generador `rng`."""
+    total = 0
+    for sign, n, faces in terminos:
+        if faces:
+            total += sign * sum(rng.randint(1, faces) for _ in range(n))
+        else:
+            total += sign * n
+    return total
+
+
+def formula_texto(terminos: List[Tuple[int, int, int]]) -> str:
+    """Inverso de `parsear_formula`: [(1, 1, 3), (1, 1, 0)] -> 'd3+1'. Suma los valores fijos."""
+    partes = []
+    fijo = 0
+    for sign, n, faces in terminos:
+        if faces:
+            dados = f"{n if n != 1 else ''}d{faces}"
+            partes.append(dados if not partes and sign > 0 else ("-" if sign < 0 else "+") + dados)
+        else:
+            fijo += sign * n
+    if fijo or not partes:
+        partes.append(str(fijo) if not partes else f"{fijo:+d}")
+    return "".join(partes)